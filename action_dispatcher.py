@@ -0,0 +1,207 @@
+from __future__ import annotations
+import asyncio
+import collections
+import time
+import logging
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Callable
+
+LOG = logging.getLogger("DISPATCHER")
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "coalesce")
+
+
+class Dispatcher:
+    """
+        Runs the functions of matched actions in the background, so reading
+        the log never waits on Discord.
+
+        Every action is queued under a key (ie: the player it is about), and
+        every key always goes to the same one of the `workers`, so the actions
+        for one key run one at a time, in the order they were queued. Actions
+        for different keys may run at the same time, and so finish out of
+        order.
+
+        At most `max_queue` actions wait at once. When that is reached, the
+        `overflow` policy decides what happens to the next one:
+            "block": wait for space, which holds up reading the log.
+            "drop_oldest": throw away the action that has waited longest.
+            "coalesce": replace a queued action with the same name and key, if
+                the action is in `coalesce`, since only the newest one matters
+                (ie: server_list). Otherwise wait, like "block".
+
+        An action that raises is logged and does not stop its worker.
+
+        Actions are numbered in the order they are submitted, and finished()
+        says how many of them, counting from the first, are done with (run,
+        failed or dropped), so the caller knows which log lines it will not
+        need to read again.
+    """
+
+    def __init__(self, workers: int = 1, max_queue: int = 1000, overflow: str = "block", coalesce: tuple = (), on_handled: Callable = None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown dispatch overflow policy '{overflow}', expected one of {', '.join(OVERFLOW_POLICIES)}.")
+        if workers < 1 or max_queue < 1:
+            raise ValueError("The dispatcher needs at least one worker and room for at least one action.")
+
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.coalesce = frozenset(coalesce)
+        self.on_handled = on_handled # Called with the action's name and how long it took, after it runs.
+
+        self._queues = [collections.deque() for _ in range(workers)]
+        self._ready = [asyncio.Event() for _ in range(workers)]
+        self._not_full = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = []
+        self._current = [None] * workers # The number of the action each worker is running.
+        self.depth = 0 # Actions waiting.
+        self.running = 0 # Actions being run.
+        self.submitted = 0 # Actions queued so far, and so the number of the next one.
+
+        # Statistics, see report().
+        self.handled = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.waits = 0
+        self.max_depth = 0
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        self._last_report = (time.monotonic(), 0)
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work(i)) for i in range(len(self._queues))]
+
+    async def submit(self, key: str, on_match: Callable, match):
+        """Queue `on_match(match)` to run after the actions already queued under `key`."""
+        i = hash(key) % len(self._queues)
+        queue = self._queues[i]
+
+        if self.depth >= self.max_queue:
+            if self.overflow == "drop_oldest":
+                self._drop_oldest()
+            elif self.overflow == "coalesce" and self._coalesce(queue, key, on_match, match):
+                return
+            else:
+                self.waits += 1
+                while self.depth >= self.max_queue:
+                    self._not_full.clear()
+                    await self._not_full.wait()
+
+        queue.append((time.perf_counter(), key, on_match, match, self.submitted))
+        self.submitted += 1
+        self.depth += 1
+        if self.depth > self.max_depth:
+            self.max_depth = self.depth
+        self._idle.clear()
+        self._ready[i].set()
+
+    def _drop_oldest(self):
+        queue = min((queue for queue in self._queues if queue), key=lambda queue: queue[0][0])
+        _, key, on_match, _, _ = queue.popleft()
+        self.depth -= 1
+        self.dropped += 1
+        LOG.debug(f"Dispatch queue is full, dropped '{on_match.__name__}' for {key}.")
+
+    def _coalesce(self, queue: collections.deque, key: str, on_match: Callable, match):
+        if on_match.__name__ not in self.coalesce:
+            return False
+
+        for i, (enqueued, queued_key, queued, _, number) in enumerate(queue):
+            if queued_key == key and queued.__name__ == on_match.__name__:
+                # Keeps its place in the queue, the time it was first queued at and its number.
+                queue[i] = (enqueued, key, on_match, match, number)
+                self.coalesced += 1
+                return True
+        return False
+
+    async def _work(self, i: int):
+        queue = self._queues[i]
+        ready = self._ready[i]
+        clock = time.perf_counter
+        while True:
+            if not queue:
+                ready.clear()
+                await ready.wait()
+                continue
+
+            enqueued, key, on_match, match, number = queue.popleft()
+            self._current[i] = number
+            self.depth -= 1
+            self.running += 1
+            self._not_full.set()
+
+            start = clock()
+            lag = start - enqueued
+            self._lag_total += lag
+            if lag > self._lag_max:
+                self._lag_max = lag
+
+            try:
+                await on_match(match)
+                if self.on_handled:
+                    self.on_handled(on_match.__name__, clock() - start)
+            except Exception as e:
+                self.failed += 1
+                LOG.error(f"Action '{on_match.__name__}' for {key} failed.")
+                LOG.exception(e)
+            finally:
+                self.handled += 1
+                self.running -= 1
+                if not self.depth and not self.running:
+                    self._idle.set()
+            # Not reached when the worker is cancelled part way through, so that action is not finished.
+            self._current[i] = None
+
+    def finished(self):
+        """The number of the oldest action which has not finished, or `submitted` if they all have."""
+        oldest = self.submitted
+        for queue, current in zip(self._queues, self._current):
+            # Each queue is in the order its actions were submitted.
+            if queue and queue[0][4] < oldest:
+                oldest = queue[0][4]
+            if current is not None and current < oldest:
+                oldest = current
+        return oldest
+
+    async def join(self):
+        """Wait until every queued action has run."""
+        await self._idle.wait()
+
+    async def close(self, timeout: float = 0):
+        """Stop the workers, after giving the queued actions up to `timeout` seconds to run."""
+        if timeout and self._tasks:
+            try:
+                await asyncio.wait_for(self.join(), timeout)
+            except asyncio.TimeoutError:
+                LOG.warning(f"Gave up on {self.running} running and {self.depth} queued actions.")
+
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def report(self):
+        """Return a summary of the dispatcher's activity since the last report."""
+        now = time.monotonic()
+        last_now, last_handled = self._last_report
+        handled = self.handled - last_handled
+        self._last_report = (now, self.handled)
+
+        lag_average = self._lag_total / handled if handled else 0.0
+        lag_max = self._lag_max
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        max_depth = self.max_depth
+        self.max_depth = self.depth
+
+        return (
+            f"Dispatcher: {handled / max(now - last_now, 1e-9):.2f} actions/s, "
+            f"queue depth {self.depth} (max {max_depth} of {self.max_queue}), "
+            f"lag avg {lag_average * 1000:.1f}ms max {lag_max * 1000:.1f}ms, "
+            f"{self.failed} failed, {self.dropped} dropped, {self.coalesced} coalesced, {self.waits} waits for space in total."
+        )
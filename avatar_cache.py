@@ -0,0 +1,193 @@
+from __future__ import annotations
+import collections
+import json
+import os
+import time
+import logging
+
+LOG = logging.getLogger("AVATAR_CACHE")
+
+# Returned by AvatarCache.get() for names which are not cached (or have expired).
+MISSING = object()
+
+
+class AvatarCache:
+    """
+        Remembers the UUIDs of players, so their avatar url can be built
+        without asking the Mojang API for every message.
+
+        Names which could not be looked up (ie: offline mode or renamed
+        accounts) are remembered too, as a UUID of None, but only for
+        `negative_ttl` seconds instead of `ttl`. At most `max_entries` names
+        are kept, the least recently used one is forgotten first.
+
+        The cache is saved to `path` (if set) as a compact JSON list of
+        [name, uuid, expiry time] at most once every `save_interval` seconds,
+        and read back the first time it is used.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1000, ttl: float = 7 * 24 * 60 * 60, negative_ttl: float = 15 * 60, save_interval: float = 60):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.save_interval = save_interval
+
+        self._entries = collections.OrderedDict() # Lowercase name -> (expiry time, uuid or None), least recently used first.
+        self._loaded = False
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+        # Statistics, see report().
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def _load(self):
+        self._loaded = True
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            LOG.warning(f"Failed to load the avatar cache: {e}")
+            return
+
+        now = time.time()
+        for name, uuid, expires in entries[-self.max_entries:]:
+            if expires > now:
+                self._entries[name] = (expires, uuid or None)
+        LOG.info(f"Loaded {len(self._entries)} cached player UUIDs.")
+
+    def get(self, name: str):
+        """Return the cached UUID for a name, None if it is known not to have one, or MISSING."""
+        if not self._loaded:
+            self._load()
+
+        key = name.lower()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        if entry[0] <= time.time():
+            del self._entries[key]
+            self.expired += 1
+            self.misses += 1
+            return MISSING
+
+        self._entries.move_to_end(key)
+        if entry[1] is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return entry[1]
+
+    def put(self, name: str, uuid: str):
+        """Remember a name's UUID, or that it does not have one if uuid is None."""
+        if not self._loaded:
+            self._load()
+
+        key = name.lower()
+        self._entries[key] = (time.time() + (self.ttl if uuid else self.negative_ttl), uuid)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        self._dirty = True
+        self.save()
+
+    def save(self, force: bool = False):
+        now = time.monotonic()
+        if not self.path or not self._dirty or (not force and now - self._last_save < self.save_interval):
+            return
+
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump([[name, uuid or "", int(expires)] for name, (expires, uuid) in self._entries.items()], f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            LOG.warning(f"Failed to save the avatar cache: {e}")
+            return
+
+        self._dirty = False
+        self._last_save = now
+
+    def report(self):
+        """Return a summary of the cache's activity."""
+        lookups = self.hits + self.negative_hits + self.misses
+        rate = (self.hits + self.negative_hits) / lookups * 100 if lookups else 0.0
+        return (
+            f"Avatar cache: {len(self._entries)} of {self.max_entries} names, {rate:.0f}% hit rate "
+            f"({self.hits} hits, {self.negative_hits} not found hits, {self.misses} misses), {self.expired} expired, {self.evictions} evicted."
+        )
+
+
+class UserCache:
+    """
+        Looks up the UUIDs of players in the server's usercache.json, which
+        has every player who has joined recently, so most of them never need
+        to be asked about over the network.
+
+        The server rewrites the whole file rather than appending to it, so it
+        is read again whenever its mtime or size changes, checked at most
+        once every `check_interval` seconds.
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._uuids = dict() # Lowercase name -> UUID without dashes.
+        self._stat = None
+        self._last_check = 0.0
+
+        # Statistics, see report().
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _check(self):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self._uuids = dict()
+            self._stat = None
+            return
+        if (st.st_mtime_ns, st.st_size) == self._stat:
+            return
+
+        try:
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+            self._uuids = {entry["name"].lower(): entry["uuid"].replace("-", "") for entry in entries}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # Most likely caught half way through being written, try again next time.
+            LOG.warning(f"Failed to read {self.path}: {e!r}")
+            return
+        self._stat = (st.st_mtime_ns, st.st_size)
+        self.reloads += 1
+
+    def get(self, name: str):
+        """Return the UUID of a player, or None if they are not in the usercache."""
+        self._check()
+        uuid = self._uuids.get(name.lower())
+        if uuid:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return uuid
+
+    def report(self):
+        """Return a summary of the usercache's activity."""
+        return f"Usercache: {len(self._uuids)} names, {self.hits} hits, {self.misses} misses, read {self.reloads} times."
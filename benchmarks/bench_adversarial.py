@@ -0,0 +1,108 @@
+"""
+    Stress test for regexes which backtrack catastrophically on player chat.
+
+    Swaps player_message_noreply for a regex with nested repeats, then mixes
+    crafted chat lines (a long word followed by a character the regex cannot
+    match, so every way of splitting the word up is tried) into the corpus,
+    and checks them with each regex backend under the time budget.
+
+    For each backend this reports the slowest line, the total time spent on
+    the crafted lines, and what got quarantined. It fails if any line took
+    longer than the budget (plus STOP_MARGIN for stopping the worker process
+    which runs the regex with re), or if any other line matches a different
+    action than it does without a budget using re.
+
+    Usage: python -m benchmarks.bench_adversarial [--length N] [--attacks N] [--budget S] [--strikes N]
+"""
+import argparse
+import time
+
+from benchmarks.common import REGEXES, PREFIX, load_corpus, build_action_list
+
+import webhook_actions
+from webhook_actions import backtracking_risk
+
+# Looks reasonable, but "(?:\w+\s?)*" can split a word up in 2^n ways, so any message ending in punctuation is slow.
+EVIL_REGEX = PREFIX + r"<(\w+)> ((?:\w+\s?)*)$"
+
+# How much longer than the budget a line may take, for killing the worker process and logging what happened.
+STOP_MARGIN = 0.025
+
+
+def attack_line(length: int):
+    return "[14:04:14] [Server thread/INFO] [minecraft/DedicatedServer]: <Steve> " + "a" * length + "!\n"
+
+
+def run(backend: str, lines: list, expected: dict, budget: float, strikes: int):
+    actions = build_action_list(dict(REGEXES, player_message_noreply=EVIL_REGEX), backend=backend, time_budget=budget, strikes=strikes)
+
+    worst = 0
+    attack_time = 0
+    mismatches = 0
+    for line, is_attack in lines:
+        start = time.perf_counter()
+        match = actions.check(line)
+        elapsed = time.perf_counter() - start
+        worst = max(worst, elapsed)
+
+        if is_attack:
+            attack_time += elapsed
+            continue
+
+        # Lines for a quarantined action are expected to not match anymore.
+        name = match[1].__name__ if match else None
+        if name != expected[line] and expected[line] not in actions.quarantined():
+            mismatches += 1
+
+    engines = ", ".join(sorted(set(entry.engine for entry in actions.entries.values())))
+    print(
+        f"{backend:>5} ({engines}{', guarded' if actions.guard else ''}): slowest line {worst * 1e3:,.1f}ms, {attack_time * 1e3:,.1f}ms on crafted lines, "
+        f"quarantined: {', '.join(actions.quarantined()) or 'nothing'}, combined regex {'used' if actions._get_matcher().combined else 'not used'}, "
+        f"{mismatches} mismatched lines"
+    )
+    actions.close()
+    return worst, mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--length", type=int, default=20, help="Length of the word in the crafted lines, every extra character doubles the time re takes.")
+    parser.add_argument("--attacks", type=int, default=10, help="How many crafted lines to send.")
+    parser.add_argument("--repeat", type=int, default=20, help="How many times to replay the corpus around them.")
+    parser.add_argument("--budget", type=float, default=0.05, help="Time budget per regex per line, in seconds.")
+    parser.add_argument("--strikes", type=int, default=2, help="Overruns before a regex is quarantined.")
+    args = parser.parse_args()
+
+    print(f"Regex: {EVIL_REGEX}")
+    print(f"Static check: {backtracking_risk(EVIL_REGEX) or 'nothing found'}")
+
+    corpus = [(line, False) for line in load_corpus()] * args.repeat
+    step = max(1, len(corpus) // args.attacks)
+    lines = []
+    for i in range(0, len(corpus), step):
+        lines.extend(corpus[i:i + step])
+        if i // step < args.attacks:
+            lines.append((attack_line(args.length), True))
+    print(f"{len(lines):,} lines, {args.attacks} crafted, word length {args.length}, budget {args.budget * 1e3:.0f}ms, {args.strikes} strikes.")
+
+    # What every normal line should match, worked out once per distinct line since some of them are slow.
+    reference = build_action_list(dict(REGEXES, player_message_noreply=EVIL_REGEX))
+    expected = {}
+    for line in load_corpus():
+        match = reference.check(line)
+        expected[line] = match[1].__name__ if match else None
+
+    failed = False
+    for backend in ("re", "auto", "re2"):
+        if backend != "re" and not webhook_actions.re2:
+            print(f"{backend:>5}: skipped, re2 is not installed.")
+            continue
+        worst, mismatches = run(backend, lines, expected, args.budget, args.strikes)
+        failed |= mismatches > 0 or worst > args.budget + STOP_MARGIN
+
+    if failed:
+        raise SystemExit("Failed: a line matched the wrong action, or took longer than the budget.")
+
+
+if __name__ == "__main__":
+    main()
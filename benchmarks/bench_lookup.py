@@ -0,0 +1,177 @@
+"""
+    Times the first message from a new player, which has to look up their
+    UUID for the avatar before it can be queued, against a local stub of the
+    Mojang API. Compares a new ClientSession per lookup (how Bridge used to
+    do it) with Bridge's shared session, which keeps the connection open.
+
+    Then replays a rejoin storm: --joins players join (which prefetches
+    their avatars, batched into bulk lookups) and then each says something,
+    and a few messages from one new player arrive at once, which should
+    share a single lookup. Reports the requests the stub got and the time
+    to queue each first message.
+
+    The stub is served over TLS with a throwaway self-signed certificate
+    (made with the openssl command) so handshakes are counted like they are
+    against the real API, or over plain HTTP if openssl is not available or
+    --plain is given. It is still local, so the gap is smaller than it is
+    over the internet, where every new connection is a few round trips more.
+
+    Usage: python -m benchmarks.bench_lookup [--players N] [--joins N] [--latency S] [--plain]
+"""
+import argparse
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# aiohttp builds its default SSL context when it is imported, so the stub's certificate has to be trusted before that.
+CERT_DIRECTORY = tempfile.mkdtemp()
+CERT = os.path.join(CERT_DIRECTORY, "cert.pem")
+KEY = os.path.join(CERT_DIRECTORY, "key.pem")
+USE_TLS = "--plain" not in sys.argv and shutil.which("openssl") and subprocess.run(
+    ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+     "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", KEY, "-out", CERT],
+    capture_output=True,
+).returncode == 0
+if USE_TLS:
+    os.environ["SSL_CERT_FILE"] = CERT
+
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+
+import benchmarks.common # Makes the bot's modules importable.
+import config
+
+
+# Requests the stub got, by endpoint.
+REQUESTS = dict(single=0, bulk=0)
+
+
+def fake_uuid(name: str):
+    return f"{abs(hash(name)):032x}"[:32]
+
+
+async def start_stub(latency: float):
+    async def profile(request: web.Request):
+        REQUESTS["single"] += 1
+        await asyncio.sleep(latency)
+        name = request.match_info["name"]
+        return web.json_response({"id": fake_uuid(name), "name": name})
+
+    async def bulk(request: web.Request):
+        REQUESTS["bulk"] += 1
+        await asyncio.sleep(latency)
+        return web.json_response([{"id": fake_uuid(name), "name": name} for name in await request.json()])
+
+    app = web.Application()
+    app.router.add_get("/users/profiles/minecraft/{name}", profile)
+    app.router.add_post("/profiles/bulk", bulk)
+    runner = web.AppRunner(app)
+    await runner.setup()
+
+    context = None
+    if USE_TLS:
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(CERT, KEY)
+    site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=context)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"{'https' if USE_TLS else 'http'}://127.0.0.1:{port}/users/profiles/minecraft/"
+
+
+async def lookup_new_session(name: str):
+    # What Bridge.__send_player_message used to do for a player it had not seen.
+    async with aiohttp.ClientSession() as session:
+        async with session.get(config.icons["uuid_lookup_url"] + name) as response:
+            await response.json()
+
+
+async def run(args):
+    runner, url = await start_stub(args.latency)
+    config.icons["uuid_lookup_url"] = url
+    config.webhook["spool_location"] = ""
+    config.icons["avatar_cache_location"] = None
+    config.icons["use_usercache"] = False
+
+    from webhook_bridge import Bridge, make_session
+
+    results = dict()
+    async with make_session() as session:
+        bridge = Bridge(session, "http://127.0.0.1:1/unused")
+        bridge.scheduler.send = lambda priority, payload: None
+
+        for name in ("new session", "shared session"):
+            times = []
+            for i in range(args.players):
+                player = f"{name.split()[0]}{i}"
+                start = time.perf_counter()
+                if name == "new session":
+                    await lookup_new_session(player)
+                else:
+                    await bridge.on_player_message_noreply(player, "hello")
+                times.append(time.perf_counter() - start)
+            results[name] = times
+
+        if len(bridge.avatar_cache._entries) != args.players:
+            raise SystemExit("Failed: the shared session did not look up every player.")
+
+        print(f"{args.players} new players, {'TLS' if USE_TLS else 'plain HTTP'}, stub answers in {args.latency * 1e3:.0f}ms.")
+        for name, times in results.items():
+            report(name, times)
+
+        # A rejoin storm, with the avatars prefetched in bulk when the players join.
+        config.icons["uuid_bulk_lookup_url"] = url.replace("/users/profiles/minecraft/", "/profiles/bulk")
+        bridge = Bridge(session, "http://127.0.0.1:1/unused")
+        bridge.scheduler.send = lambda priority, payload: None
+        REQUESTS.update(single=0, bulk=0)
+
+        players = [f"joiner{i}" for i in range(args.joins)]
+        for player in players:
+            bridge.prefetch_avatar(player)
+        await asyncio.sleep(config.icons["uuid_lookup_batch_window"] + args.latency + 0.1)
+        times = []
+        for player in players:
+            start = time.perf_counter()
+            await bridge.on_player_message_noreply(player, "I'm back")
+            times.append(time.perf_counter() - start)
+        storm = dict(REQUESTS)
+
+        # Several messages from a player nobody has looked up yet, all at once.
+        REQUESTS.update(single=0, bulk=0)
+        await asyncio.gather(*(bridge.on_player_message_noreply("newcomer", f"message {i}") for i in range(5)))
+        burst = dict(REQUESTS)
+
+    await runner.cleanup()
+
+    print(f"Rejoin storm: {args.joins} players joined, {storm['bulk']} bulk and {storm['single']} single requests.")
+    report("after joining", times)
+    print(f"5 messages at once from a new player: {burst['single'] + burst['bulk']} request(s). {bridge.uuid_lookup.report()}")
+    if storm["single"] or storm["bulk"] > -(-args.joins // 10) or burst["single"] + burst["bulk"] != 1:
+        raise SystemExit("Failed: the lookups were not batched or shared.")
+
+
+def report(name: str, times: list):
+    times.sort()
+    print(f"{name:>15}: first message p50 {statistics.median(times) * 1e3:.2f}ms p99 {times[int(len(times) * 0.99)] * 1e3:.2f}ms, fastest {times[0] * 1e3:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=200, help="How many new players send a message.")
+    parser.add_argument("--joins", type=int, default=30, help="How many players rejoin at once.")
+    parser.add_argument("--latency", type=float, default=0.0, help="How long the stub takes to answer, in seconds.")
+    parser.add_argument("--plain", action="store_true", help="Serve the stub over plain HTTP instead of TLS.")
+    try:
+        asyncio.run(run(parser.parse_args()))
+    finally:
+        shutil.rmtree(CERT_DIRECTORY, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+    Compares action_list.check against checking every regex one by one (how
+    action_list used to work), using the log corpus and realistic regexes.
+    Also times splitting the prefix off every line and matching only the
+    message (config.webhook["match_message_only"]).
+
+    Usage: python -m benchmarks.bench_matcher [--repeat N]
+"""
+import argparse
+import re
+import time
+
+from benchmarks.common import REGEXES, MESSAGE_REGEXES, ACTION_ORDER, load_corpus, build_action_list
+from log_line import LogLine
+
+
+def per_regex_check(order, input: str):
+    # The old behaviour: search every regex string in order, through re's cache.
+    for names in order:
+        for name in names:
+            if re.search(REGEXES[name], input):
+                return name
+    return None
+
+
+def run(name: str, check, lines: list):
+    start = time.perf_counter()
+    for line in lines:
+        check(line)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>16}: {len(lines) / elapsed:>12,.0f} lines/s ({elapsed * 1e6 / len(lines):.2f} us/line)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=500, help="How many times to replay the corpus.")
+    args = parser.parse_args()
+
+    lines = load_corpus() * args.repeat
+    order = [entry if isinstance(entry, list) else [entry] for entry in ACTION_ORDER]
+    actions = build_action_list()
+
+    # Both have to agree on every line for the comparison to mean anything.
+    for line in load_corpus():
+        match = actions.check(line)
+        assert (match[1].__name__ if match else None) == per_regex_check(order, line), line
+
+    print(f"{len(lines):,} lines, {sum(len(names) for names in order)} regexes.")
+    old = run("per-regex loop", lambda line: per_regex_check(order, line), lines)
+    new = run("action_list", actions.check, lines)
+    print(f"Speedup: {old / new:.2f}x")
+
+    message_actions = build_action_list(MESSAGE_REGEXES)
+    def check_message(line):
+        parsed = LogLine(line)
+        return message_actions.check(parsed.message, parsed)
+
+    run("parse only", LogLine, lines)
+    message = run("parse + message", check_message, lines)
+    print(f"Speedup of matching messages only: {new / message:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
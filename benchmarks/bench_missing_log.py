@@ -0,0 +1,106 @@
+"""
+    Checks that waiting for a log which does not exist yet (ie: the bot
+    started before the server) does not hold up the event loop.
+
+    LogTailer.open() is started on a missing latest.log while another task
+    ticks every --tick seconds, recording how late each tick is. After
+    --wait seconds the log is created with a few lines, and the tailer has
+    to open it and return them. Fails if a tick was more than --max-late
+    seconds late, or the lines do not come back.
+
+    Runs once with inotify (where available) and once polling, like on a
+    system without it.
+
+    Usage: python -m benchmarks.bench_missing_log [--wait S] [--tick S] [--max-late S] [--poll-interval S]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import benchmarks.common # Makes the bot's modules importable.
+import log_tailer
+from log_tailer import LogTailer, LogWatcher
+
+LINES = [f"[12:00:{i:02d}] [Server thread/INFO]: line {i}\n" for i in range(5)]
+
+
+async def tick(interval: float, lateness: list, stop: asyncio.Event):
+    expected = time.monotonic() + interval
+    while not stop.is_set():
+        await asyncio.sleep(max(0, expected - time.monotonic()))
+        lateness.append(time.monotonic() - expected)
+        expected += interval
+
+
+async def run(args, inotify: bool):
+    libc = log_tailer._libc
+    if not inotify:
+        log_tailer._libc = None
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "latest.log")
+            watcher = LogWatcher(path, args.poll_interval)
+            watcher.start()
+            tailer = LogTailer(path, watcher, 1000)
+
+            async def open_and_read():
+                await tailer.open()
+                return await tailer.read_batch()
+
+            lateness = []
+            stop = asyncio.Event()
+            ticker = asyncio.create_task(tick(args.tick, lateness, stop))
+            reader = asyncio.create_task(open_and_read())
+
+            await asyncio.sleep(args.wait)
+            if reader.done():
+                raise SystemExit(f"Failed: the tailer finished before the log existed ({reader.result()!r}).")
+
+            created = time.monotonic()
+            with open(path, "w", encoding="utf-8") as f:
+                f.writelines(LINES)
+            try:
+                lines = await asyncio.wait_for(reader, args.poll_interval + 2 * log_tailer.REARM_INTERVAL)
+            except asyncio.TimeoutError:
+                raise SystemExit("Failed: the tailer did not pick up the log once it was created.")
+            picked_up = time.monotonic() - created
+
+            stop.set()
+            await ticker
+            tailer.file.close()
+            mode = watcher.mode
+            watcher.close()
+    finally:
+        log_tailer._libc = libc
+
+    lateness.sort()
+    worst = lateness[-1]
+    print(
+        f"{mode:>8}: {len(lateness)} ticks while waiting, late by p50 {statistics.median(lateness) * 1e3:.2f}ms "
+        f"p99 {lateness[int(len(lateness) * 0.99)] * 1e3:.2f}ms max {worst * 1e3:.2f}ms; "
+        f"log picked up {picked_up * 1e3:.1f}ms after it was created."
+    )
+    if lines != LINES:
+        raise SystemExit(f"Failed: expected {len(LINES)} lines from the new log, got {lines!r}.")
+    if worst > args.max_late:
+        raise SystemExit(f"Failed: a tick was {worst * 1e3:.1f}ms late, waiting for the log held up the event loop.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--wait", type=float, default=1.0, help="How long the log is missing for, in seconds.")
+    parser.add_argument("--tick", type=float, default=0.01, help="How often the other task ticks, in seconds.")
+    parser.add_argument("--max-late", type=float, default=0.05, help="How late a tick may be, in seconds.")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="The watcher's poll interval, in seconds.")
+    args = parser.parse_args()
+
+    for inotify in (True, False):
+        asyncio.run(run(args, inotify))
+
+
+if __name__ == "__main__":
+    main()
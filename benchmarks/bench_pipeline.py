@@ -0,0 +1,198 @@
+"""
+    Replays the log corpus through WebhookCog's line handling, with the
+    actions from WebhookCog.setup_actions and a stub Bridge, so the whole log
+    pipeline can be measured without a server or Discord.
+
+    Lines are fed in batches like the log tailer does, either as fast as
+    possible or at fixed rates. Reports throughput, latency from a line being
+    read to its action finishing (p50/p99/max), and memory use. The actions
+    run through the dispatcher, set up from config.webhook like the bot does.
+
+    Usage: python -m benchmarks.bench_pipeline [--rate N ...] [--duration S] [--repeat N] [--handler-delay S]
+"""
+import argparse
+import asyncio
+import collections
+import statistics
+import time
+import tracemalloc
+import types
+
+from benchmarks.common import REGEXES, load_corpus
+
+import config
+from cogs.webhook import WebhookCog
+
+
+class StubBridge:
+    """Stands in for webhook_bridge.Bridge, counting calls instead of sending anything."""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.calls = collections.Counter()
+
+    def __getattr__(self, name: str):
+        if not name.startswith("on_"):
+            raise AttributeError(name)
+
+        async def send(*args):
+            self.calls[name] += 1
+            if self.delay:
+                await asyncio.sleep(self.delay) # Pretend to wait for Discord.
+        return send
+
+    def prefetch_avatar(self, username: str):
+        self.calls["prefetch_avatar"] += 1
+
+
+class StubChannel:
+    async def fetch_message(self, id: int):
+        author = types.SimpleNamespace(display_name="someone", id=1234)
+        return types.SimpleNamespace(author=author, content="The message being replied to.")
+
+
+def setup_cog(bridge: StubBridge):
+    # Use the same regexes as the matcher benchmark, whatever is in the local config.
+    config.webhook["regex"].update(REGEXES)
+    for name in config.webhook["actions_enabled"]:
+        config.webhook["actions_enabled"][name] = True
+
+    bot = types.SimpleNamespace(bridge=bridge, bridge_channel=StubChannel(), list_command_triggered=True)
+    cog = WebhookCog(bot)
+    cog.action_list = cog.setup_actions(bridge)
+    return cog
+
+
+def time_actions(cog: WebhookCog, arrivals: collections.deque, latencies: list):
+    """
+        Wrap action_list.check so every action that runs records how long
+        after its line was read it finished. Lines are checked in order, so
+        the arrival times are taken from the front of `arrivals`.
+    """
+    check = cog.action_list.check
+
+    def timed_check(line: str, parsed=None):
+        arrived = arrivals.popleft()
+        match = check(line, parsed)
+        if not match:
+            return None
+
+        on_match = match[1]
+        async def timed(m):
+            await on_match(m)
+            latencies.append(time.perf_counter() - arrived)
+        timed.__name__ = on_match.__name__
+        return match[0], timed
+
+    cog.action_list.check = timed_check
+
+
+async def run_max(cog: WebhookCog, lines: list, arrivals: collections.deque, batch: int):
+    for i in range(0, len(lines), batch):
+        lines_batch = lines[i:i + batch]
+        now = time.perf_counter()
+        arrivals.extend(now for _ in lines_batch)
+        await cog.handle_lines(lines_batch)
+        await asyncio.sleep(0)
+
+
+async def run_rate(cog: WebhookCog, lines: list, arrivals: collections.deque, batch: int, rate: float):
+    start = time.perf_counter()
+    i = 0
+    while i < len(lines):
+        elapsed = time.perf_counter() - start
+        due = min(len(lines), int(elapsed * rate) + 1, i + batch)
+        if due <= i:
+            # Sleep until the next line is "written".
+            await asyncio.sleep(i / rate - elapsed)
+            continue
+
+        arrivals.extend(start + n / rate for n in range(i, due))
+        await cog.handle_lines(lines[i:due])
+        i = due
+        await asyncio.sleep(0)
+
+
+def percentile(values: list, p: float):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(name: str, lines: int, elapsed: float, read: float, latencies: list):
+    latencies.sort()
+    if latencies:
+        latency = (
+            f"p50 {percentile(latencies, 0.5) * 1e3:.3f}ms, p99 {percentile(latencies, 0.99) * 1e3:.3f}ms, "
+            f"max {latencies[-1] * 1e3:.3f}ms, mean {statistics.fmean(latencies) * 1e3:.3f}ms"
+        )
+    else:
+        latency = "no actions ran"
+    print(f"{name:>14}: {lines / elapsed:>10,.0f} lines/s over {elapsed:.2f}s (all read after {read:.2f}s), {len(latencies):,} actions; {latency}")
+
+
+def run(mode, cog: WebhookCog, lines: list, batch: int, rate: float = None):
+    arrivals = collections.deque()
+    latencies = []
+    check = cog.action_list.check
+    time_actions(cog, arrivals, latencies)
+
+    read = []
+    async def replay():
+        cog.dispatcher = cog.setup_dispatcher()
+        cog.dispatcher.start()
+        if rate:
+            await mode(cog, lines, arrivals, batch, rate)
+        else:
+            await mode(cog, lines, arrivals, batch)
+        read.append(time.perf_counter() - start)
+        await cog.dispatcher.join()
+        await cog.dispatcher.close()
+
+    start = time.perf_counter()
+    asyncio.run(replay())
+    elapsed = time.perf_counter() - start
+
+    cog.action_list.check = check
+    return elapsed, read[0], latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=500, help="How many times to replay the corpus as fast as possible.")
+    parser.add_argument("--rate", type=float, action="append", help="Lines per second to replay at, can be given more than once.")
+    parser.add_argument("--duration", type=float, default=5, help="How long to replay at each rate, in seconds.")
+    parser.add_argument("--batch", type=int, default=config.webhook["max_batch_lines"], help="Most lines handled at once.")
+    parser.add_argument("--handler-delay", type=float, default=0, help="Seconds each Bridge call takes, to simulate a slow Discord.")
+    parser.add_argument("--workers", type=int, default=config.webhook["dispatch_workers"], help="Dispatcher workers.")
+    args = parser.parse_args()
+    config.webhook["dispatch_workers"] = args.workers
+
+    corpus = load_corpus()
+    bridge = StubBridge(args.handler_delay)
+    cog = setup_cog(bridge)
+
+    print(f"{len(corpus)} corpus lines, batches of {args.batch}, handler delay {args.handler_delay * 1e3:.1f}ms, {args.workers} workers.")
+
+    lines = corpus * args.repeat
+    report("max", len(lines), *run(run_max, cog, lines, args.batch))
+
+    for rate in args.rate or [1000, 10000]:
+        count = int(rate * args.duration)
+        lines = (corpus * (count // len(corpus) + 1))[:count]
+        report(f"{rate:,.0f}/s", len(lines), *run(run_rate, cog, lines, args.batch, rate))
+
+    # Measured separately, tracemalloc slows everything down a lot.
+    lines = corpus * max(1, args.repeat // 10)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    run(run_max, cog, lines, args.batch)
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(f"{'memory':>14}: peak {peak / 1024:,.1f} KiB while replaying {len(lines):,} lines, {retained / 1024:,.1f} KiB retained after.")
+
+    print("Bridge calls: " + ", ".join(f"{name} {count:,}" for name, count in sorted(bridge.calls.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+    Checks that reloading the webhook cog (ie: with Jishaku) neither sends a
+    line's message twice nor loses one.
+
+    A WebhookCog tails a temporary latest.log and posts to a local fake
+    webhook, which takes --latency seconds to answer so messages are still
+    in flight when the cog is unloaded. --lines console messages are logged,
+    the cog is unloaded part way through sending them, more are logged
+    while no cog is loaded, and a new cog is loaded to pick up from the
+    log checkpoint and the spool, like a reload does. Fails if a message
+    was not delivered exactly once, the spool still has messages in it, or
+    the checkpoint is not at the end of the log.
+
+    Usage: python -m benchmarks.bench_reload [--lines N] [--latency S] [--unload-after S] [--timeout S]
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import re
+import tempfile
+import time
+import types
+
+from benchmarks.bench_webhook import FakeWebhook, start_server
+from benchmarks.common import REGEXES
+
+import config
+from cogs.webhook import WebhookCog
+from webhook_spool import Spool
+
+
+def log(path: str, messages: range):
+    with open(path, "a", encoding="utf-8") as f:
+        for i in messages:
+            f.write(f"[12:00:00] [Server thread/INFO]: [Server] message {i}\n")
+
+
+def delivered(fake: FakeWebhook):
+    """How many times each message was delivered, chat coalescing may have joined several into one post."""
+    counts = collections.Counter()
+    for _, payload in fake.delivered:
+        counts.update(re.findall(r"message (\d+)", payload.get("content", "")))
+    return counts
+
+
+async def wait_for(condition, timeout: float):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+async def run(args):
+    fake = FakeWebhook(1000, 1, args.latency)
+    runner, url = await start_server(fake)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "latest.log")
+        open(path, "w").close()
+
+        config.webhook.update(
+            url=url,
+            latest_log_location=path,
+            log_poll_interval=0.05,
+            log_checkpoint_location=os.path.join(directory, "log_checkpoint.json"),
+            spool_location=os.path.join(directory, "webhook_spool"),
+            log_stats_interval=0,
+            reload_actions_on_change=False,
+        )
+        config.webhook["regex"].update(REGEXES)
+        config.webhook["actions_enabled"]["console_message"] = True
+        config.icons.update(use_usercache=False, avatar_cache_location=os.path.join(directory, "avatar_cache.json"))
+
+        bot = types.SimpleNamespace(loop=asyncio.get_running_loop(), list_command_triggered=True)
+        half = args.lines // 2
+
+        old = WebhookCog(bot)
+        await old.cog_load()
+        await asyncio.sleep(0.3) # Let it open the log and skip to its end, there is no checkpoint yet.
+
+        log(path, range(half))
+        await asyncio.sleep(args.unload_after)
+        in_flight = half - sum(delivered(fake).values())
+        start = time.monotonic()
+        await old.cog_unload()
+        unloaded = time.monotonic() - start
+
+        log(path, range(half, args.lines))
+        new = WebhookCog(bot)
+        await new.cog_load()
+        finished = await wait_for(lambda: len(delivered(fake)) >= args.lines, args.timeout)
+        await asyncio.sleep(args.latency * 4) # Any duplicates would arrive about now.
+        await new.cog_unload()
+
+        await runner.cleanup()
+        counts = delivered(fake)
+        spool = Spool(config.webhook["spool_location"])
+        left = len(spool.load())
+        await spool.close()
+        with open(config.webhook["log_checkpoint_location"]) as f:
+            offset = json.load(f)["offset"]
+        size = os.path.getsize(path)
+
+    print(
+        f"{in_flight} of {half} messages not yet delivered when the first cog was unloaded, which took {unloaded * 1e3:.0f}ms. "
+        f"{len(counts)} of {args.lines} messages delivered, {sum(counts.values()) - len(counts)} duplicates, "
+        f"{left} left in the spool, checkpoint at {offset} of {size} bytes."
+    )
+    duplicates = sorted((int(i) for i, count in counts.items() if count > 1))
+    if duplicates:
+        raise SystemExit(f"Failed: messages {duplicates} were delivered more than once.")
+    if not finished:
+        missing = sorted(set(range(args.lines)) - {int(i) for i in counts})
+        raise SystemExit(f"Failed: messages {missing} were never delivered.")
+    if left:
+        raise SystemExit(f"Failed: {left} messages were left in the spool.")
+    if offset != size:
+        raise SystemExit(f"Failed: the checkpoint is at {offset} bytes, not at the end of the log ({size} bytes).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=40, help="How many messages to log.")
+    parser.add_argument("--latency", type=float, default=0.05, help="How long the fake webhook takes to answer, in seconds.")
+    parser.add_argument("--unload-after", type=float, default=0.2, help="How long after logging the first half to unload the cog, in seconds.")
+    parser.add_argument("--timeout", type=float, default=10.0, help="How long to wait for everything to be delivered, in seconds.")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+    Measures what the webhook spool costs, by sending messages at a steady
+    rate through a WebhookPool to a local fake webhook with and without a
+    spool, and reporting the time spent queueing each message and the time
+    from queueing to delivery.
+
+    Also checks that messages which were never acked come back, in order,
+    when the spool is loaded again, and that fully acked segments are
+    removed.
+
+    Usage: python -m benchmarks.bench_spool [--rate N] [--seconds S] [--flush-interval S]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.bench_webhook import FakeWebhook, start_server
+from webhook_scheduler import WebhookPool, PRIORITY_CHAT
+from webhook_spool import Spool
+
+
+def percentile(values: list, fraction: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def send_steady(session: aiohttp.ClientSession, url: str, rate: float, seconds: float, spool: Spool):
+    pool = WebhookPool(session, url, ((rate * 2, 1),), spool=spool)
+    scheduler = pool.schedulers[0]
+    queue_times = []
+    latencies = []
+
+    post = scheduler._post
+    async def timed_post(priority, job):
+        sent_before = scheduler.sent
+        await post(priority, job)
+        if scheduler.sent > sent_before:
+            latencies.append(time.monotonic() - job[0])
+    scheduler._post = timed_post
+
+    pool.start()
+    count = int(rate * seconds)
+    start = time.monotonic()
+    for i in range(count):
+        # Stay on schedule, rather than sleeping a fixed amount after each send.
+        await asyncio.sleep(max(0, start + i / rate - time.monotonic()))
+        before = time.perf_counter()
+        pool.send(PRIORITY_CHAT, dict(username=f"player{i % 7}", content=f"message {i}"))
+        queue_times.append(time.perf_counter() - before)
+
+    while len(latencies) < count:
+        await asyncio.sleep(0.01)
+    report = pool.report()
+    await pool.close()
+    return queue_times, latencies, report
+
+
+async def bench(args):
+    async with aiohttp.ClientSession() as session:
+        for name in ("no spool", "spool"):
+            fake = FakeWebhook(10 ** 6, 1, args.latency)
+            runner, url = await start_server(fake)
+            with tempfile.TemporaryDirectory() as directory:
+                spool = Spool(directory, args.flush_interval) if name == "spool" else None
+                queue_times, latencies, report = await send_steady(session, url, args.rate, args.seconds, spool)
+                leftover = len(Spool(directory).load()) if spool else 0
+            await runner.cleanup()
+
+            print(
+                f"{name:>8}: queueing p50 {statistics.median(queue_times) * 1e6:,.0f}us p99 {percentile(queue_times, 0.99) * 1e6:,.0f}us, "
+                f"delivery p50 {statistics.median(latencies) * 1e3:,.1f}ms p99 {percentile(latencies, 0.99) * 1e3:,.1f}ms, "
+                f"{leftover} left in the spool"
+            )
+            if spool:
+                print(f"{'':>8}  {report.split('Spool: ')[1]}")
+
+
+async def check_recovery():
+    with tempfile.TemporaryDirectory() as directory:
+        spool = Spool(directory, segment_size=4096, max_segments=3)
+        spool.load()
+        ids = [spool.append(PRIORITY_CHAT, dict(username="Steve", content=f"message {i}")) for i in range(500)]
+        spool.start()
+        for id in ids[:400]:
+            spool.ack(id)
+        await asyncio.sleep(spool.flush_interval * 3)
+        # Stopped without acking the rest, as if the bot was restarted while Discord was down.
+        await spool.close()
+        segments = len(os.listdir(directory))
+
+        pending = Spool(directory).load()
+        contents = [payload["content"] for _, _, payload in pending]
+        expected = [f"message {i}" for i in range(400, 500)]
+        print(f"Recovery: {len(pending)} of 100 unacked messages came back {'in order' if contents == expected else 'OUT OF ORDER'}, {segments} segment files left.")
+        if contents != expected:
+            raise SystemExit("Failed: the spool did not give back exactly the unacked messages, in order.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=50, help="Messages per second.")
+    parser.add_argument("--seconds", type=float, default=5, help="How long to send for.")
+    parser.add_argument("--latency", type=float, default=0.005, help="How long the fake webhook takes to answer, in seconds.")
+    parser.add_argument("--flush-interval", type=float, default=0.05, help="How often the spool is synced to the disk, in seconds.")
+    args = parser.parse_args()
+
+    print(f"{int(args.rate * args.seconds)} messages at {args.rate:.0f}/s, {args.latency * 1e3:.0f}ms per request, fsync every {args.flush_interval * 1e3:.0f}ms.")
+    asyncio.run(bench(args))
+    asyncio.run(check_recovery())
+
+
+if __name__ == "__main__":
+    main()
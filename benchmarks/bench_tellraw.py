@@ -0,0 +1,206 @@
+"""
+    Microbenchmark for building the tellraw command of a Discord message,
+    comparing the MinecraftTellRawGenerator objects BridgeCog.on_message used
+    to build for every message with the cog's precompiled templates.
+
+    First checks that both give exactly the same output for a few thousand
+    random messages (replies, attachments, empty content, quotes, newlines
+    and non-ASCII), with insertion on and off. Then reports the time per
+    message and the memory allocated per message (tracemalloc's peak).
+
+    Usage: python -m benchmarks.bench_tellraw [--messages N] [--seed N]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from minecraftTellrawGenerator import MinecraftTellRawGenerator as tellraw
+
+import benchmarks.common # Makes the bot's modules importable.
+from cogs.bridge import make_templates
+from tellraw_template import combine
+
+WORDS = ("hello", "gg", "\"quoted\"", "back\\slash", "new\nline", "ünïcödé", "😀", "<@123>", ":thumbsup:", "tab\there", "")
+
+
+def random_message(rng: random.Random):
+    def text(length):
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, length)))
+
+    reply = rng.random() < 0.3
+    return dict(
+        author=text(2) or "Steve",
+        content=text(12),
+        message_id=str(rng.randint(10 ** 17, 10 ** 18)),
+        mention=f"<@{rng.randint(10 ** 17, 10 ** 18)}>",
+        reply_author=(text(2) or "Alex") if reply else None,
+        reply_content=text(12) if reply else None,
+        attachments=[f"https://cdn.discordapp.com/attachments/{i}/{text(1)}.png" for i in range(rng.choice((0, 0, 0, 1, 3)))],
+    )
+
+
+def build_objects(m: dict, insertion_available: bool):
+    # How BridgeCog.on_message built the tellraw command before the templates, from the already parsed values.
+    pre = None
+    if m["reply_author"] is not None:
+        pre = tellraw.multiple_tellraw(
+            tellraw(
+                text="[REPLY] ",
+                color="gray",
+                italic=True
+            ),
+            tellraw(
+                text=m["reply_author"],
+                color="gray",
+                italic=True
+            ),
+            tellraw(
+                text=": " + m["reply_content"] + "\n",
+                color="gray",
+                hover=tellraw(text="This is the message being replied to."),
+                italic=True
+            )
+        )
+    else:
+        pre = tellraw(text="")
+
+    a = tellraw(
+        text= "╚> [" if m["reply_author"] is not None else "["
+    )
+    b = tellraw(
+        text="Discord",
+        color="blue",
+        hover=tellraw(text="This message was sent from Discord!", color="light_purple"),
+        bold=True
+    )
+    c = tellraw(
+        text = "] "
+    )
+    d = None
+    if insertion_available:
+        d = tellraw(
+            text=m["author"],
+            insertion=f"reply:{m['message_id']}:pingoff ",
+            hover=tellraw(text="Shift+click to reply to this message!", color="yellow")
+        )
+        e = tellraw(
+            text=": " + m["content"],
+            insertion=f"reply:{m['message_id']}:pingoff ",
+            hover=tellraw(text="Shift+click to reply to this message!", color="yellow")
+        )
+    else:
+        d = tellraw(
+            text=m["author"],
+            insertion=f"reply:{m['message_id']}:pingoff ",
+            hover=tellraw(text=m["mention"], color="yellow")
+        )
+        e = tellraw(
+            text=": " + m["content"],
+            insertion=f"reply:{m['message_id']}:pingoff ",
+            hover=tellraw(text=m["mention"], color="yellow")
+        )
+
+    if len(m["attachments"]) > 0:
+        attachment_list = []
+
+        i = 0
+        for url in m["attachments"]:
+            i += 1
+            attachment_list.append(tellraw(
+                text="[" if m["content"] == "" and i == 1 else " ["
+            ))
+            attachment_list.append(tellraw(
+                text=f"attachment {i}",
+                url=url,
+                color="aqua",
+                hover=tellraw.multiple_tellraw(
+                    tellraw(
+                        text="Click to open "
+                    ),
+                    tellraw(
+                        text=url,
+                        color="aqua"
+                    ),
+                    tellraw(
+                        text="."
+                    )
+                )
+            ))
+            attachment_list.append(tellraw(
+                text="]"
+            ))
+
+        return tellraw.multiple_tellraw(pre, a, b, c, d, e, *attachment_list)
+    return tellraw.multiple_tellraw(pre, a, b, c, d, e)
+
+
+def build_templates(m: dict, templates: dict):
+    # The same as BridgeCog.on_message does now.
+    if m["reply_author"] is not None:
+        fragments = [templates["reply_message"].render(
+            reply_author=m["reply_author"],
+            reply_content=m["reply_content"],
+            author=m["author"],
+            content=m["content"],
+            message_id=m["message_id"],
+            mention=m["mention"],
+        )]
+    else:
+        fragments = [templates["message"].render(
+            author=m["author"],
+            content=m["content"],
+            message_id=m["message_id"],
+            mention=m["mention"],
+        )]
+
+    for i, url in enumerate(m["attachments"], 1):
+        template = templates["first_attachment" if m["content"] == "" and i == 1 else "attachment"]
+        fragments.append(template.render(number=str(i), url=url))
+
+    return combine(*fragments)
+
+
+def measure(build, messages: list, *args):
+    start = time.perf_counter()
+    for m in messages:
+        build(m, *args)
+    elapsed = (time.perf_counter() - start) / len(messages)
+
+    # Peak memory while building one message, averaged over a sample.
+    peaks = []
+    tracemalloc.start()
+    for m in messages[:200]:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        build(m, *args)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return elapsed, sum(peaks) / len(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000, help="How many random messages to build.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the random messages.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = [random_message(rng) for _ in range(args.messages)]
+
+    for insertion_available in (False, True):
+        templates = make_templates(insertion_available)
+        compiled = [name for name, template in templates.items() if template.compiled]
+        mismatches = sum(build_objects(m, insertion_available) != build_templates(m, templates) for m in messages)
+        print(f"insertion {'on' if insertion_available else 'off'}: templates compiled: {', '.join(compiled)}; {mismatches} of {len(messages)} messages differ.")
+        if mismatches:
+            raise SystemExit("Failed: the templates do not give the same output as the tellraw objects.")
+
+        before_time, before_memory = measure(build_objects, messages, insertion_available)
+        after_time, after_memory = measure(build_templates, messages, templates)
+        print(f"  {'objects':>9}: {before_time * 1e6:6.1f}us and {before_memory / 1024:5.1f}KiB per message")
+        print(f"  {'templates':>9}: {after_time * 1e6:6.1f}us and {after_memory / 1024:5.1f}KiB per message ({before_time / after_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
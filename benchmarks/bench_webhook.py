@@ -0,0 +1,213 @@
+"""
+    Sends a burst of messages to a local fake webhook with Discord-like rate
+    limits, comparing WebhookScheduler against posting everything in order
+    and sleeping on every 429 (what discord.py's Webhook.send does).
+
+    The burst is a lot of chat plus some joins, with server state messages
+    arriving part way through. Reports the total time, how many 429s were
+    hit, and how long each kind of message took from being queued to being
+    delivered.
+
+    With --webhooks N, the same burst is also sent through a WebhookPool of
+    N webhooks, with --broken of them answering 404 as if they were deleted,
+    to show the gain in throughput and that failing over loses nothing.
+
+    Usage: python -m benchmarks.bench_webhook [--chat N] [--events N] [--limit N] [--window S] [--latency S] [--webhooks N] [--broken N]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+from aiohttp import web
+
+import benchmarks.common # Makes the bot's modules importable.
+from webhook_scheduler import WebhookScheduler, WebhookPool, PRIORITY_STATE, PRIORITY_CHAT, PRIORITY_EVENTS, PRIORITY_NAMES
+
+
+class FakeWebhook:
+    """A webhook endpoint which allows `limit` messages per `window` seconds, and says so in its headers like Discord."""
+
+    def __init__(self, limit: int, window: float, latency: float, broken: bool = False):
+        self.broken = broken
+        self.limit = limit
+        self.window = window
+        self.latency = latency
+        self.reset_at = 0.0
+        self.remaining = limit
+        self.delivered = [] # (time, payload)
+        self.rejected = 0
+
+    async def handle(self, request: web.Request):
+        payload = await request.json()
+        await asyncio.sleep(self.latency)
+        if self.broken:
+            return web.json_response({"message": "Unknown Webhook", "code": 10015}, status=404)
+
+        now = time.monotonic()
+        if now >= self.reset_at:
+            self.reset_at = now + self.window
+            self.remaining = self.limit
+
+        if self.remaining == 0:
+            self.rejected += 1
+            return web.json_response({"message": "You are being rate limited.", "retry_after": self.reset_at - now, "global": False}, status=429)
+
+        self.remaining -= 1
+        self.delivered.append((now, payload))
+        return web.json_response({"id": str(len(self.delivered))}, headers={
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset-After": f"{self.reset_at - now:.3f}",
+            "X-RateLimit-Bucket": "fake",
+        })
+
+
+async def start_server(fake: FakeWebhook):
+    app = web.Application()
+    app.router.add_post("/webhook", fake.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/webhook"
+
+
+def make_burst(chat: int, events: int):
+    """The messages to send, as (delay before queueing, priority, payload). State messages arrive a bit later."""
+    messages = []
+    every = max(1, chat // events) if events else 0
+    for i in range(chat):
+        messages.append((0.0, PRIORITY_CHAT, dict(username=f"player{i % 7}", content=f"message {i}")))
+        if every and i % every == 0 and i // every < events:
+            messages.append((0.0, PRIORITY_EVENTS, dict(username="Server", content=f"player{i % 7} joined the game")))
+    messages.append((0.5, PRIORITY_STATE, dict(username="Server", content="The server is stopping.")))
+    return messages
+
+
+async def send_naive(session: aiohttp.ClientSession, url: str, messages: list):
+    """Post every message in the order it was queued, sleeping whenever Discord says 429."""
+    queue = asyncio.Queue()
+    latencies = []
+
+    async def sender():
+        while True:
+            queued_at, priority, payload = await queue.get()
+            while True:
+                async with session.post(url, params={"wait": "true"}, json=payload) as response:
+                    if response.status != 429:
+                        break
+                    await asyncio.sleep((await response.json())["retry_after"])
+            latencies.append((priority, time.monotonic() - queued_at))
+            queue.task_done()
+
+    task = asyncio.create_task(sender())
+    await queue_messages(messages, lambda priority, payload: queue.put_nowait((time.monotonic(), priority, payload)))
+    await queue.join()
+    task.cancel()
+    return latencies
+
+
+async def send_scheduled(session: aiohttp.ClientSession, url: str, messages: list, rate_limits: tuple):
+    scheduler = WebhookScheduler(session, url, rate_limits)
+    latencies = []
+
+    # Measure the same way as the naive sender, from queueing to the response.
+    post = scheduler._post
+    async def timed_post(priority, job):
+        sent_before = scheduler.sent
+        await post(priority, job)
+        if scheduler.sent > sent_before:
+            latencies.append((priority, time.monotonic() - job[0]))
+    scheduler._post = timed_post
+
+    scheduler.start()
+    await queue_messages(messages, scheduler.send)
+    while scheduler.backlog or len(latencies) < len(messages):
+        await asyncio.sleep(0.01)
+    await scheduler.close()
+    return latencies
+
+
+async def send_pooled(session: aiohttp.ClientSession, urls: list, messages: list, rate_limits: tuple):
+    pool = WebhookPool(session, urls, rate_limits, failure_threshold=1, cooldown=60)
+    latencies = []
+
+    for scheduler in pool.schedulers:
+        def timed_post(priority, job, scheduler=scheduler, post=scheduler._post):
+            async def timed():
+                sent_before = scheduler.sent
+                await post(priority, job)
+                if scheduler.sent > sent_before:
+                    latencies.append((priority, time.monotonic() - job[0]))
+            return timed()
+        scheduler._post = timed_post
+
+    pool.start()
+    await queue_messages(messages, pool.send)
+    while pool.backlog or len(latencies) < len(messages):
+        await asyncio.sleep(0.01)
+    print(f"{'':>10}  {pool.report()}")
+    await pool.close()
+    return latencies
+
+
+async def queue_messages(messages: list, queue):
+    for delay, priority, payload in sorted(messages, key=lambda message: message[0]):
+        if delay:
+            await asyncio.sleep(delay)
+            delay = 0
+        queue(priority, payload)
+
+
+def report(name: str, elapsed: float, rejected: int, latencies: list):
+    summary = []
+    for priority, priority_name in enumerate(PRIORITY_NAMES):
+        values = sorted(latency for p, latency in latencies if p == priority)
+        if values:
+            summary.append(f"{priority_name} p50 {statistics.median(values) * 1e3:,.0f}ms max {values[-1] * 1e3:,.0f}ms")
+    print(f"{name:>10}: {elapsed:.2f}s, {rejected} 429s; {', '.join(summary)}")
+
+
+async def run(args):
+    messages = make_burst(args.chat, args.events)
+    print(f"{len(messages)} messages, limit {args.limit} per {args.window}s, {args.latency * 1e3:.0f}ms per request.")
+
+    async with aiohttp.ClientSession() as session:
+        for name in ("naive", "scheduler"):
+            fake = FakeWebhook(args.limit, args.window, args.latency)
+            runner, url = await start_server(fake)
+            start = time.monotonic()
+            if name == "naive":
+                latencies = await send_naive(session, url, messages)
+            else:
+                latencies = await send_scheduled(session, url, messages, ((args.limit, args.window),))
+            report(name, time.monotonic() - start, fake.rejected, latencies)
+            await runner.cleanup()
+
+        if args.webhooks > 1:
+            fakes = [FakeWebhook(args.limit, args.window, args.latency, broken=i < args.broken) for i in range(args.webhooks)]
+            servers = [await start_server(fake) for fake in fakes]
+            start = time.monotonic()
+            latencies = await send_pooled(session, [url for _, url in servers], messages, ((args.limit, args.window),))
+            report(f"pool of {args.webhooks}", time.monotonic() - start, sum(fake.rejected for fake in fakes), latencies)
+            for runner, _ in servers:
+                await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chat", type=int, default=40, help="Chat messages in the burst.")
+    parser.add_argument("--events", type=int, default=10, help="Join messages in the burst.")
+    parser.add_argument("--limit", type=int, default=5, help="Messages allowed per window.")
+    parser.add_argument("--window", type=float, default=1.0, help="Length of a rate limit window, in seconds. Discord's is 2.")
+    parser.add_argument("--latency", type=float, default=0.02, help="How long the fake webhook takes to answer, in seconds.")
+    parser.add_argument("--webhooks", type=int, default=3, help="Webhooks in the pool, 1 to skip it.")
+    parser.add_argument("--broken", type=int, default=1, help="How many of the pool's webhooks answer 404.")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
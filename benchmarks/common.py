@@ -0,0 +1,93 @@
+"""
+    Shared pieces for the benchmarks.
+
+    The benchmarks are standalone scripts, run them from the repository root
+    so the bot's modules can be imported, ie: `python -m benchmarks.bench_matcher`
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from webhook_actions import regex_action, multi_regex_action, action_list
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log_corpus.txt")
+
+# Prefix of lines logged by the server thread, on both vanilla and Forge servers.
+PREFIX = r"^\[[\d:]+\] \[Server thread/INFO\](?: \[minecraft/DedicatedServer\])?: "
+
+# A realistic set of config.webhook["regex"] values for a Forge server.
+REGEXES = dict(
+    player_message_reply = PREFIX + r"<(\w+)> reply:(\d+):(pingon|pingoff) (.*)$",
+    player_message_noreply = PREFIX + r"<(\w+)> (.*)$",
+    player_joined = PREFIX + r"(\w+) joined the game$",
+    player_left = PREFIX + r"(\w+) left the game$",
+    server_starting = r"^\[[\d:]+\] \[(?:main|Server thread)/INFO\](?: \[minecraft/DedicatedServer\])?: Starting minecraft server version",
+    server_started = PREFIX + r"Done \([\d.]+s\)! For help, type \"help\"",
+    server_stopping = r"^\[[\d:]+\] \[Server thread/INFO\](?: \[minecraft/MinecraftServer\])?: Stopping server",
+    server_list = PREFIX + r"There are (\d+) of a max of (\d+) players online: (.*)$",
+    console_message = PREFIX + r"\[Server\] (.*)$",
+    advancement = PREFIX + r"(\w+) has made the advancement \[(.+)\]$",
+    not_whitelisted = r"^\[[\d:]+\] \[[^\]]+/INFO\](?: \[minecraft/ServerLoginNetHandler\])?: Disconnecting com\.mojang\.authlib\.GameProfile@\w+\[id=[\w-]+,name=(\w+),.*You are not white-listed on this server!",
+)
+
+# The same regexes, for config.webhook["match_message_only"], matched against only the message after the prefix.
+MESSAGE_REGEXES = dict(
+    player_message_reply = r"^<(\w+)> reply:(\d+):(pingon|pingoff) (.*)$",
+    player_message_noreply = r"^<(\w+)> (.*)$",
+    player_joined = r"^(\w+) joined the game$",
+    player_left = r"^(\w+) left the game$",
+    server_starting = r"^Starting minecraft server version",
+    server_started = r"^Done \([\d.]+s\)! For help, type \"help\"",
+    server_stopping = r"^Stopping server",
+    server_list = r"^There are (\d+) of a max of (\d+) players online: (.*)$",
+    console_message = r"^\[Server\] (.*)$",
+    advancement = r"^(\w+) has made the advancement \[(.+)\]$",
+    not_whitelisted = r"^Disconnecting com\.mojang\.authlib\.GameProfile@\w+\[id=[\w-]+,name=(\w+),.*You are not white-listed on this server!",
+)
+
+# The order WebhookCog.setup_actions registers the actions in. Each entry is one action, lists are multi-actions.
+ACTION_ORDER = [
+    "not_whitelisted",
+    "advancement",
+    "console_message",
+    "server_list",
+    "server_stopping",
+    "server_started",
+    "server_starting",
+    "player_left",
+    "player_joined",
+    ["player_message_reply", "player_message_noreply"],
+]
+
+
+def load_corpus():
+    with open(CORPUS, "r", encoding="utf-8") as f:
+        return f.readlines()
+
+
+def make_callback(name: str):
+    async def callback(match):
+        None
+    callback.__name__ = name
+    return callback
+
+
+def build_action_list(regexes: dict = REGEXES, filters: dict = {}, **options):
+    """
+        Build an action_list the same way WebhookCog.setup_actions does, with callbacks that do nothing.
+        `options` are passed on to action_list, ie: backend and time_budget.
+    """
+    actions = []
+    for entry in ACTION_ORDER:
+        if isinstance(entry, list):
+            actions.append(multi_regex_action(
+                [regexes[name] for name in entry],
+                [make_callback(name) for name in entry],
+                filters=[filters.get(name) for name in entry],
+            ))
+        else:
+            actions.append(regex_action(regexes[entry], make_callback(entry), filters=filters.get(entry)))
+    return action_list(actions, **options)
@@ -4,15 +4,160 @@ import emoji
 from discord.ext import commands
 from minecraftTellrawGenerator import MinecraftTellRawGenerator as tellraw
 
+from tellraw_template import TellrawTemplate, combine
+
 import config
 
 emoji_match = "<a?(:.*?:)\d*?>"
 def parse_emoji(content):
     return emoji.demojize(re.sub(emoji_match, "\1", content))
 
+# The "[Discord]" label in front of messages from Discord.
+def discord_label(opening: str):
+    return [
+        tellraw(
+            text=opening
+        ),
+        tellraw(
+            text="Discord",
+            color="blue",
+            hover=tellraw(text="This message was sent from Discord!", color="light_purple"),
+            bold=True
+        ),
+        tellraw(
+            text="] "
+        ),
+    ]
+
+# The author and content of a message from Discord, which can be shift+clicked to reply to it if insertion is available.
+def message_body(author: str, content: str, message_id: str, mention: str, insertion_available: bool):
+    hover = tellraw(text="Shift+click to reply to this message!", color="yellow") if insertion_available else tellraw(text=mention, color="yellow")
+    return [
+        tellraw(
+            text=author,
+            insertion=f"reply:{message_id}:pingoff ",
+            hover=hover
+        ),
+        tellraw(
+            text=": " + content,
+            insertion=f"reply:{message_id}:pingoff ",
+            hover=hover
+        ),
+    ]
+
+# Build the tellraw templates for messages from Discord. The static parts of each are serialized once, here.
+def make_templates(insertion_available: bool):
+    def message(author, content, message_id, mention):
+        return [tellraw(text=""), *discord_label("["), *message_body(author, content, message_id, mention, insertion_available)]
+
+    def reply_message(reply_author, reply_content, author, content, message_id, mention):
+        pre = tellraw.multiple_tellraw(
+            tellraw(
+                text="[REPLY] ",
+                color="gray",
+                italic=True
+            ),
+            tellraw(
+                text=reply_author,
+                color="gray",
+                italic=True
+            ),
+            tellraw(
+                text=": " + reply_content + "\n",
+                color="gray",
+                hover=tellraw(text="This is the message being replied to."),
+                italic=True
+            )
+        )
+        return [pre, *discord_label("╚> ["), *message_body(author, content, message_id, mention, insertion_available)]
+
+    def attachment_link(opening, number, url):
+        return [
+            tellraw(
+                text=opening
+            ),
+            tellraw(
+                text=f"attachment {number}",
+                url=url,
+                color="aqua",
+                hover=tellraw.multiple_tellraw(
+                    tellraw(
+                        text="Click to open "
+                    ),
+                    tellraw(
+                        text=url,
+                        color="aqua"
+                    ),
+                    tellraw(
+                        text="."
+                    )
+                )
+            ),
+            tellraw(
+                text="]"
+            ),
+        ]
+
+    def first_attachment(number, url):
+        return attachment_link("[", number, url)
+
+    def attachment(number, url):
+        return attachment_link(" [", number, url)
+
+    def edit(old_author, old_content, new_author, new_content):
+        return [
+            # Line 1: old message
+            *discord_label("["),
+            tellraw(
+                text="[EDIT - OLD] ",
+                color="dark_gray",
+                italic=True
+            ),
+            tellraw(
+                text=old_author,
+                color="dark_gray",
+                italic=True
+            ),
+            tellraw(
+                text=": " + old_content + "\n",
+                color="dark_gray",
+                hover=tellraw(text="This is the old message."),
+                italic=True
+            ),
+
+            # Line 2: new message
+            *discord_label("["),
+            tellraw(
+                text="[EDIT - NEW] ",
+                color="gold"
+            ),
+            tellraw(
+                text=new_author,
+                color="gold"
+            ),
+            tellraw(
+                text=": ",
+                color="gold"
+            ),
+            tellraw(
+                text=new_content,
+                hover=tellraw(text="This is the new message."),
+                color="gold"
+            ),
+        ]
+
+    return dict(
+        message=TellrawTemplate(message, "author", "content", "message_id", "mention"),
+        reply_message=TellrawTemplate(reply_message, "reply_author", "reply_content", "author", "content", "message_id", "mention"),
+        first_attachment=TellrawTemplate(first_attachment, "number", "url"),
+        attachment=TellrawTemplate(attachment, "number", "url"),
+        edit=TellrawTemplate(edit, "old_author", "old_content", "new_author", "new_content"),
+    )
+
 class BridgeCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.templates = make_templates(config.webhook["insertion_available"])
     
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
@@ -53,7 +198,6 @@ class BridgeCog(commands.Cog):
         if message.channel.id != config.bot["channel_id"]:
             return
         
-        pre = None
         if message.reference:
             message_author = None
             message_content = None
@@ -65,102 +209,27 @@ class BridgeCog(commands.Cog):
                 message_author = message_data.author
                 message_content = message_data.content
 
-            pre = tellraw.multiple_tellraw(
-                tellraw(
-                    text="[REPLY] ",
-                    color="gray",
-                    italic=True
-                ),
-                tellraw(
-                    text=message_author.display_name,
-                    color="gray",
-                    italic=True
-                ),
-                tellraw(
-                    text=": " + parse_emoji(message_content) + "\n",
-                    color="gray",
-                    hover=tellraw(text="This is the message being replied to."),
-                    italic=True
-                )
-            )
-        else:
-            pre = tellraw(text="")
-
-        a = tellraw(
-            text= "╚> [" if message.reference else "["
-        )
-        b = tellraw(
-            text="Discord",
-            color="blue",
-            hover=tellraw(text="This message was sent from Discord!", color="light_purple"),
-            bold=True
-        )
-        c = tellraw(
-            text = "] "
-        )
-        d = None
-        if config.webhook["insertion_available"]:
-            d = tellraw(
-                text=message.author.display_name,
-                insertion=f"reply:{str(message.id)}:pingoff ",
-                hover=tellraw(text="Shift+click to reply to this message!", color="yellow")
-            )
-            e = tellraw(
-                text=": " + parse_emoji(message.content),
-                insertion=f"reply:{str(message.id)}:pingoff ",
-                hover=tellraw(text="Shift+click to reply to this message!", color="yellow")
-            )
-            
+            fragments = [self.templates["reply_message"].render(
+                reply_author=message_author.display_name,
+                reply_content=parse_emoji(message_content),
+                author=message.author.display_name,
+                content=parse_emoji(message.content),
+                message_id=str(message.id),
+                mention=message.author.mention,
+            )]
         else:
-            d = tellraw(
-                text=message.author.display_name,
-                insertion=f"reply:{str(message.id)}:pingoff ",
-                hover=tellraw(text=message.author.mention, color="yellow")
-            )
-            e = tellraw(
-                text=": " + parse_emoji(message.content),
-                insertion=f"reply:{str(message.id)}:pingoff ",
-                hover=tellraw(text=message.author.mention, color="yellow")
-            )
-        
+            fragments = [self.templates["message"].render(
+                author=message.author.display_name,
+                content=parse_emoji(message.content),
+                message_id=str(message.id),
+                mention=message.author.mention,
+            )]
 
-        combined = None
-
-        if len(message.attachments) > 0:
-            attachment_list = []
-
-            i = 0
-            for attachment in message.attachments:
-                i += 1
-                attachment_list.append(tellraw(
-                    text="[" if message.content == "" and i == 1 else " ["
-                ))
-                attachment_list.append(tellraw(
-                    text=f"attachment {i}",
-                    url=attachment.url,
-                    color="aqua",
-                    hover=tellraw.multiple_tellraw(
-                        tellraw(
-                            text="Click to open "
-                        ),
-                        tellraw(
-                            text=attachment.url,
-                            color="aqua"
-                        ),
-                        tellraw(
-                            text="."
-                        )
-                    )
-                ))
-                attachment_list.append(tellraw(
-                    text="]"
-                ))
+        for i, attachment in enumerate(message.attachments, 1):
+            template = self.templates["first_attachment" if message.content == "" and i == 1 else "attachment"]
+            fragments.append(template.render(number=str(i), url=attachment.url))
 
-            combined = tellraw.multiple_tellraw(pre, a, b, c, d, e, *attachment_list)
-        else:
-            combined = tellraw.multiple_tellraw(pre, a, b, c, d, e)
-        
-        await self.bot.send_server_command("tellraw @a " + combined)
+        await self.bot.send_server_command("tellraw @a " + combine(*fragments))
     
     @commands.Cog.listener()
     async def on_message_edit(self, before, after):
@@ -176,68 +245,12 @@ class BridgeCog(commands.Cog):
         if before.content == after.content: # Catch embed "edits"
             return
 
-        combined = tellraw.multiple_tellraw(
-            # Line 1: old message
-            tellraw(
-                text="["
-            ),
-            tellraw(
-                text="Discord",
-                color="blue",
-                hover=tellraw(text="This message was sent from Discord!", color="light_purple"),
-                bold=True
-            ),
-            tellraw(
-                text="] "
-            ),
-            tellraw(
-                text="[EDIT - OLD] ",
-                color="dark_gray",
-                italic=True
-            ),
-            tellraw(
-                text=before.author.display_name,
-                color="dark_gray",
-                italic=True
-            ),
-            tellraw(
-                text=": " + parse_emoji(before.content) + "\n",
-                color="dark_gray",
-                hover=tellraw(text="This is the old message."),
-                italic=True
-            ),
-
-            # Line 2: new message
-            tellraw(
-                text="["
-            ),
-            tellraw(
-                text="Discord",
-                color="blue",
-                hover=tellraw(text="This message was sent from Discord!", color="light_purple"),
-                bold=True
-            ),
-            tellraw(
-                text="] "
-            ),
-            tellraw(
-                text="[EDIT - NEW] ",
-                color="gold"
-            ),
-            tellraw(
-                text=after.author.display_name,
-                color="gold"
-            ),
-            tellraw(
-                text=": ",
-                color="gold"
-            ),
-            tellraw(
-                text=parse_emoji(after.content),
-                hover=tellraw(text="This is the new message."),
-                color="gold"
-            )
-        )
+        combined = combine(self.templates["edit"].render(
+            old_author=before.author.display_name,
+            old_content=parse_emoji(before.content),
+            new_author=after.author.display_name,
+            new_content=parse_emoji(after.content),
+        ))
         await self.bot.send_server_command("tellraw @a " + combined)
     
 async def setup(bot):
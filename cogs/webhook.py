@@ -1,15 +1,23 @@
 import re
 import discord
 import emoji
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 import asyncio
-import aiohttp
+import collections
 import logging
 import typing
-
-from webhook_bridge import Bridge
-from webhook_actions import open_latest_log, need_log_reopen, regex_action, multi_regex_action, action_list
+import time
+import json
+import io
+import os
+import importlib.util
+
+from webhook_bridge import Bridge, make_session
+from log_tailer import LogWatcher, LogTailer, TailCheckpoint
+from log_line import LogLine
+from action_dispatcher import Dispatcher
+from webhook_actions import regex_action, multi_regex_action, action_list
 import config
 
 LOG = logging.getLogger("WEBHOOK_COG")
@@ -18,27 +26,86 @@ emoji_match = "<a?(:.*?:)\d*?>"
 def parse_emoji(content):
     return emoji.demojize(re.sub(emoji_match, "\1", content))
 
-def setup_action(callback, what_do: str):
+def is_owner(interaction: discord.Interaction) -> bool:
+    return interaction.user.id == config.bot["owner_id"]
+
+# The config.webhook settings that make up the actions, which are replaced when the actions are reloaded.
+ACTION_SETTINGS = (
+    "regex", "regex_literals", "action_filters", "actions_enabled", "match_message_only",
+    "adaptive_ordering", "regex_backend", "regex_time_budget", "regex_budget_strikes",
+    "regex_strike_window",
+)
+
+# The least amount of match groups each action's regex needs, checked before reloaded regexes are used.
+REQUIRED_GROUPS = dict(
+    player_message_noreply = 2,
+    player_message_reply = 4,
+    player_joined = 1,
+    player_left = 1,
+    server_starting = 0,
+    server_started = 0,
+    server_stopping = 0,
+    server_list = 3,
+    console_message = 1,
+    advancement = 2,
+    not_whitelisted = 1,
+)
+
+def setup_action(callback, what_do: str, settings: dict):
     LOG.debug(f"  Event: '{callback.__name__}'")
     LOG.debug(f"    Action: {what_do}")
-    LOG.debug(f"    Enabled: {config.webhook['actions_enabled'][callback.__name__]}")
-    LOG.debug(f"    Regex: {config.webhook['regex'][callback.__name__]}")
-
-    return regex_action(config.webhook["regex"][callback.__name__], callback)
+    LOG.debug(f"    Enabled: {settings['actions_enabled'][callback.__name__]}")
+    LOG.debug(f"    Regex: {settings['regex'][callback.__name__]}")
+
+    return regex_action(
+        settings["regex"][callback.__name__],
+        callback,
+        settings["regex_literals"][callback.__name__],
+        settings["action_filters"][callback.__name__],
+    )
 
-def setup_multi_action(callbacks, what_do: str):
+def setup_multi_action(callbacks, what_do: str, settings: dict):
     LOG.debug(f"  Multi-event:")
     LOG.debug(f"    Action: {what_do}")
     for callback in callbacks:
         LOG.debug(f"    Event: '{callback.__name__}'")
-        LOG.debug(f"      Regex: {config.webhook['regex'][callback.__name__]}")
-        LOG.debug(f"      Enabled: {config.webhook['actions_enabled'][callback.__name__]}")
+        LOG.debug(f"      Regex: {settings['regex'][callback.__name__]}")
+        LOG.debug(f"      Enabled: {settings['actions_enabled'][callback.__name__]}")
+
+    return multi_regex_action(
+        [settings["regex"][callback.__name__] for callback in callbacks],
+        callbacks,
+        [settings["regex_literals"][callback.__name__] for callback in callbacks],
+        [settings["action_filters"][callback.__name__] for callback in callbacks],
+    )
 
-    return multi_regex_action([config.webhook["regex"][callback.__name__] for callback in callbacks], callbacks)
+# Actions whose first match group is the player they are about. Their functions are run in order per player,
+# everything else is run in order as "server".
+PLAYER_ACTIONS = frozenset((
+    "player_message_noreply", "player_message_reply", "player_joined", "player_left", "advancement", "not_whitelisted",
+))
+
+# Read config.webhook from the config file again, without touching the config module everything else uses.
+def read_webhook_config():
+    spec = importlib.util.spec_from_file_location("config_reload", config.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.webhook
+
+# Check that every regex has enough match groups for its action, raising a ValueError if one does not.
+def validate_actions(actions: action_list):
+    for name, entry in actions.entries.items():
+        if entry.regex.groups < REQUIRED_GROUPS.get(name, 0):
+            raise ValueError(f"The regex for '{name}' has {entry.regex.groups} match groups, but needs {REQUIRED_GROUPS[name]}.")
 
 class WebhookCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.log_watcher = None
+        self.dispatcher = None
+        self.pending_action_list = None # Reloaded actions, swapped in before the next batch of lines.
+        self.previous_action_list = None # The actions before the last reload, for rolling back.
+        self.config_mtime = None
 
     @app_commands.command(
         name="actions",
@@ -62,14 +129,15 @@ class WebhookCog(commands.Cog):
     @app_commands.checks.has_permissions(administrator=True)
     async def actions(self, interaction: discord.Interaction, action: app_commands.Choice[int], enabled: typing.Optional[bool]=None) -> None:
         LOG.info(f"Action [{action.name} ({action.value}) -> {enabled}] requested by {interaction.user.name}#{interaction.user.discriminator}.")
-        if action.value == 10:
-            await interaction.response.send_message("```" + "\n".join([_action.name for _action in self.action_list.all_actions]) + "```")
+        if action.value == 11:
+            await interaction.response.send_message("```" + self.action_list.describe() + "```")
             return
         
-        action_enabled = self.action_list.get_enabled(action.name)
-
         if enabled == None:
-            await interaction.response.send_message(f"Action {action.name} is currently {'enabled' if action_enabled else 'disabled'}.")
+            state = self.action_list.get_state(action.name)
+            if state == "quarantined":
+                state += " (its regex took too long on some lines, enable it again once the regex is fixed)"
+            await interaction.response.send_message(f"Action {action.name} is currently {state}.")
             return
         
         if enabled:
@@ -78,53 +146,233 @@ class WebhookCog(commands.Cog):
             self.action_list.disable_action(action.name)
         await interaction.response.send_message(f"Action {action.name} is now {'enabled' if enabled else 'disabled'}.")
 
+    @app_commands.command(
+        name="profile-actions",
+        description="Show or control per-action timings of the log pipeline.",
+    )
+    @app_commands.describe(what="What to do with the profile.")
+    @app_commands.choices(what=[
+        app_commands.Choice(name="show", value=1),
+        app_commands.Choice(name="start", value=2),
+        app_commands.Choice(name="stop", value=3),
+        app_commands.Choice(name="reset", value=4),
+        app_commands.Choice(name="dump", value=5),
+    ])
+    @app_commands.check(is_owner)
+    async def profile_actions(self, interaction: discord.Interaction, what: app_commands.Choice[int]) -> None:
+        LOG.info(f"Profile [{what.name}] requested by {interaction.user.name}#{interaction.user.discriminator}.")
+        if not hasattr(self, "action_list"):
+            await interaction.response.send_message("The log pipeline is not running yet.", ephemeral=True)
+            return
+
+        if what.value == 2:
+            self.action_list.set_profiling(True)
+        elif what.value == 3:
+            self.action_list.set_profiling(False)
+        elif what.value == 4:
+            self.action_list.reset_profile()
+        elif what.value == 5:
+            # Dumped as a file so runs can be compared offline.
+            dump = json.dumps(self.action_list.profile(), indent=2)
+            file = discord.File(io.BytesIO(dump.encode()), filename=f"action_profile_{int(time.time())}.json")
+            await interaction.response.send_message("Action profile:", file=file, ephemeral=True)
+            return
+
+        await interaction.response.send_message("```" + self.action_list.describe_profile() + "```", ephemeral=True)
+
+    @app_commands.command(
+        name="reload-actions",
+        description="Reload the webhook regexes and actions from the config, without restarting the webhook.",
+    )
+    @app_commands.describe(rollback="Go back to the actions from before the last reload instead.")
+    @app_commands.check(is_owner)
+    async def reload_actions_command(self, interaction: discord.Interaction, rollback: typing.Optional[bool]=False) -> None:
+        LOG.info(f"Action reload (rollback: {rollback}) requested by {interaction.user.name}#{interaction.user.discriminator}.")
+        # Reading the config and compiling the regexes can take longer than Discord waits for a response.
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        if rollback:
+            message = self.rollback_actions()
+        else:
+            message = await self.reload_actions()
+        await interaction.followup.send(message, ephemeral=True)
+
+    # Build the actions from the config file again, and queue them to be swapped in between batches of lines.
+    # The old actions stay in use if anything goes wrong. Returns a message saying what happened.
+    async def reload_actions(self):
+        if not hasattr(self, "action_list"):
+            return "The log pipeline is not running yet."
+
+        actions = None
+        try:
+            # Compiling the regexes happens in a thread, so the lines keep being read in the meantime.
+            settings = await asyncio.to_thread(read_webhook_config)
+            actions = await asyncio.to_thread(self.setup_actions, self.bot.bridge, settings)
+            validate_actions(actions)
+        except Exception as e:
+            if actions:
+                actions.close()
+            LOG.error(f"Failed to reload the actions, keeping the current ones: {e}")
+            return f"Failed to reload the actions, keeping the current ones: {e}"
+
+        # Carry over what was learned about the actions that are still there.
+        current = self.pending_action_list or self.action_list
+        for name, entry in actions.entries.items():
+            old = current.entries.get(name)
+            if old:
+                entry.hits, entry.recent_hits, entry.score = old.hits, old.recent_hits, old.score
+        actions.set_profiling(current.profiling)
+
+        for key in ACTION_SETTINGS:
+            config.webhook[key] = settings[key]
+        if self.pending_action_list:
+            self.pending_action_list.close()
+        self.pending_action_list = actions
+        LOG.info("Reloaded the actions, they will be used from the next batch of lines.")
+        return "Reloaded the actions, they will be used from the next batch of lines."
+
+    # Go back to the actions from before the last reload.
+    def rollback_actions(self):
+        if not self.previous_action_list:
+            return "There is nothing to roll back to."
+        if self.pending_action_list:
+            self.pending_action_list.close()
+        self.pending_action_list, self.previous_action_list = self.previous_action_list, None
+        for key in ACTION_SETTINGS:
+            config.webhook[key] = self.pending_action_list.settings[key]
+        LOG.info("Rolling back to the previous actions from the next batch of lines.")
+        return "Rolling back to the previous actions from the next batch of lines."
+
     # Task that runs forever (only started once) that runs main from webhook.py
     async def run_webhook(self):
         try: # Wrap everything in a try since the error isn't propagated properly.
-            async with aiohttp.ClientSession() as session:
+            async with make_session() as session:
                 LOG.info("Connecting to webhook...")
-                webhook = discord.Webhook.from_url(config.webhook["url"], session=session)
-                LOG.info("Webhook connected.")
-                whb = Bridge(webhook)  # Create the webhook bridge object.
+                whb = Bridge(session, config.webhook["url"])  # Create the webhook bridge object.
+                whb.start()
                 self.bot.bridge = whb  # Set the bot's bridge object to the one we just created.
+                LOG.info("Webhook connected.")
 
                 LOG.info("Setting up regexes.")
 
                 LOG.info("The following regex actions are being registered:")
 
                 self.action_list = self.setup_actions(whb)
+                self.action_list.set_profiling(config.webhook["profile_actions"])
 
                 LOG.info("Done action setup.")
 
-                f = open_latest_log()
-                f.seek(0, 2)
-
-                # Main loop: Grab a line of the file, check if it matches any patterns. If so, run the action.
-                LOG.info(f"Listening to log file {config.webhook['latest_log_location']}.")
-                while True:
-                    line = f.readline()
-                    if line:
-                        if line != "" and line != "\n":
-                            match = self.action_list.check(line)
-                            if match:
-                                await match[1](match[0])
-                        elif line == "\n":
-                            LOG.info("Ignored empty newline.")
-                        elif line == "":
-                            if need_log_reopen():
-                                f = open_latest_log()
-                    else:
-                        if need_log_reopen():
-                            f = open_latest_log()
-
-                    # Delay between checking each line. I assume 100 lines per second is more than enough?
-                    # A better delay system will be set up soon, this is mostly temporary.
-                    await asyncio.sleep(0.01)
+                self.dispatcher = self.setup_dispatcher()
+                self.dispatcher.start()
+
+                self.log_watcher = LogWatcher(config.webhook["latest_log_location"], config.webhook["log_poll_interval"])
+                self.log_watcher.start()
+                tailer = LogTailer(config.webhook["latest_log_location"], self.log_watcher, config.webhook["max_batch_lines"])
+
+                checkpoint = None
+                if config.webhook["log_checkpoint_location"]:
+                    checkpoint = TailCheckpoint(config.webhook["log_checkpoint_location"], config.webhook["log_checkpoint_interval"])
+
+                # The checkpoint only moves past a line once the actions it queued have run, otherwise
+                # lines whose actions were still queued when the bot stopped would never be sent.
+                handled = None # The tailer's state after the newest batch whose actions have all finished.
+                batches = collections.deque() # (actions submitted so far, tailer state) after each newer batch.
+
+                def advance():
+                    nonlocal handled
+                    finished = self.dispatcher.finished()
+                    while batches and batches[0][0] <= finished:
+                        handled = batches.popleft()[1]
+
+                try:
+                    # Waits without blocking the rest of the bot if the server is offline.
+                    await tailer.open()
+
+                    # Continue from where the last run left off, if we know where that was.
+                    tailer.resume(
+                        checkpoint.load() if checkpoint else None,
+                        config.webhook["max_replay_bytes"],
+                        config.webhook["max_replay_age"],
+                    )
+
+                    # Main loop: Read every line that is available in batches, check if they match any patterns. If so, run the action.
+                    # The tailer sleeps until the log is written to whenever it has nothing new in it.
+                    LOG.info(f"Listening to log file {config.webhook['latest_log_location']}.")
+                    while True:
+                        lines = await tailer.read_batch()
+                        self.log_watcher.lines += len(lines)
+
+                        # Reloaded actions are swapped in here, so a batch is never checked against a mix of both.
+                        if self.pending_action_list:
+                            self.action_list.close() # Its regex worker process is started again if it is rolled back to.
+                            self.previous_action_list, self.action_list = self.action_list, self.pending_action_list
+                            self.pending_action_list = None
+                            LOG.info("Now using the reloaded actions.")
+
+                        await self.handle_lines(lines)
+
+                        if checkpoint:
+                            submitted = self.dispatcher.submitted
+                            if batches and batches[-1][0] == submitted:
+                                batches[-1] = (submitted, tailer.state()) # No actions since, so it is finished with just as soon.
+                            else:
+                                batches.append((submitted, tailer.state()))
+                            advance()
+                            if handled:
+                                checkpoint.save(handled)
+
+                        # Let the rest of the bot run between batches.
+                        await asyncio.sleep(0)
+                finally:
+                    self.log_watcher.close()
+                    self.action_list.close()
+                    if self.pending_action_list:
+                        self.pending_action_list.close()
+                    # Give the actions of lines which were already read a chance to run before saving where we are.
+                    await self.dispatcher.close(config.webhook["dispatch_drain_timeout"])
+                    await whb.close(config.webhook["dispatch_drain_timeout"])
+                    if checkpoint:
+                        # Not past the actions it gave up on, if the drain timed out.
+                        advance()
+                        if handled:
+                            checkpoint.save(handled, force=True)
         except Exception as e:
             LOG.error("Webhook task failed!")
             LOG.exception(e)
     
-    def setup_actions(self, whb: Bridge):
+    def setup_dispatcher(self):
+        def on_handled(name: str, elapsed: float):
+            if self.action_list.profiling:
+                self.action_list.record_handler(name, elapsed)
+
+        return Dispatcher(
+            config.webhook["dispatch_workers"],
+            config.webhook["dispatch_queue_size"],
+            config.webhook["dispatch_overflow"],
+            config.webhook["dispatch_coalesce_actions"],
+            on_handled,
+        )
+
+    # Check a batch of log lines against the actions, queueing the action of every line that matches one.
+    async def handle_lines(self, lines: list):
+        actions = self.action_list
+        message_only = actions.message_only
+        parse = message_only or actions.needs_parsed_lines()
+        for line in lines:
+            if line != "\n":
+                if parse:
+                    parsed = LogLine(line)
+                    match = actions.check(parsed.message if message_only else line, parsed)
+                else:
+                    match = actions.check(line)
+                if match:
+                    key = match[0].group(1) if match[1].__name__ in PLAYER_ACTIONS else "server"
+                    await self.dispatcher.submit(key, match[1], match[0])
+            else:
+                LOG.info("Ignored empty newline.")
+
+    def setup_actions(self, whb: Bridge, settings: dict = None):
+        settings = settings if settings else config.webhook
+
         # Initial step: Add all actions to the list.
         list = []
 
@@ -169,18 +417,21 @@ class WebhookCog(commands.Cog):
             setup_multi_action(
                 [player_message_reply, player_message_noreply],
                 "Send messages that players send ingame to Discord.",
+                settings,
             ),
         )
 
         # Player join action
         async def player_joined(match):
             LOG.info("Player joined, sending...")
+            whb.prefetch_avatar(match.group(1))
             await whb.on_player_join(match.group(1))
 
         insert_action(
             setup_action(
                 player_joined,
                 "Send player join events to Discord.",
+                settings,
             ),
         )
 
@@ -193,6 +444,7 @@ class WebhookCog(commands.Cog):
             setup_action(
                 player_left,
                 "Send player leave events to Discord.",
+                settings,
             ),
         )
 
@@ -205,6 +457,7 @@ class WebhookCog(commands.Cog):
             setup_action(
                 server_starting,
                 "Send server starting events to Discord.",
+                settings,
             ),
         )
 
@@ -217,6 +470,7 @@ class WebhookCog(commands.Cog):
             setup_action(
                 server_started,
                 "Send server started events to Discord.",
+                settings,
             ),
         )
 
@@ -229,6 +483,7 @@ class WebhookCog(commands.Cog):
             setup_action(
                 server_stopping,
                 "Send server stop events to Discord.",
+                settings,
             ),
         )
 
@@ -246,6 +501,7 @@ class WebhookCog(commands.Cog):
             setup_action(
                 server_list,
                 "Send server list events to Discord.",
+                settings,
             ),
         )
 
@@ -258,6 +514,7 @@ class WebhookCog(commands.Cog):
             setup_action(
                 console_message,
                 "Send console messages to Discord.",
+                settings,
             ),
         )
 
@@ -270,6 +527,7 @@ class WebhookCog(commands.Cog):
             setup_action(
                 advancement,
                 "Send advancement events to Discord.",
+                settings,
             ),
         )
 
@@ -282,23 +540,69 @@ class WebhookCog(commands.Cog):
             setup_action(
                 not_whitelisted,
                 "Send non-whitelisted player join events to Discord.",
+                settings,
             ),
         )
 
         # Second step: Create the actions object.
-        actions = action_list(list)
+        actions = action_list(
+            list,
+            settings["adaptive_ordering"],
+            settings["regex_backend"],
+            settings["regex_time_budget"],
+            settings["regex_budget_strikes"],
+            settings["match_message_only"],
+            settings["regex_strike_window"],
+        )
 
         # Third step: Enable or disable actions based on the config.
-        for action_name in config.webhook["actions_enabled"]:
-            if config.webhook["actions_enabled"][action_name]:
+        for action_name in settings["actions_enabled"]:
+            if settings["actions_enabled"][action_name]:
                 actions.enable_action(action_name)
                 LOG.info(f"  Action '{action_name}' enabled.")
             else:
                 actions.disable_action(action_name)
                 LOG.info(f"  Action '{action_name}' disabled.")
 
+        # So rolling back to these actions can put their settings back in config.webhook too.
+        actions.settings = {key: settings[key] for key in ACTION_SETTINGS}
         return actions
     
+    # Periodically log how busy the log tailer is, so the cost of idling and the throughput can be checked.
+    @tasks.loop(seconds=300)
+    async def report_tailer_stats(self):
+        if self.log_watcher:
+            LOG.info(self.log_watcher.report())
+        if self.dispatcher:
+            LOG.info(self.dispatcher.report())
+        if hasattr(self.bot, "bridge"):
+            LOG.info(self.bot.bridge.report())
+        if hasattr(self, "action_list"):
+            LOG.info(f"Lines skipped by the regex prefilter: {self.action_list.prefilter_saved()}")
+            if self.action_list.guard:
+                LOG.info(self.action_list.guard.report())
+            quarantined = self.action_list.quarantined()
+            if quarantined:
+                LOG.warning(f"Quarantined actions (enable them with /actions once their regex is fixed): {', '.join(quarantined)}")
+
+    # Periodically reorder the actions so the ones matching most often are checked first.
+    @tasks.loop(seconds=60)
+    async def reorder_actions(self):
+        if hasattr(self, "action_list"):
+            self.action_list.reorder()
+
+    # Reload the actions whenever the config file is saved.
+    @tasks.loop(seconds=5)
+    async def watch_config(self):
+        try:
+            mtime = os.stat(config.__file__).st_mtime
+        except OSError:
+            return
+        if self.config_mtime is not None and mtime != self.config_mtime:
+            LOG.info("The config file changed, reloading the actions.")
+            await self.reload_actions()
+        self.config_mtime = mtime
+
     @commands.Cog.listener()
     async def on_ready(self):
         None
@@ -307,9 +611,32 @@ class WebhookCog(commands.Cog):
         # Start the webhook task
         self.webhook_task = self.bot.loop.create_task(self.run_webhook())
 
+        if config.webhook["log_stats_interval"] > 0:
+            self.report_tailer_stats.change_interval(seconds=config.webhook["log_stats_interval"])
+            self.report_tailer_stats.start()
+
+        self.reorder_actions.change_interval(seconds=config.webhook["reorder_interval"])
+        self.reorder_actions.start()
+
+        if config.webhook["reload_actions_on_change"]:
+            self.watch_config.start()
+
     async def cog_unload(self):
+        if self.report_tailer_stats.is_running():
+            self.report_tailer_stats.cancel()
+        if self.reorder_actions.is_running():
+            self.reorder_actions.cancel()
+        if self.watch_config.is_running():
+            self.watch_config.cancel()
+
+        # Wait for the task to drain its actions, save the checkpoint and close the spool, otherwise
+        # a reloaded cog would start from the old checkpoint and send those lines again.
         self.webhook_task.cancel()
-        
+        try:
+            await self.webhook_task
+        except asyncio.CancelledError:
+            pass
+
 
 async def setup(bot: discord.ext.commands.Bot):
     await bot.add_cog(WebhookCog(bot))
\ No newline at end of file
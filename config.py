@@ -77,6 +77,9 @@ tmux_data = dict(
 
 webhook = dict(
     # Your webhook url. Be careful not to commit this.
+    # This can also be a list of urls of webhooks in the same channel, to send
+    # more messages than Discord allows through one webhook. Everything from
+    # one player goes through the same webhook, so it stays in order.
     url = "",
 
     # Regexes that the webhook checks for in the log file in order to send
@@ -117,6 +120,185 @@ webhook = dict(
         not_whitelisted = "",
     ),
 
+    # Text that a line must contain for each regex above to match it, ie:
+    # "joined the game" for player_joined. Lines which contain none of these
+    # are skipped without running any regex. Leave empty to work it out from
+    # the regex automatically, which is usually good enough.
+    regex_literals = dict(
+        player_message_noreply = "",
+        player_message_reply = "",
+        player_joined = "",
+        player_left = "",
+        server_starting = "",
+        server_started = "",
+        server_stopping = "",
+        server_list = "",
+        console_message = "",
+        advancement = "",
+        not_whitelisted = "",
+    ),
+
+    # If True, the regexes above are matched against only the message of each
+    # line, the part after the "[time] [thread/LEVEL] [logger]: " prefix (or
+    # "[time LEVEL]: " on Paper), so they do not each have to match the prefix
+    # again. The prefix is split off once per line. ie: player_joined could
+    # then be "^(\w+) joined the game$". Counting the split, this is about as
+    # fast as matching whole lines (bench_matcher measured 0.8x to 1.12x), so
+    # turn it on for the simpler regexes, not for speed.
+    match_message_only = False,
+
+    # Only run a regex above on lines whose prefix matches these, ie:
+    # player_joined = dict(thread = "Server thread", level = "INFO"). Lines
+    # can be filtered on "time", "thread", "level" and "logger", and a list of
+    # values allows any of them. "logger" is only in Forge logs, and "thread"
+    # is not in Paper logs. Leave empty to run the regex on every line.
+    action_filters = dict(
+        player_message_noreply = dict(),
+        player_message_reply = dict(),
+        player_joined = dict(),
+        player_left = dict(),
+        server_starting = dict(),
+        server_started = dict(),
+        server_stopping = dict(),
+        server_list = dict(),
+        console_message = dict(),
+        advancement = dict(),
+        not_whitelisted = dict(),
+    ),
+
+    # Which regex engine to use for the regexes above. Player chat is part of
+    # the lines being checked, so a regex which can backtrack catastrophically
+    # (ie: "(\w+\s?)*$") could be made to hang the bot with the right message.
+    # "re": Python's own engine.
+    # "re2": Google's re2 (pip install google-re2), which always runs in linear
+    #        time, for every regex it supports.
+    # "auto": re2 for just the regexes which look like they may backtrack
+    #         badly (if re2 is installed), re for the rest.
+    regex_backend = "auto",
+
+    # How long (in seconds) a single regex may take on a single line before it
+    # counts as a strike against it. A regex with regex_budget_strikes strikes
+    # within regex_strike_window seconds is quarantined (not checked anymore)
+    # until the action is enabled again with /actions. Older strikes are
+    # forgotten, so the odd hiccup of a busy host does not add up over time
+    # (0 never forgets them). Most regexes are only timed, not interrupted.
+    # The ones which look like they may backtrack badly but are not on re2
+    # (ie: it is not installed) are checked in a separate process instead,
+    # which is stopped once it takes this long. That process needs a POSIX
+    # system (ie: Linux), elsewhere those regexes are quarantined straight
+    # away. Set to 0 to not time anything, which leaves them unguarded.
+    regex_time_budget = 0.05,
+    regex_budget_strikes = 2,
+    regex_strike_window = 10 * 60,
+
+    # Matched lines are queued and their actions (ie: sending to Discord) are
+    # run in the background, so reading the log never waits on Discord.
+    # Actions about one player (or about the server) always run in order, but
+    # with more than one worker, actions about different players can run at
+    # the same time and be posted out of order.
+    dispatch_workers = 1,
+
+    # How many actions can wait at once, and what happens to the next one
+    # when that many are waiting:
+    # "block": wait for space, which holds up reading the log.
+    # "drop_oldest": throw away the action that has waited longest.
+    # "coalesce": replace a waiting action of the same kind, for the actions
+    #             in dispatch_coalesce_actions. Otherwise wait like "block".
+    dispatch_queue_size = 1000,
+    dispatch_overflow = "block",
+    dispatch_coalesce_actions = ("server_list",),
+
+    # How long (in seconds) to wait for queued actions to run when shutting down.
+    dispatch_drain_timeout = 10,
+
+    # Messages are queued and sent to the webhook one at a time, server state
+    # (starting, started, stopping and the player list) first, then chat and
+    # console messages, then joins, leaves and advancements.
+    # Sends are spread out to stay under these (messages, seconds) limits, so
+    # bursts are paced instead of running into Discord's rate limits. Discord
+    # allows around 5 messages every 2 seconds per webhook, and 30 a minute
+    # per channel, which is shared by all the webhooks in the url list.
+    rate_limits = ((5, 2),),
+    channel_rate_limits = ((30, 60),),
+
+    # How many messages can wait to be sent. After that, the oldest message of
+    # the least important kind is dropped.
+    max_backlog = 500,
+
+    # How many times to try sending a message when Discord cannot be reached
+    # or has a problem of its own, waiting twice as long every time.
+    max_send_attempts = 5,
+
+    # With several webhook urls, a webhook which fails this many sends in a
+    # row (ie: it was deleted) is skipped for webhook_failover_cooldown
+    # seconds, and its queued messages are sent through the others.
+    webhook_failure_threshold = 3,
+    webhook_failover_cooldown = 60,
+
+    # One HTTP session is shared by the webhooks and the avatar lookups, and
+    # keeps connections open between requests. At most this many are open
+    # at once, in total and to any one host (ie: Discord or Mojang).
+    http_connection_limit = 100,
+    http_connection_limit_per_host = 10,
+
+    # How long (in seconds) an idle connection is kept open, and how long a
+    # looked up address is remembered.
+    http_keepalive_timeout = 60,
+    http_dns_cache_time = 300,
+
+    # How long (in seconds) a request may take in total, and to connect.
+    http_timeout = 15,
+    http_connect_timeout = 5,
+
+    # Every message is written to this directory before it is sent, and
+    # marked as done once Discord has it, so messages still waiting when the
+    # bot stops (or that could not be sent while Discord was down) are sent
+    # later instead of being lost. Set to "" to not keep them.
+    spool_location = "webhook_spool",
+
+    # How often (in seconds) the spool is synced to the disk. A message
+    # queued less than this long before a crash may be lost.
+    spool_flush_interval = 0.05,
+
+    # Size (in bytes) at which the spool starts a new file. Files are deleted
+    # once every message in them has been sent.
+    spool_segment_size = 1024 * 1024,
+
+    # Chat messages from a player that come within this many seconds of each
+    # other are sent as one post, one message per line, which uses less of
+    # the webhook's rate limit when someone sends a lot of short messages.
+    # Messages wait for up to this long before being sent. Set to 0 to send
+    # every message on its own straight away.
+    chat_coalesce_window = 0,
+
+    # The longest (in seconds) the first message of a post may be held for,
+    # however much the player keeps talking, and the longest a post may get.
+    # Discord does not allow more than 2000 characters in a message.
+    chat_coalesce_max_latency = 3.0,
+    chat_coalesce_max_length = 2000,
+
+    # Joins, leaves and players who are not whitelisted are sent straight
+    # away when things are quiet, but any more of the same kind within this
+    # many seconds are collected and sent as one embed ("Alice, Bob and 12
+    # others joined the game.") at the end of the window. Useful after a
+    # restart, when everyone rejoins at once. Set an event to 0 to send
+    # every one on its own.
+    event_aggregation_windows = dict(
+        player_join = 10,
+        player_leave = 10,
+        player_not_whitelisted = 30,
+    ),
+
+    # The most players to name in one of those embeds, the rest are counted.
+    event_aggregation_max_names = 10,
+
+    # Whether to reload the regexes and actions when this file is saved. They
+    # can also be reloaded with /reload-actions. Only regex, regex_literals,
+    # action_filters, match_message_only, regex_backend, regex_time_budget,
+    # regex_budget_strikes, regex_strike_window, actions_enabled and
+    # adaptive_ordering are reloaded, everything else still needs a restart.
+    reload_actions_on_change = False,
+
     # The webhook actions that are enabled and searched for in the logs.
     # If set to false, the event will not be sent to Discord.
     actions_enabled = dict(
@@ -133,12 +315,57 @@ webhook = dict(
         not_whitelisted = True,
     ),
 
+    # Whether to check the actions that match most often (usually chat) first,
+    # instead of in a fixed order. Only turn this on if no log line can match
+    # more than one of the regexes above, otherwise which action runs for such
+    # a line may change. player_message_reply is always checked right before
+    # player_message_noreply.
+    adaptive_ordering = False,
+
+    # How often (in seconds) hit counts are updated and, if adaptive_ordering
+    # is on, the actions are reordered.
+    reorder_interval = 60,
+
+    # Whether to time every regex and action from startup. Profiling can also
+    # be turned on and off with /profile-actions, and costs a few timer calls
+    # per line while on. Nothing is timed while it is off.
+    profile_actions = False,
+
     # The name of the server, displayed when events like shutdowns or player joins occur.
     server_name = "Minecraft Server",
 
     # Absolute path to the latest log location.
     latest_log_location = "/somewhere/latest.log",
 
+    # How often (in seconds) to check latest.log for new lines when inotify is
+    # not available (ie: not on Linux). On Linux, the bot sleeps until the log
+    # is actually written to instead.
+    log_poll_interval = 0.01,
+
+    # How often (in seconds) to log the log tailer's statistics (lines per
+    # second, wakeups per second and CPU usage). Set to 0 to disable.
+    log_stats_interval = 300,
+
+    # The maximum amount of log lines to process before letting the rest of
+    # the bot run. Bursts of lines larger than this are split into batches.
+    max_batch_lines = 500,
+
+    # File used to remember how far into latest.log the bot has read, so that
+    # events logged while the bot was restarting (or the cog was reloading)
+    # are still sent. Set to None to always start from the end of the log.
+    log_checkpoint_location = "log_checkpoint.json",
+
+    # How often (in seconds) the checkpoint is saved while reading the log.
+    log_checkpoint_interval = 5,
+
+    # The maximum amount of log (in bytes) to replay when resuming from a
+    # checkpoint. If more than this was missed, only the newest part is sent.
+    max_replay_bytes = 256 * 1024,
+
+    # Checkpoints saved longer ago than this (in seconds) are ignored, and the
+    # bot starts from the end of the log instead.
+    max_replay_age = 15 * 60,
+
     # Set this to True if the minecraft version supports tellraw "insertion"
     # values. This allows players to click on discord usernames to reply to
     # them.
@@ -164,6 +391,30 @@ icons = dict(
     avatar_lookup_url = "https://crafatar.com/avatars/",
     uuid_lookup_url = "https://api.mojang.com/users/profiles/minecraft/",
 
+    # Takes a JSON list of up to 10 names, and answers with the profiles of
+    # the ones which exist. Used to look up the players who joined within
+    # uuid_lookup_batch_window seconds of each other in one go, before they
+    # say anything. Set to None to look every player up on their own.
+    uuid_bulk_lookup_url = "https://api.minecraftservices.com/minecraft/profile/lookup/bulk/byname",
+    uuid_lookup_batch_window = 0.5,
+
+    # Whether to look up the UUIDs of players in the server's usercache.json
+    # (in the server root) before asking Mojang.
+    use_usercache = True,
+
+    # File the UUIDs of players are saved to, so their avatars can be shown
+    # without asking Mojang again after a restart. Set to None to only keep
+    # them in memory.
+    avatar_cache_location = "avatar_cache.json",
+
+    # How many players to remember, and for how long (in seconds). Players
+    # which Mojang does not know (ie: offline mode or renamed accounts) are
+    # remembered for avatar_cache_negative_ttl, so they are asked about again
+    # sooner.
+    avatar_cache_size = 1000,
+    avatar_cache_ttl = 7 * 24 * 60 * 60,
+    avatar_cache_negative_ttl = 15 * 60,
+
     # Minecraft server icon. Currently not used.
     server = "http://media.fatboychummy.games/bots/mc_bridge/server_status.png",
 
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+
+class LogLine:
+    """
+        A log line split into its prefix and message.
+
+        Handles the layouts vanilla, Forge and Paper servers write:
+            [14:03:03] [Server thread/INFO]: message
+            [14:03:03] [Server thread/INFO] [minecraft/DedicatedServer]: message
+            [16Jan2023 14:03:03.123] [Server thread/INFO] [net.minecraft.server.MinecraftServer/]: message
+            [14:03:03 INFO]: message
+
+        Only the message is split off when the line is created, since that is
+        all most lines need. The prefix's fields (time, thread, level and
+        logger) are parsed the first time one of them is used. Fields which
+        are not in the line's layout are None. If the prefix is not recognised
+        at all, every field is None and the message is the whole line.
+    """
+    __slots__ = ("raw", "message", "prefix", "_fields")
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self._fields = None
+
+        # The prefix always ends at the first "]: ", nothing before it can contain one.
+        end = raw.find("]: ") if raw.startswith("[") else -1
+        if end < 0:
+            self.prefix = None
+            self.message = raw.rstrip("\r\n")
+        else:
+            self.prefix = raw[:end + 1]
+            self.message = raw[end + 3:].rstrip("\r\n")
+
+    @property
+    def time(self):
+        return (self._fields or self._parse())[0]
+
+    @property
+    def thread(self):
+        return (self._fields or self._parse())[1]
+
+    @property
+    def level(self):
+        return (self._fields or self._parse())[2]
+
+    @property
+    def logger(self):
+        return (self._fields or self._parse())[3]
+
+    def _parse(self):
+        self._fields = parse_prefix(self.prefix) if self.prefix else (None, None, None, None)
+        return self._fields
+
+    def __repr__(self):
+        return f"LogLine(time={self.time!r}, thread={self.thread!r}, level={self.level!r}, logger={self.logger!r}, message={self.message!r})"
+
+
+def parse_prefix(prefix: str):
+    """Split a prefix like "[14:03:03] [Server thread/INFO] [minecraft/DedicatedServer]" into (time, thread, level, logger)."""
+    fields = prefix[1:-1].split("] [")
+
+    if len(fields) == 1:
+        # Paper: [HH:MM:SS LEVEL]
+        time, _, level = fields[0].rpartition(" ")
+        if not time:
+            return None, None, None, None
+        return time, None, level, None
+
+    # Vanilla and Forge: [time] [thread/LEVEL] then an optional [logger].
+    thread, _, level = fields[1].rpartition("/")
+    if not thread:
+        return None, None, None, None
+    return fields[0], thread, level, "] [".join(fields[2:]) or None
@@ -0,0 +1,592 @@
+from __future__ import annotations
+import asyncio
+import collections
+import ctypes
+import ctypes.util
+import errno
+import glob
+import gzip
+import io
+import json
+import os
+import struct
+import time
+import logging
+
+LOG = logging.getLogger("LOG_TAILER")
+
+# inotify event masks, from <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Events on the watched directory itself which mean the watch is gone.
+WATCH_LOST = IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+
+# Events on the log file's name which mean it was (re)created, moved or removed.
+PATH_CHANGED = IN_CREATE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")
+
+# Minimum amount of time between attempts to (re)arm the inotify watch while polling.
+REARM_INTERVAL = 1.0
+
+# Size of a single read from the log file.
+READ_CHUNK = 64 * 1024
+
+# Minimum amount of time between checks for log rotation while polling.
+ROTATION_CHECK_INTERVAL = 1.0
+
+# Amount of bytes at the start of a log used to recognise it after it was rotated and compressed.
+HEAD_SIZE = 256
+
+# How many of the newest rotated (.log.gz) logs to search when catching up.
+ROTATED_SEARCH_LIMIT = 5
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+
+class _Inotify:
+    """Minimal ctypes wrapper around an inotify instance watching a single directory."""
+
+    def __init__(self, directory: str):
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        mask = IN_MODIFY | IN_CLOSE_WRITE | PATH_CHANGED | IN_DELETE_SELF | IN_MOVE_SELF
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch failed for {directory}")
+
+    def read_events(self):
+        """Read all pending events, returning a list of (mask, name) tuples."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "replace")
+                offset += length
+                events.append((mask, name))
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class LogWatcher:
+    """
+        Wakes the log reader up when the log file is written to.
+
+        On Linux this watches the log's parent directory with inotify, so the
+        reader sleeps until the server actually writes something. Anywhere else
+        (or if the watch cannot be set up) it falls back to polling every
+        `poll_interval` seconds.
+    """
+
+    def __init__(self, path: str, poll_interval: float):
+        self.path = path
+        self.directory, self.filename = os.path.split(os.path.abspath(path))
+        self.poll_interval = poll_interval
+
+        self._inotify = None
+        self._event = asyncio.Event()
+        self._last_arm_attempt = 0.0
+        self._last_path_check = 0.0
+        self._check_path = True
+
+        # Statistics, see report().
+        self.lines = 0
+        self.wakeups = 0
+        self._last_report = (time.monotonic(), time.process_time(), 0, 0)
+
+    @property
+    def mode(self):
+        return "inotify" if self._inotify else "polling"
+
+    def start(self):
+        self._arm()
+        if not self._inotify:
+            LOG.info(f"inotify unavailable, polling the log every {self.poll_interval} seconds.")
+
+    def _arm(self):
+        self._last_arm_attempt = time.monotonic()
+        if _libc is None:
+            return
+
+        try:
+            self._inotify = _Inotify(self.directory)
+        except OSError as e:
+            LOG.debug(f"Failed to set up inotify watch: {e}")
+            self._inotify = None
+            return
+
+        asyncio.get_running_loop().add_reader(self._inotify.fd, self._on_readable)
+        LOG.info(f"Watching {self.directory} with inotify.")
+
+        # Anything may have happened while we were not watching.
+        self._event.set()
+
+    def _disarm(self):
+        if self._inotify:
+            asyncio.get_running_loop().remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+
+    def _on_readable(self):
+        try:
+            events = self._inotify.read_events()
+        except OSError as e:
+            LOG.warning(f"Failed to read inotify events, falling back to polling: {e}")
+            self._disarm()
+            self._event.set()
+            return
+
+        for mask, name in events:
+            if mask & WATCH_LOST:
+                LOG.warning("Log directory watch lost, falling back to polling.")
+                self._disarm()
+                self._event.set()
+                return
+            if mask & IN_Q_OVERFLOW or name == self.filename:
+                self._event.set()
+
+    async def wait(self):
+        """Wait until the log file (probably) has something new to read."""
+        if self._inotify:
+            await self._event.wait()
+        else:
+            await asyncio.sleep(self.poll_interval)
+            if time.monotonic() - self._last_arm_attempt >= REARM_INTERVAL:
+                self._arm()
+
+        self._event.clear()
+        self.wakeups += 1
+
+        # inotify only wakes us up for the log itself, so it is always worth checking the path after a
+        # wakeup. When polling, that would be a stat() every few milliseconds, so do it less often.
+        if self._inotify or time.monotonic() - self._last_path_check >= ROTATION_CHECK_INTERVAL:
+            self._check_path = True
+
+    def should_check_path(self):
+        """Whether the log's path should be checked for rotation. Meant to be called after a read came back empty."""
+        if not self._check_path:
+            return False
+
+        self._check_path = False
+        self._last_path_check = time.monotonic()
+        return True
+
+    def report(self):
+        """Return a summary of the tailer's activity since the last report."""
+        now, cpu = time.monotonic(), time.process_time()
+        last_now, last_cpu, last_lines, last_wakeups = self._last_report
+        self._last_report = (now, cpu, self.lines, self.wakeups)
+
+        elapsed = max(now - last_now, 1e-9)
+        return (
+            f"Log tailer ({self.mode}): "
+            f"{(self.lines - last_lines) / elapsed:.1f} lines/s, "
+            f"{(self.wakeups - last_wakeups) / elapsed:.1f} wakeups/s, "
+            f"process CPU {(cpu - last_cpu) / elapsed * 100:.2f}% over the last {elapsed:.0f}s."
+        )
+
+    def close(self):
+        self._disarm()
+
+
+class LogTailer:
+    """
+        Reads complete lines out of the log file in batches.
+
+        Everything that is available is read in as few buffered reads as
+        possible and split into lines. A line which the server has only
+        partially written is held back until the rest of it arrives. At most
+        `max_batch_lines` lines are returned at a time, so a large burst (ie:
+        a modded server starting up) cannot hold up the event loop.
+
+        Rotation is detected by the log's (st_dev, st_ino) changing. The old
+        file is read to the end before switching to the new one, and if the
+        old file can no longer be read, the rest of it is read from its
+        compressed copy in the logs folder instead.
+
+        `offset` is how far into the current log the lines returned so far go,
+        which is what gets saved by TailCheckpoint.
+
+        Waiting (for the log to exist, or for new lines) is done through the
+        `watcher`, so the rest of the bot keeps running while the server is
+        offline or idle.
+    """
+
+    def __init__(self, path: str, watcher: LogWatcher, max_batch_lines: int):
+        self.path = path
+        self.watcher = watcher
+        self.max_batch_lines = max_batch_lines
+        self.file = None
+        self._pending = collections.deque()
+        self._next_file = None
+        self._missing = False
+
+    def _try_open(self):
+        try:
+            return open(self.path, "rb")
+        except FileNotFoundError:
+            return None
+
+    async def open(self):
+        """Open the log, waiting for it to exist if needed."""
+        f = self._try_open()
+        if f is None:
+            LOG.info(f"Waiting for latest.log to exist ({self.path}).")
+        while f is None:
+            await self.watcher.wait()
+            f = self._try_open()
+
+        LOG.info("Log opened.")
+        self._attach(f)
+
+    def _attach(self, f):
+        self.file = f
+        self.position = f.tell()
+        self.offset = self.position
+        self._partial = b""
+        self._finished = False
+
+        st = os.fstat(f.fileno())
+        self.identity = (st.st_dev, st.st_ino)
+        self._head = os.pread(f.fileno(), HEAD_SIZE, 0) if self.position else b""
+
+    def resume(self, state, max_replay_bytes: int, max_replay_age: float):
+        """
+            Pick up where a previous run left off, given the state it saved. At
+            most `max_replay_bytes` are replayed, counting the rest of the old
+            log if it was rotated in the meantime. Without a usable
+            checkpoint, reading starts from the end of the log.
+        """
+        size = os.fstat(self.file.fileno()).st_size
+        start = size
+
+        if state is None:
+            LOG.info("No log checkpoint, starting from the end of the log.")
+        elif time.time() - state["time"] > max_replay_age:
+            LOG.info("Log checkpoint is too old, starting from the end of the log.")
+        elif (state["dev"], state["ino"]) == self.identity and state["offset"] <= size:
+            start = state["offset"]
+        elif size <= max_replay_bytes:
+            start = 0
+
+            # The log was rotated while we were gone. Catch up on the rest of the old one first.
+            head = bytes.fromhex(state["head"])
+            rotated = self._open_rotated(head, state["offset"])
+            if rotated and self._cap_rotated(rotated, state["offset"], max_replay_bytes - size):
+                self.file.seek(0)
+                self._next_file = self.file
+                self.file = rotated
+                self.identity = (state["dev"], state["ino"])
+                self.position = self.offset = rotated.tell()
+                self._head = head
+                self._finished = True
+                return
+            if rotated:
+                rotated.close()
+                start = size
+        else:
+            LOG.warning("Log was rotated while we were gone and more than max_replay_bytes was missed, starting from the end of the log.")
+
+        self.file.seek(start)
+        if size - start > max_replay_bytes:
+            LOG.warning(f"Skipping {size - start - max_replay_bytes} bytes of the log, more than max_replay_bytes was missed.")
+            self.file.seek(size - max_replay_bytes)
+            self.file.readline() # Skip to the start of the next line.
+
+        self.position = self.offset = self.file.tell()
+        if start < size:
+            LOG.info(f"Resuming from the log checkpoint, replaying {size - self.offset} bytes.")
+
+    def _cap_rotated(self, rotated, position: int, max_bytes: int):
+        """
+            Skip forward in a rotated log opened at `position`, so at most
+            `max_bytes` of it are left to read. Returns False if that could not
+            be done, in which case none of it should be replayed.
+        """
+        try:
+            # The gzip trailer has the size of the contents (modulo 4GiB, which is plenty for a log).
+            with open(rotated.name, "rb") as f:
+                f.seek(-4, os.SEEK_END)
+                length = int.from_bytes(f.read(4), "little")
+            if length < position:
+                LOG.warning("Could not tell how much of the rotated log is left, starting from the end of the log.")
+                return False
+
+            skip = length - position - max_bytes
+            if skip > 0:
+                if max_bytes <= 0:
+                    LOG.warning("Log was rotated while we were gone and more than max_replay_bytes was missed, starting from the end of the log.")
+                    return False
+                LOG.warning(f"Skipping {skip} bytes of the rotated log, more than max_replay_bytes was missed.")
+                rotated.seek(length - max_bytes) # Decompresses in small chunks, not all at once.
+                rotated.readline() # Skip to the start of the next line.
+        except (OSError, EOFError) as e:
+            LOG.warning(f"Failed to read the rotated log ({e}), starting from the end of the log.")
+            return False
+        return True
+
+    def state(self):
+        """The state to save in a checkpoint, so a later run can resume from here."""
+        if len(self._head) < HEAD_SIZE and not self._finished:
+            self._head = os.pread(self.file.fileno(), HEAD_SIZE, 0)
+
+        return dict(
+            dev=self.identity[0],
+            ino=self.identity[1],
+            offset=self.offset,
+            head=self._head.hex(),
+        )
+
+    def rotated(self, check_path: bool) -> bool:
+        """
+            Check whether the log was replaced and a new one needs to be opened.
+            The path itself is only checked if `check_path` is set.
+        """
+        if self._next_file is not None:
+            return False # Already switching over.
+        if self._finished:
+            return True # The current file was lost, see _read().
+        if not check_path:
+            return False
+
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if not self._missing:
+                LOG.info("Log was rotated away, waiting for the new one.")
+            self._missing = True
+            return True
+        self._missing = False
+
+        if (st.st_dev, st.st_ino) != self.identity:
+            LOG.info("Log was rotated.")
+            return True
+
+        if st.st_size < self.position:
+            LOG.info("Log was truncated, reading from the start.")
+            self.file.seek(0)
+            self.position = self.offset = 0
+            self._partial = b""
+            self._head = b""
+
+        return False
+
+    def reopen(self, f):
+        """Switch to a new log file once everything left in the current one has been read."""
+        self._next_file = f
+
+    def _switch(self):
+        self.file.close()
+        self._attach(self._next_file)
+        self._next_file = None
+
+    def _open_rotated(self, head: bytes, position: int):
+        """Find the compressed copy of the log starting with `head`, and open it at `position`."""
+        if not head:
+            return None
+
+        def mtime(segment):
+            try:
+                return os.path.getmtime(segment)
+            except OSError:
+                return 0
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        segments = sorted(glob.glob(os.path.join(glob.escape(directory), "*.log.gz")), key=mtime, reverse=True)
+        for segment in segments[:ROTATED_SEARCH_LIMIT]:
+            try:
+                g = gzip.open(segment, "rb")
+                if g.read(len(head)) != head:
+                    g.close()
+                    continue
+
+                # Skip over what was already read, without decompressing it all at once.
+                remaining = position - len(head)
+                while remaining > 0:
+                    data = g.read(min(READ_CHUNK, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+
+                LOG.info(f"Catching up from rotated log {segment}.")
+                return g
+            except (OSError, EOFError) as e:
+                LOG.debug(f"Skipping rotated log {segment}: {e}")
+
+        return None
+
+    def _read(self):
+        try:
+            return self.file.read(READ_CHUNK)
+        except (OSError, EOFError) as e:
+            self.file.close()
+            if self._finished:
+                LOG.error(f"Failed to read the rotated copy of the log ({e}), some lines may have been lost.")
+                self.file = io.BytesIO()
+                return b""
+
+            LOG.warning(f"Failed to read the log ({e}), looking for its rotated copy.")
+            rotated = self._open_rotated(self._head, self.position)
+            if rotated is None:
+                LOG.error("Could not find the rotated copy of the log, some lines may have been lost.")
+                rotated = io.BytesIO()
+
+            # Whatever we are reading now is finished, so the next time we run out a new log is needed.
+            self.file = rotated
+            self._finished = True
+            return self.file.read(READ_CHUNK)
+
+    def _fill(self):
+        while len(self._pending) < self.max_batch_lines:
+            chunk = self._read()
+            if not chunk:
+                if self._next_file is None:
+                    return
+
+                # The old file is finished, so a partial line at the end of it is not going to be completed.
+                if self._partial:
+                    self._pending.append(self._partial)
+                    self._partial = b""
+                if self._pending:
+                    return
+
+                self._switch()
+                continue
+
+            if len(self._head) < HEAD_SIZE and len(self._head) == self.position:
+                self._head += chunk[:HEAD_SIZE - len(self._head)]
+            self.position += len(chunk)
+
+            data = self._partial + chunk
+            end = data.rfind(b"\n") + 1
+            self._partial = data[end:]
+            if end:
+                self._pending.extend(data[:end - 1].split(b"\n"))
+
+            # A short read means we have caught up with the server.
+            if len(chunk) < READ_CHUNK and self._next_file is None:
+                return
+
+    async def read_batch(self) -> list[str]:
+        """Return the next batch of complete lines, waiting until there is at least one."""
+        while True:
+            lines = self._read_lines()
+            if lines:
+                return lines
+
+            if self.rotated(self.watcher.should_check_path()):
+                f = self._try_open()
+                if f:
+                    LOG.info("Log opened.")
+                    self.reopen(f)
+                    continue
+
+            await self.watcher.wait()
+
+    def _read_lines(self):
+        if len(self._pending) < self.max_batch_lines:
+            self._fill()
+
+        pending = self._pending
+        lines = []
+        offset = self.offset
+        for _ in range(min(len(pending), self.max_batch_lines)):
+            line = pending.popleft()
+            offset += len(line) + 1
+            lines.append(line.rstrip(b"\r").decode("utf-8", "replace") + "\n")
+
+        self.offset = offset
+        return lines
+
+
+class TailCheckpoint:
+    """
+        Saves the tailer's position in the log to a small state file, so the
+        next run (or cog reload) can continue from it instead of skipping
+        everything logged in between.
+
+        The file is replaced atomically (written to a temporary file which is
+        then renamed over it), and written at most once every `interval`
+        seconds, so one fsync covers every line read in that time.
+    """
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self._saved = None
+        self._last_save = 0.0
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            LOG.warning(f"Failed to load log checkpoint: {e}")
+            return None
+
+        if not all(key in state for key in ("dev", "ino", "offset", "head", "time")):
+            LOG.warning("Ignoring malformed log checkpoint.")
+            return None
+
+        self._saved = {key: state[key] for key in ("dev", "ino", "offset", "head")}
+        return state
+
+    def save(self, state: dict, force: bool = False):
+        now = time.monotonic()
+        if state == self._saved or (not force and now - self._last_save < self.interval):
+            return
+
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(dict(state, time=time.time()), f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            LOG.warning(f"Failed to save log checkpoint: {e}")
+            return
+
+        self._saved = state
+        self._last_save = now
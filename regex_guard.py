@@ -0,0 +1,152 @@
+from __future__ import annotations
+import json
+import os
+import re
+import select
+import subprocess
+import sys
+import time
+import logging
+
+LOG = logging.getLogger("REGEX_GUARD")
+
+# How long the worker may take to start and compile its regexes, in seconds.
+START_TIMEOUT = 5.0
+
+
+class RegexGuard:
+    """
+        Runs regexes in a separate process, so a search which backtracks
+        catastrophically can be stopped. Python's regexes cannot be
+        interrupted, so this is the only way to put a hard limit on them.
+
+        search() sends the line to the worker and waits at most `timeout`
+        seconds for it to say whether the regex matched. If it does not
+        answer in time, the worker is killed and the search counts as not
+        matching. A new worker is started by the next start() (or search()).
+
+        Only the answer comes back, not the match, so a regex which matched
+        has to be run again by the caller to get it. That costs about as
+        long as it took the worker, so it is still within the timeout.
+
+        The worker is a plain `python regex_guard.py` talking JSON lines over
+        its stdin and stdout, which keeps the bot's own modules (and main.py)
+        out of it. Waiting for it needs select() on a pipe, so this only works
+        on POSIX systems.
+    """
+
+    def __init__(self, patterns: list[str], timeout: float):
+        self.patterns = patterns
+        self.timeout = timeout
+        self._process = None
+        self._buffer = b""
+
+        # Statistics, see report().
+        self.searches = 0
+        self.timeouts = 0
+        self.starts = 0
+
+    @property
+    def running(self):
+        return self._process is not None
+
+    def start(self):
+        """Start the worker if it is not running. Returns False if it could not be started."""
+        if self._process:
+            return True
+        if os.name != "posix":
+            LOG.error("Regexes can only be checked in a separate process on POSIX systems.")
+            return False
+
+        try:
+            self._process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+            self._send(self.patterns)
+            if self._receive(START_TIMEOUT) != b"ready":
+                raise OSError("the worker did not start")
+        except OSError as e:
+            LOG.error(f"Failed to start the regex worker process: {e}")
+            self._kill()
+            return False
+
+        self.starts += 1
+        return True
+
+    def _send(self, value):
+        self._process.stdin.write(json.dumps(value).encode() + b"\n")
+        self._process.stdin.flush()
+
+    # Read the next line from the worker, or return None if there is none within `timeout` seconds.
+    def _receive(self, timeout: float):
+        fd = self._process.stdout.fileno()
+        deadline = time.monotonic() + timeout
+        while b"\n" not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select((fd,), (), (), remaining)[0]:
+                return None
+            data = os.read(fd, 4096)
+            if not data:
+                return None # The worker died.
+            self._buffer += data
+
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line
+
+    def search(self, index: int, input: str):
+        """Whether the regex at `index` matches `input`. False if it did not finish within the timeout."""
+        if not self.start():
+            return False
+
+        self.searches += 1
+        try:
+            self._send((index, input))
+        except OSError as e:
+            LOG.warning(f"Lost the regex worker process ({e}), starting a new one.")
+            self._kill()
+            return False
+
+        answer = self._receive(self.timeout)
+        if answer is None:
+            self.timeouts += 1
+            LOG.warning(f"Stopped the regex '{self.patterns[index]}', it took longer than {self.timeout * 1000:.0f}ms.")
+            self._kill()
+            return False
+        return answer == b"1"
+
+    def _kill(self):
+        if self._process:
+            self._process.kill()
+            self._process.wait()
+            for pipe in (self._process.stdin, self._process.stdout):
+                try:
+                    pipe.close()
+                except OSError:
+                    pass # Whatever was left to write to the dead worker.
+            self._process = None
+        self._buffer = b""
+
+    def close(self):
+        self._kill()
+
+    def report(self):
+        """Return a summary of the guarded searches so far."""
+        return f"Regex guard: {self.searches} searches, {self.timeouts} stopped after {self.timeout * 1000:.0f}ms, {self.starts} worker starts."
+
+
+def _serve():
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    regexes = [re.compile(pattern) for pattern in json.loads(stdin.readline())]
+    stdout.write(b"ready\n")
+    stdout.flush()
+
+    for line in stdin:
+        index, input = json.loads(line)
+        stdout.write(b"1\n" if regexes[index].search(input) else b"0\n")
+        stdout.flush()
+
+
+if __name__ == "__main__":
+    _serve()
@@ -0,0 +1,75 @@
+from __future__ import annotations
+import json
+import re
+import logging
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Callable
+
+LOG = logging.getLogger("TELLRAW_TEMPLATE")
+
+# Stands in for a slot while a template is built. json escapes the NUL characters, so it cannot be mistaken for text.
+MARKER = "\0{}\0"
+MARKER_PATTERN = re.compile(r"\\u0000(\w+)\\u0000")
+
+# Escapes a string the same way json.dumps does inside the tellraw generator, without the quotes.
+_escape = json.encoder.encode_basestring_ascii
+
+# Awkward text to check templates with: quotes, backslashes, control characters, non-ASCII and characters outside the BMP.
+SAMPLES = ("", "plain", "\"quoted\" \\ back\\slash", "line\nbreak\ttab\r\x01", "ünïcödé ✓ 😀 </script>", "a" * 300)
+
+
+def combine(*fragments: str):
+    """Join rendered fragments into one tellraw argument, like MinecraftTellRawGenerator.multiple_tellraw."""
+    return '["",' + ",".join(fragments) + "]"
+
+
+class TellrawTemplate:
+    """
+        A list of tellraw components which is serialized once, leaving only
+        its slots (ie: the author and the message) to be escaped and spliced
+        in for every message.
+
+        `build` returns the components (MinecraftTellRawGenerator objects, or
+        strings from multiple_tellraw) for the values of the `slots`, as
+        keyword arguments. It is called once with markers for the values, and
+        the JSON around the markers is kept. render() gives the components
+        joined with commas, ready for combine().
+
+        Every template is checked against `build` with awkward text when it
+        is made. If they differ (ie: build does more with a value than put it
+        in a string), render() just calls build, so the output is always the
+        same as without the template.
+    """
+
+    def __init__(self, build: Callable, *slots: str):
+        self.build = build
+        self.slots = slots
+        self.compiled = True
+
+        pieces = MARKER_PATTERN.split(self._build(**{slot: MARKER.format(slot) for slot in slots}))
+        self._literals = pieces[0::2]
+        self._names = pieces[1::2]
+
+        for sample in SAMPLES:
+            values = {slot: sample + slot for slot in slots}
+            expected = self._build(**values)
+            if self.render(**values) != expected:
+                LOG.warning(f"Tellraw template '{build.__name__}' does not match its components, building them for every message instead.")
+                self.compiled = False
+                break
+
+    def _build(self, **values):
+        return ",".join(str(component) for component in self.build(**values))
+
+    def render(self, **values: str):
+        if not self.compiled:
+            return self._build(**values)
+
+        literals = self._literals
+        parts = [literals[0]]
+        for name, literal in zip(self._names, literals[1:]):
+            parts.append(_escape(values[name])[1:-1])
+            parts.append(literal)
+        return "".join(parts)
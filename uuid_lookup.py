@@ -0,0 +1,157 @@
+from __future__ import annotations
+import asyncio
+import logging
+
+import aiohttp
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from avatar_cache import AvatarCache
+
+LOG = logging.getLogger("UUID_LOOKUP")
+
+# Most names Mojang's bulk profile lookup takes in one request.
+MAX_BULK_NAMES = 10
+
+
+class UuidLookup:
+    """
+        Looks up the UUIDs of players through the Mojang API, saving what it
+        finds (or that a name has no UUID) in an AvatarCache.
+
+        Every name is only looked up once at a time: anyone else asking for it
+        meanwhile waits for the same request. Names asked for with
+        urgent=False (ie: prefetching when a player joins) are collected for
+        `batch_window` seconds, then looked up together with one request to
+        `bulk_url` per MAX_BULK_NAMES names, so a lot of players rejoining at
+        once does not mean a request each. An urgent lookup sends whatever is
+        collected straight away, along with its own name.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, cache: AvatarCache, url: str, bulk_url: str = None, batch_window: float = 0.5):
+        self.session = session
+        self.cache = cache
+        self.url = url
+        self.bulk_url = bulk_url
+        self.batch_window = batch_window
+
+        self._in_flight = dict() # Lowercase name -> future for its UUID.
+        self._batch = []
+        self._timer = None
+        self._tasks = set()
+
+        # Statistics, see report().
+        self.requests = 0
+        self.bulk_requests = 0
+        self.names = 0
+        self.shared = 0
+
+    def lookup(self, name: str, urgent: bool = True):
+        """Return a future for the UUID of a player, or None if they do not have one (or it could not be looked up)."""
+        key = name.lower()
+        future = self._in_flight.get(key)
+        if future:
+            self.shared += 1
+        else:
+            future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+            self._batch.append(name)
+
+        if urgent or len(self._batch) >= MAX_BULK_NAMES:
+            self._flush()
+        elif not self._timer:
+            self._timer = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if not self._batch:
+            return
+
+        names, self._batch = self._batch, []
+        task = asyncio.create_task(self._fetch(names))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, names: list):
+        results = dict()
+        try:
+            if len(names) == 1 or not self.bulk_url:
+                await asyncio.gather(*(self._fetch_one(name, results) for name in names))
+            else:
+                await asyncio.gather(*(
+                    self._fetch_bulk(names[i:i + MAX_BULK_NAMES], results)
+                    for i in range(0, len(names), MAX_BULK_NAMES)
+                ))
+        finally:
+            for name in names:
+                future = self._in_flight.pop(name.lower(), None)
+                if future and not future.done():
+                    future.set_result(results.get(name.lower()))
+
+    async def _fetch_one(self, name: str, results: dict):
+        LOG.info(f"Attempt to cache username: {name}")
+        self.requests += 1
+        self.names += 1
+        try:
+            async with self.session.get(self.url + name) as response:
+                if response.status == 200:
+                    uuid = (await response.json())["id"]
+                    LOG.info(f"200. UUID: {uuid}")
+                    self.cache.put(name, uuid)
+                    results[name.lower()] = uuid
+                    return
+
+                LOG.warning(f"Failed to cache username: {name} ({response.status})")
+                if response.status in (204, 404):
+                    # There is no such account (ie: offline mode), no point asking again for every message.
+                    self.cache.put(name, None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+            LOG.warning(f"Failed to cache username: {name} ({e!r})")
+
+    async def _fetch_bulk(self, names: list, results: dict):
+        LOG.info(f"Attempt to cache usernames: {', '.join(names)}")
+        self.requests += 1
+        self.bulk_requests += 1
+        self.names += len(names)
+        try:
+            async with self.session.post(self.bulk_url, json=names) as response:
+                if response.status != 200:
+                    LOG.warning(f"Failed to cache usernames: {', '.join(names)} ({response.status})")
+                    return
+                profiles = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            LOG.warning(f"Failed to cache usernames: {', '.join(names)} ({e!r})")
+            return
+
+        if not isinstance(profiles, list):
+            LOG.warning(f"Failed to cache usernames: {', '.join(names)} (expected a list of profiles, got {type(profiles).__name__})")
+            return
+        for profile in profiles:
+            if not isinstance(profile, dict) or not isinstance(profile.get("name"), str) or not isinstance(profile.get("id"), str):
+                LOG.warning(f"Skipping a malformed profile in the bulk lookup answer: {profile!r:.100}")
+                continue
+            results[profile["name"].lower()] = profile["id"]
+        for name in names:
+            # Names Mojang does not know are left out of the answer.
+            uuid = results.get(name.lower())
+            self.cache.put(name, uuid)
+
+    async def close(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        for task in self._tasks:
+            task.cancel()
+        for future in self._in_flight.values():
+            if not future.done():
+                future.set_result(None)
+        self._in_flight.clear()
+
+    def report(self):
+        """Return a summary of the lookups so far."""
+        return (
+            f"UUID lookups: {self.names} names in {self.requests} requests ({self.bulk_requests} bulk), "
+            f"{self.shared} lookups shared a request already in flight."
+        )
@@ -1,70 +1,115 @@
 from __future__ import annotations
 import re
 import time
-import os
+import collections
 import logging
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+try:
+    import re2 # Optional, a regex engine that runs in linear time.
+except ImportError:
+    re2 = None
+
+REGEX_ERRORS = (re.error, re2.error) if re2 else (re.error,)
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from typing import Callable
 
 from webhook_bridge import Bridge
-import config
-
-filesize = 0
+from log_line import LogLine
+from regex_guard import RegexGuard
 
 LOG = logging.getLogger("WEBHOOK_ACTIONS")
 
-def need_log_reopen():
-    global filesize
-    if not os.path.isfile(config.webhook["latest_log_location"]):
-        LOG.info("Reopen required.")
-        return True
-    new_size = os.path.getsize(config.webhook["latest_log_location"])
-    old_size = filesize
-    filesize = new_size
+# Finds backreferences to numbered groups (or named ones, which may also be duplicated between regexes).
+BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
 
-    return new_size < old_size
+# Repeat operators, whose contents are required if the minimum is at least one.
+REPEATS = tuple(getattr(sre_parse, op) for op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") if hasattr(sre_parse, op))
 
+# Parts of a LogLine's prefix an action can be filtered on.
+FILTER_FIELDS = ("time", "thread", "level", "logger")
 
-def open_latest_log():
-    printed = False
-    lll = config.webhook["latest_log_location"]
-    while not os.path.isfile(lll):
-        if not printed:
-            LOG.info(f"Waiting for latest.log to exist ({lll}).")
-        printed = True
-        time.sleep(0.1)
+class action_entry:
+    """A single regex, the function to run when it matches, and its state."""
+    __slots__ = (
+        "name", "pattern", "regex", "engine", "guarded", "on_match", "literal", "filters", "enabled", "quarantined", "overruns",
+        "hits", "recent_hits", "score", "skipped",
+        "tested", "matches", "match_time", "worst_match_time", "handler_calls", "handler_time", "worst_handler_time",
+    )
 
-    LOG.info("Log opened.")
-    return open(lll)
+    def __init__(self, pattern: str, on_match: Callable, literal: str = None, filters: dict = None):
+        self.name = on_match.__name__
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+        self.engine = "re"
+        self.guarded = None # Index of the regex in the action_list's RegexGuard, if it is run there.
+        self.on_match = on_match
+        self.literal = literal
+        self.filters = make_filters(filters)
+        self.enabled = True
+        self.quarantined = False # Set when the regex took too long on a line, see action_list.
+        self.overruns = collections.deque() # When the regex took longer than the time budget, within the strike window.
 
+        # Statistics.
+        self.hits = 0 # Lines matched in total.
+        self.recent_hits = 0 # Lines matched since the actions were last reordered.
+        self.score = 0.0 # Decaying hit count used to order the actions.
+        self.skipped = 0 # Lines the regex was not run on thanks to the prefilter.
+        self.reset_profile()
 
-class regex_action:
-    """Holds a regex and runs a function if the regex matches an input string"""
+    # Whether a parsed log line passes this entry's filters.
+    def accepts(self, line: LogLine):
+        for field, allowed in self.filters:
+            if getattr(line, field) not in allowed:
+                return False
+        return True
 
-    def __init__(self, regex: str, on_match):
-        self.regex = regex
-        self.on_match = on_match
-        self.name = on_match.__name__
-        self.enabled = True
+    def reset_profile(self):
+        # Only counted while profiling, see action_list.set_profiling().
+        self.tested = 0
+        self.matches = 0
+        self.match_time = 0.0
+        self.worst_match_time = 0.0
+        self.handler_calls = 0
+        self.handler_time = 0.0
+        self.worst_handler_time = 0.0
 
-    def get_enabled(self, name):
-        if self.name == name:
-            return self.enabled
-    
-    def enable(self, name):
-        if self.name == name or name == None:
-            self.enabled = True
-    
-    def disable(self, name):
-        if self.name == name or name == None:
-            self.enabled = False
+    def profile(self):
+        return dict(
+            enabled=self.enabled,
+            quarantined=self.quarantined,
+            engine=self.engine,
+            guarded=self.guarded is not None,
+            tested=self.tested,
+            matches=self.matches,
+            match_time=self.match_time,
+            worst_match_time=self.worst_match_time,
+            handler_calls=self.handler_calls,
+            handler_time=self.handler_time,
+            worst_handler_time=self.worst_handler_time,
+        )
+
+
+class regex_action:
+    """
+        Holds a regex and runs a function if the regex matches an input string.
+        `literal` is a substring every matching line must contain, derived from the regex if not given.
+    """
+
+    def __init__(self, regex: str, on_match, literal: str = None, filters: dict = None):
+        self.entries = (action_entry(regex, on_match, literal, filters),)
+        self.name = self.entries[0].name
 
     def check(self, input: str):
-        match = re.search(self.regex, input)
-        if match and self.enabled:
-            return match, self.on_match
+        entry = self.entries[0]
+        if entry.enabled:
+            match = entry.regex.search(input)
+            if match:
+                return match, entry.on_match
 
         return None
     
@@ -74,75 +119,668 @@ class multi_regex_action:
         This is mostly used to ensure a specific order of tests for some regexes.
     """
 
-    def __init__(self, regexes: list[str], on_match: list[Callable]):
-        self.regexes = regexes
-        self.match_list = on_match
-        self.enabled = [True for _ in on_match]
-    
-    def get_enabled(self, name):
-        for action in self.match_list:
-            if action.__name__ == name:
-                return self.enabled[self.match_list.index(action)]
-    
-    def enable(self, name):
-        for action in self.match_list:
-            if action.__name__ == name or name == None:
-                self.enabled[self.match_list.index(action)] = True
-    
-    def disable(self, name):
-        for action in self.match_list:
-            if action.__name__ == name or name == None:
-                self.enabled[self.match_list.index(action)] = False
+    def __init__(self, regexes: list[str], on_match: list[Callable], literals: list[str] = None, filters: list[dict] = None):
+        literals = literals if literals else [None for _ in on_match]
+        filters = filters if filters else [None for _ in on_match]
+        self.entries = tuple(
+            action_entry(regex, callback, literal, filter)
+            for regex, callback, literal, filter in zip(regexes, on_match, literals, filters)
+        )
+        self.name = "+".join(entry.name for entry in self.entries)
 
     def check(self, input: str):
-        for regex in self.regexes:
-            match = re.search(regex, input)
-            if match and self.enabled[self.regexes.index(regex)]:
-                return match, self.match_list[self.regexes.index(regex)]
+        for entry in self.entries:
+            if entry.enabled:
+                match = entry.regex.search(input)
+                if match:
+                    return match, entry.on_match
         
         return None
 
+def make_filters(filters: dict):
+    """
+        Turn {"level": "INFO", "thread": ["Server thread", "main"]} into a tuple of (field, allowed values),
+        which is quicker to check for every line.
+    """
+    if not filters:
+        return ()
+
+    result = []
+    for field, allowed in filters.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Cannot filter log lines on '{field}', only on {', '.join(FILTER_FIELDS)}.")
+        result.append((field, frozenset((allowed,) if isinstance(allowed, str) or allowed is None else allowed)))
+    return tuple(result)
+
+def compile_regex(pattern: str, backend: str):
+    """
+        Compile a regex with the backend from config.webhook["regex_backend"], returning the compiled regex and the
+        name of the engine used. re is used for anything re2 cannot compile (ie: backreferences and lookarounds).
+    """
+    if re2 and (backend == "re2" or (backend == "auto" and backtracking_risk(pattern))):
+        try:
+            return re2.compile(pattern), "re2"
+        except re2.error as e:
+            LOG.warning(f"re2 cannot compile '{pattern}' ({e}), using re for it.")
+    return re.compile(pattern), "re"
+
+
+def guarded_search(guard: RegexGuard, index: int, regex):
+    """Make a search function that runs `regex` in `guard`'s worker process first, and only here if it matched there."""
+    def search(input: str):
+        if guard.search(index, input):
+            return regex.search(input)
+        return None
+    return search
+
+
+def backtracking_risk(regex: str):
+    """
+        Look for nested unbounded repeats, ie: "(\\w+\\s?)*", which can take exponential time on lines that almost match.
+        Returns a description of the problem, or None if none was found.
+    """
+    try:
+        parsed = sre_parse.parse(regex)
+    except re.error:
+        return None
+
+    def walk(items, outer):
+        for op, av in items:
+            if op in REPEATS:
+                unbounded = av[1] == sre_parse.MAXREPEAT
+                if unbounded and outer:
+                    return "has an unbounded repeat inside of another one"
+                found = walk(av[2], outer or unbounded)
+            elif op is sre_parse.SUBPATTERN:
+                found = walk(av[3], outer)
+            elif op is sre_parse.BRANCH:
+                found = next(filter(None, (walk(branch, outer) for branch in av[1])), None)
+            elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+                found = walk(av[1], outer)
+            else:
+                found = None
+            if found:
+                return found
+        return None
+
+    return walk(parsed, False)
+
+
+def is_anchored(regex: str):
+    """Whether a regex can only match at the start of the input, by starting with a ^ that applies to all of it."""
+    if not regex.startswith("^"):
+        return False
+
+    try:
+        parsed = sre_parse.parse(regex)
+    except re.error:
+        return False
+
+    # A regex like "^a|b" starts with ^, but the ^ only applies to the first branch.
+    return not parsed.state.flags & re.MULTILINE and len(parsed) > 0 and parsed[0] == (sre_parse.AT, sre_parse.AT_BEGINNING)
+
+
+def required_literals(regex: str):
+    """
+        Find the runs of literal text that every match of a regex has to contain.
+        For example, "<(\\w+)> joined the game" gives ["<", "> joined the game"].
+    """
+    try:
+        parsed = sre_parse.parse(regex)
+    except re.error:
+        return []
+    if parsed.state.flags & re.IGNORECASE:
+        return []
+
+    runs = []
+    current = []
+
+    def end_run():
+        if current:
+            runs.append("".join(current))
+            current.clear()
+
+    def walk(items):
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                current.append(chr(av))
+            elif op is sre_parse.SUBPATTERN and not av[1] & re.IGNORECASE:
+                walk(av[3])
+            elif op in REPEATS and av[0] >= 1:
+                # The contents are required, but may be repeated, so they cannot join the text around them.
+                end_run()
+                walk(av[2])
+                end_run()
+            else:
+                end_run()
+
+    walk(parsed)
+    end_run()
+    return runs
+
+
+def pick_literal(literals: list, others: list):
+    """Pick the literal which is best at telling lines apart: the one found in the fewest other regexes, then the longest."""
+    if not literals:
+        return None
+    return min(literals, key=lambda literal: (sum(any(literal in other for other in other_literals) for other_literals in others), -len(literal)))
+
+
+class combined_matcher:
+    """
+        Checks an input string against a list of regexes in a single pass.
+
+        Every regex has a literal that a line needs to contain to match it,
+        either given in config.webhook["regex_literals"] or derived from the
+        regex. If a line contains none of them, it is thrown out without
+        running any regex, and a regex is not run on a line without its own
+        literal.
+
+        All of the regexes are also joined into one alternation, with a named
+        group around each of them, so lines that make it past the literals but
+        match nothing are thrown out with one search instead of one per regex.
+        When the alternation does match, the regexes before the one that
+        matched are still tried in order, so the first regex in the list that
+        matches always wins, exactly like checking them one by one.
+
+        Entries with filters are only run on lines whose parsed prefix passes
+        them. A line without a parsed prefix never passes a filter.
+
+        If any of the regexes is compiled with re2, the line ending is removed
+        before matching, since re2's $ does not match before a final newline.
+        The alternation is then only built if every regex is compiled with
+        re2, so a regex moved to re2 to avoid backtracking does not end up in
+        an alternation compiled with re. For the same reason, regexes run in
+        the `guard`'s worker process are left out of the alternation. They are
+        still tried in their place in the order when the alternation matches,
+        and on their own when it does not.
+    """
+
+    def __init__(self, entries: list, combine: bool = True, guard: RegexGuard = None):
+        derived = [required_literals(entry.pattern) for entry in entries]
+        literals = [
+            entry.literal if entry.literal else pick_literal(derived[i], derived[:i] + derived[i + 1:])
+            for i, entry in enumerate(entries)
+        ]
+
+        # Plain tuples are the fastest to unpack in the per-line loop.
+        self.regexes = [
+            (guarded_search(guard, entry.guarded, entry.regex) if entry.guarded is not None else entry.regex.search, literal, entry)
+            for entry, literal in zip(entries, literals)
+        ]
+        # The guarded regexes, which are all that can match when the alternation does not.
+        self.guarded = [regex for regex in self.regexes if regex[2].guarded is not None]
+
+        # Lines thrown out before any regex ran. Added to each entry's statistics when the matcher is replaced.
+        self.dropped = 0
+
+        # The regex which matched the alternation may be filtered out, so the ones after it have to be tried too.
+        self.filtered = any(entry.filters for entry in entries)
+
+        # Set by check_timed() to the (entry, seconds) of every regex which took longer than the budget.
+        # The entry is None for the alternation.
+        self.overruns = []
+
+        self.strip = any(entry.engine == "re2" for entry in entries)
+
+        self.prefilter = None
+        if entries and all(literals):
+            self.prefilter = re.compile("|".join(re.escape(literal) for literal in sorted(set(literals), key=len, reverse=True)))
+
+        self.combined = None
+        # Numbered by their place in the list, since that is what a match of the alternation is used for.
+        regexes = [(i, entry.pattern) for i, entry in enumerate(entries) if entry.guarded is None]
+        if not regexes or not combine:
+            return
+
+        engines = set(entries[i].engine for i, _ in regexes)
+        if engines == {"re", "re2"}:
+            LOG.info("Regexes use both re and re2, checking regexes one by one.")
+            return
+
+        if self.guarded:
+            LOG.info("Leaving the regexes checked in a separate process out of the combined regex.")
+
+        # Backreferences are numbered by group, and the groups of every regex are renumbered when joined.
+        if any(BACKREFERENCE.search(regex) for _, regex in regexes):
+            LOG.info("A regex uses backreferences, checking regexes one by one.")
+            return
+
+        # Regexes anchored to the start of the line go into their own group, which is anchored as a whole so
+        # the search does not try every position of the line. The alternation's order does not matter here,
+        # since any regex that matches is a valid upper bound for the first one that does.
+        anchored = [f"(?P<_{i}>{regex[1:]})" for i, regex in regexes if is_anchored(regex)]
+        unanchored = [f"(?P<_{i}>{regex})" for i, regex in regexes if not is_anchored(regex)]
+        if anchored:
+            unanchored.insert(0, "^(?:" + "|".join(anchored) + ")")
+
+        pattern = "|".join(unanchored)
+        try:
+            self.combined = re2.compile(pattern) if engines == {"re2"} else re.compile(pattern)
+        except REGEX_ERRORS as e:
+            LOG.info(f"Regexes cannot be combined ({e}), checking regexes one by one.")
+
+    def check(self, input: str, line: LogLine = None):
+        if self.strip:
+            input = input.rstrip("\r\n")
+
+        if self.prefilter and not self.prefilter.search(input):
+            self.dropped += 1
+            return None
+
+        regexes = self.regexes
+        if self.combined:
+            match = self.combined.search(input)
+            if not match:
+                if not self.guarded:
+                    return None
+                regexes = self.guarded
+
+            # Only the regexes up to the one which matched can be the first to match.
+            elif not self.filtered:
+                regexes = regexes[:int(match.lastgroup[1:]) + 1]
+
+        for search, literal, entry in regexes:
+            if literal and literal not in input:
+                entry.skipped += 1
+                continue
+
+            if entry.filters and not (line and entry.accepts(line)):
+                continue
+
+            match = search(input)
+            if match:
+                entry.hits += 1
+                entry.recent_hits += 1
+                return match, entry.on_match
+
+        return None
+
+    def check_timed(self, input: str, line: LogLine, budget: float):
+        """The same as check(), but noting every regex that took longer than `budget` seconds in `overruns`."""
+        clock = time.perf_counter
+        if self.strip:
+            input = input.rstrip("\r\n")
+
+        if self.prefilter and not self.prefilter.search(input):
+            self.dropped += 1
+            return None
+
+        regexes = self.regexes
+        if self.combined:
+            start = clock()
+            match = self.combined.search(input)
+            elapsed = clock() - start
+            if elapsed > budget:
+                self.overruns.append((None, elapsed))
+            if not match:
+                if not self.guarded:
+                    return None
+                regexes = self.guarded
+            elif not self.filtered:
+                regexes = regexes[:int(match.lastgroup[1:]) + 1]
+
+        for search, literal, entry in regexes:
+            if literal and literal not in input:
+                entry.skipped += 1
+                continue
+
+            if entry.filters and not (line and entry.accepts(line)):
+                continue
+
+            start = clock()
+            match = search(input)
+            elapsed = clock() - start
+            if elapsed > budget:
+                self.overruns.append((entry, elapsed))
+
+            if match:
+                entry.hits += 1
+                entry.recent_hits += 1
+                return match, entry.on_match
+
+        return None
+
+    def check_profiled(self, input: str, line: LogLine, totals: dict, budget: float):
+        """The same as check_timed(), but timing every step. Kept separate so check() has no overhead when not profiling."""
+        clock = time.perf_counter
+        totals["lines"] += 1
+        if self.strip:
+            input = input.rstrip("\r\n")
+
+        if self.prefilter:
+            start = clock()
+            found = self.prefilter.search(input)
+            totals["prefilter_time"] += clock() - start
+            if not found:
+                self.dropped += 1
+                return None
+
+        regexes = self.regexes
+        if self.combined:
+            start = clock()
+            match = self.combined.search(input)
+            elapsed = clock() - start
+            totals["combined_time"] += elapsed
+            if budget and elapsed > budget:
+                self.overruns.append((None, elapsed))
+            if not match:
+                if not self.guarded:
+                    return None
+                regexes = self.guarded
+            elif not self.filtered:
+                regexes = regexes[:int(match.lastgroup[1:]) + 1]
+
+        for search, literal, entry in regexes:
+            if literal and literal not in input:
+                entry.skipped += 1
+                continue
+
+            if entry.filters and not (line and entry.accepts(line)):
+                continue
+
+            start = clock()
+            match = search(input)
+            elapsed = clock() - start
+
+            entry.tested += 1
+            entry.match_time += elapsed
+            if elapsed > entry.worst_match_time:
+                entry.worst_match_time = elapsed
+            if budget and elapsed > budget:
+                self.overruns.append((entry, elapsed))
+
+            if match:
+                entry.matches += 1
+                entry.hits += 1
+                entry.recent_hits += 1
+                return match, entry.on_match
+
+        return None
+
+
 class action_list:
     """
         Holds a list of regex_actions and checks them all for matches given an input string.
         Grants the ability to dynamically enable and/or disable actions.
+
+        Actions are indexed by name, so enabling, disabling and looking them up
+        does not need to search through every action.
+
+        If `adaptive` is set, the actions are reordered every so often (see
+        reorder()) so the ones which match most often are checked first. A
+        multi_regex_action is moved as a whole, so the order inside of it is
+        kept.
+
+        Player chat ends up in the lines being matched, so a regex which can
+        backtrack catastrophically could be made to hang the bot. `backend`
+        picks the regex engine, see compile_regex(). With a `time_budget` (in
+        seconds), the regexes which look like they can backtrack badly (see
+        backtracking_risk()) but are still on re are run in a separate
+        process (see regex_guard.RegexGuard), which is stopped once it goes
+        over the budget. Every other regex is only timed. Either way, a regex
+        which goes over the budget on `strikes` lines within `strike_window`
+        seconds (or ever, if it is 0) is quarantined: it is not checked
+        anymore until the action is enabled again. Overruns older than the
+        window are forgotten, so the odd pause of the whole bot (ie: the host
+        being busy) does not add up to a quarantine over weeks. If the
+        combined regex goes over the budget on `strikes` lines, the regexes
+        are checked one by one from then on, so the slow one can be found.
+
+        `message_only` says the regexes are written to be matched against only
+        the message of each line (see log_line.LogLine), which is left up to
+        whatever passes the lines in.
     """
     
-    def __init__(self, actions: list):
+    def __init__(self, actions: list, adaptive: bool = False, backend: str = "re", time_budget: float = 0, strikes: int = 1, message_only: bool = False, strike_window: float = 0):
         self.all_actions = actions
+        self.adaptive = adaptive
+        self.message_only = message_only
+        self.time_budget = time_budget
+        self.strikes = strikes
+        self.strike_window = strike_window
+        self.entries = {entry.name: entry for action in actions for entry in action.entries}
+        self._matcher = None # Built on the first check after the enabled actions change.
+        self.combine = True # Cleared if the combined regex goes over the time budget.
+        self.combined_overruns = collections.deque()
+        self.profiling = False
+        self.reset_profile()
+
+        if backend != "re" and not re2:
+            LOG.warning(f"Regex backend '{backend}' needs re2 (pip install google-re2), which is not installed. Using re.")
+        guarded = []
+        for entry in self.entries.values():
+            if backend != "re":
+                entry.regex, entry.engine = compile_regex(entry.pattern, backend)
+            risk = backtracking_risk(entry.pattern)
+            if risk and entry.engine == "re":
+                if time_budget:
+                    LOG.warning(
+                        f"The regex for '{entry.name}' {risk}, so some lines may take very long to check. "
+                        f"It is checked in a separate process, which is stopped after {time_budget * 1000:.0f}ms: {entry.pattern}"
+                    )
+                    entry.guarded = len(guarded)
+                    guarded.append(entry.pattern)
+                else:
+                    LOG.warning(
+                        f"The regex for '{entry.name}' {risk}, so some lines may take very long to check, "
+                        f"and nothing stops it since regex_time_budget is 0: {entry.pattern}"
+                    )
+        self.guard = None
+        if guarded:
+            # Started now rather than while checking a line. If it fails, the guarded regexes are quarantined in _get_matcher().
+            self.guard = RegexGuard(guarded, time_budget)
+            self.guard.start()
+
+    def _get_matcher(self):
+        if self._matcher is None:
+            entries = [entry for action in self.all_actions for entry in action.entries if entry.enabled and not entry.quarantined]
+
+            # Without the worker process (ie: it was stopped by close()), the guarded regexes cannot be stopped.
+            if self.guard and any(entry.guarded is not None for entry in entries) and not self.guard.start():
+                for entry in entries:
+                    if entry.guarded is not None:
+                        LOG.error(f"Quarantined the regex for '{entry.name}', it cannot be checked in a separate process: {entry.pattern}")
+                        entry.quarantined = True
+                entries = [entry for entry in entries if not entry.quarantined]
+
+            self._matcher = combined_matcher(entries, self.combine, self.guard)
+        return self._matcher
+
+    # Deal with the regexes which went over the time budget on the last line checked.
+    def _handle_overruns(self, input: str):
+        overruns = self._matcher.overruns
+        self._matcher.overruns = []
+        changed = False
+        for entry, elapsed in overruns:
+            if entry is None:
+                LOG.warning(f"The combined regex took {elapsed * 1000:.0f}ms on a line: {input[:200]!r}")
+                if self._strike(self.combined_overruns) and self.combine:
+                    LOG.warning("Checking the regexes one by one from now on, to find the slow one.")
+                    self.combine = False
+                    changed = True
+            else:
+                LOG.warning(f"The regex for '{entry.name}' took {elapsed * 1000:.0f}ms on a line: {input[:200]!r}")
+                if self._strike(entry.overruns):
+                    LOG.error(f"Quarantined the regex for '{entry.name}', it is not checked until the action is enabled again: {entry.pattern}")
+                    entry.quarantined = True
+                    changed = True
+        if changed:
+            self._reset_matcher()
+
+    # Note an overrun in `overruns`, forgetting the ones outside of the strike window. Returns whether that makes enough strikes.
+    def _strike(self, overruns: collections.deque):
+        now = time.monotonic()
+        overruns.append(now)
+        if self.strike_window:
+            while now - overruns[0] > self.strike_window:
+                overruns.popleft()
+        return len(overruns) >= self.strikes
+
+    # Stop the worker process of the guarded regexes, if there is one. It is started again if the actions are used after all.
+    def close(self):
+        if self.guard:
+            self.guard.close()
+            # So the next check starts the worker in _get_matcher(), not in the middle of a timed search.
+            self._reset_matcher()
+
+    # Get the names of the quarantined actions.
+    def quarantined(self):
+        return [name for name, entry in self.entries.items() if entry.quarantined]
+
+    def _reset_matcher(self):
+        if self._matcher:
+            for _, _, entry in self._matcher.regexes:
+                entry.skipped += self._matcher.dropped
+        self._matcher = None
+
+    # Get how many lines each action's regex was not run on thanks to the literal prefilter.
+    def prefilter_saved(self):
+        saved = {name: entry.skipped for name, entry in self.entries.items()}
+        if self._matcher:
+            for _, _, entry in self._matcher.regexes:
+                saved[entry.name] += self._matcher.dropped
+        return saved
+
+    # Reorder the actions by how often they matched recently, most often first.
+    # Older hits count for half as much every time this is done, so the order follows changes in traffic.
+    def reorder(self):
+        for entry in self.entries.values():
+            entry.score = entry.score / 2 + entry.recent_hits
+            entry.recent_hits = 0
+
+        if not self.adaptive:
+            return
+
+        # sorted() is stable, so actions which match equally often keep their order.
+        order = sorted(self.all_actions, key=lambda action: sum(entry.score for entry in action.entries), reverse=True)
+        if order != self.all_actions:
+            LOG.debug(f"Reordered actions: {[action.name for action in order]}")
+            self.all_actions = order
+            self._reset_matcher()
+
+    # Start or stop collecting timings for every action.
+    def set_profiling(self, profiling: bool):
+        if profiling and not self.profiling:
+            self.profile_started = time.time()
+        self.profiling = profiling
+
+    def reset_profile(self):
+        self.profile_totals = dict(lines=0, prefilter_time=0.0, combined_time=0.0)
+        self.profile_started = time.time()
+        for entry in self.entries.values():
+            entry.reset_profile()
+
+    # Record how long running an action's function took.
+    def record_handler(self, name: str, elapsed: float):
+        entry = self.entries.get(name)
+        if entry:
+            entry.handler_calls += 1
+            entry.handler_time += elapsed
+            if elapsed > entry.worst_handler_time:
+                entry.worst_handler_time = elapsed
+
+    # Get the profile as a JSON-friendly dict.
+    def profile(self):
+        return dict(
+            profiling=self.profiling,
+            started=self.profile_started,
+            duration=time.time() - self.profile_started,
+            totals=dict(self.profile_totals),
+            actions={name: entry.profile() for name, entry in self.entries.items()},
+        )
+
+    # Describe the profile, slowest actions first.
+    def describe_profile(self):
+        totals = self.profile_totals
+        lines = [
+            f"Profiling {'on' if self.profiling else 'off'}, {totals['lines']} lines over {time.time() - self.profile_started:.0f}s. "
+            f"Prefilter {totals['prefilter_time'] * 1000:.1f}ms, combined regex {totals['combined_time'] * 1000:.1f}ms.",
+            "action: tested, matches, match total/worst, handler calls, handler total/worst",
+        ]
+        for entry in sorted(self.entries.values(), key=lambda entry: entry.match_time + entry.handler_time, reverse=True):
+            lines.append(
+                f"{entry.name}: {entry.tested}, {entry.matches}, "
+                f"{entry.match_time * 1000:.1f}ms/{entry.worst_match_time * 1e6:.0f}us, "
+                f"{entry.handler_calls}, {entry.handler_time * 1000:.1f}ms/{entry.worst_handler_time * 1000:.1f}ms"
+            )
+        return "\n".join(lines)
+
+    # Describe the actions, in the order they are checked, with their statistics.
+    def describe(self):
+        lines = [f"Actions, in the order they are checked (adaptive ordering {'on' if self.adaptive else 'off'}):"]
+        saved = self.prefilter_saved()
+        for i, action in enumerate(self.all_actions):
+            for j, entry in enumerate(action.entries):
+                prefix = f"{i + 1}." if j == 0 else " " * len(f"{i + 1}.")
+                state = self.get_state(entry.name)
+                engine = entry.engine + (", guarded" if entry.guarded is not None else "")
+                lines.append(
+                    f"{prefix} {entry.name} ({state}, {engine}): "
+                    f"{entry.hits} hits, {entry.score:.1f} recent, {saved[entry.name]} lines skipped by prefilter"
+                )
+        return "\n".join(lines)
     
+    # Whether any action is filtered on the log line's prefix, so lines have to be parsed before checking them.
+    def needs_parsed_lines(self):
+        return any(entry.filters for entry in self.entries.values())
+
     # Find the first action that matches the input string, return it and the match.
-    def check(self, input: str):
-        for action in self.all_actions:
-            match = action.check(input)
-            if match:
-                LOG.debug(f"Got match ({match[0][0]})!")
-                return match[0], match[1] # Return the match, and the function to run.
+    # `line` is the parsed log line, which is needed for actions that are filtered on its prefix.
+    def check(self, input: str, line: LogLine = None):
+        if self.profiling:
+            match = self._get_matcher().check_profiled(input, line, self.profile_totals, self.time_budget)
+        elif self.time_budget:
+            match = self._get_matcher().check_timed(input, line, self.time_budget)
+        else:
+            match = self._get_matcher().check(input, line)
+        if self._matcher.overruns:
+            self._handle_overruns(input)
+        if match:
+            LOG.debug(f"Got match ({match[0][0]})!")
+            return match[0], match[1] # Return the match, and the function to run.
         
         return None # Just here so we can note that if it fails it returns nothing.
 
+    # Whether an action is enabled, and not quarantined.
     def get_enabled(self, name: str):
-        for action in self.all_actions:
-            enabled = action.get_enabled(name)
-            if type(enabled) == bool:
-                return enabled
+        entry = self.entries.get(name)
+        if entry:
+            return entry.enabled and not entry.quarantined
+
+    # Get "enabled", "disabled" or "quarantined" for an action.
+    def get_state(self, name: str):
+        entry = self.entries.get(name)
+        if entry:
+            return "quarantined" if entry.quarantined else "enabled" if entry.enabled else "disabled"
+
+    def _set_enabled(self, entry: action_entry, enabled: bool):
+        if entry.enabled != enabled:
+            entry.enabled = enabled
+            self._reset_matcher()
     
-    # Enable an action by name.
+    # Enable an action by name. This also lets a quarantined regex be checked again.
     def enable_action(self, name: str):
-        for action in self.all_actions:
-            action.enable(name)
+        entry = self.entries.get(name)
+        if entry:
+            if entry.quarantined:
+                entry.quarantined = False
+                entry.overruns.clear()
+                self._reset_matcher()
+            self._set_enabled(entry, True)
     
     # Disable an action by name.
     def disable_action(self, name: str):
-        for action in self.all_actions:
-            action.disable(name)
+        entry = self.entries.get(name)
+        if entry:
+            self._set_enabled(entry, False)
     
     # Enable all actions.
     def enable_all(self):
-        for action in self.all_actions:
-            action.enable()
+        for name in self.entries:
+            self.enable_action(name)
     
     # Disable all actions.
     def disable_all(self):
-        for action in self.all_actions:
-            action.disable()
\ No newline at end of file
+        for entry in self.entries.values():
+            self._set_enabled(entry, False)
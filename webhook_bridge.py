@@ -1,50 +1,269 @@
 import discord
 import aiohttp
+import asyncio
+import time
+import os
 import logging
 
+from webhook_spool import Spool
+from avatar_cache import AvatarCache, UserCache, MISSING
+from uuid_lookup import UuidLookup
+from webhook_scheduler import WebhookPool, PRIORITY_STATE, PRIORITY_CHAT, PRIORITY_EVENTS
 import config
 
 LOG = logging.getLogger("WEBHOOK_BRIDGE")
 
+# Mentions allowed in messages sent through the webhook.
+NO_EVERYONE = discord.AllowedMentions(everyone=False).to_dict()
+
+def make_session():
+    """
+        Create the HTTP session shared by the webhooks and the avatar lookups,
+        which keeps connections open between requests (up to the limits in
+        config.webhook) instead of connecting again for every one.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=config.webhook["http_connection_limit"],
+        limit_per_host=config.webhook["http_connection_limit_per_host"],
+        keepalive_timeout=config.webhook["http_keepalive_timeout"],
+        ttl_dns_cache=config.webhook["http_dns_cache_time"],
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=config.webhook["http_timeout"],
+        connect=config.webhook["http_connect_timeout"],
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+class _ChatBurst:
+    """Chat messages from one player, waiting to be sent as a single post."""
+    __slots__ = ("started", "avatar_url", "lines", "length", "timer")
+
+    def __init__(self, avatar_url:str):
+        self.started = time.monotonic()
+        self.avatar_url = avatar_url
+        self.lines = []
+        self.length = 0
+        self.timer = None
+
+class _EventStorm:
+    """Players who joined (or left, etc.) since the last embed about it, waiting to be sent as one embed."""
+    __slots__ = ("names", "timer")
+
+    def __init__(self):
+        self.names = []
+        self.timer = None
+
+# The embed for each kind of event which can be aggregated: colour, and the description for a list of players.
+EVENT_EMBEDS = dict(
+    player_join = (0x00ff00, ":inbox_tray: {players} joined the game."),
+    player_leave = (0xff0000, ":outbox_tray: {players} left the game."),
+    player_not_whitelisted = (0xff0000, ":no_entry: {players} tried to join but {are} not whitelisted. If this is you or a friend, run the /whitelist command to add them."),
+)
+
 class Bridge:
-    """A simple class which holds some methods for interacting with the webhook."""
-    def __init__(self, webhook:discord.Webhook):
-        self.webhook = webhook
-        self.username_cache = dict()
+    """
+        A simple class which holds some methods for interacting with the webhook.
+        Messages are queued on a WebhookPool, which sends them in order of priority within the rate limits,
+        spread over the webhooks if there are several.
+
+        If config.webhook["chat_coalesce_window"] is set, chat messages from a
+        player are held for that long, and any more messages from them in the
+        meantime are added to the same post on new lines. The post is sent
+        once they have not said anything for the window, once the first
+        message has waited chat_coalesce_max_latency, or before it would go
+        over chat_coalesce_max_length. Replies (which have an embed) are not
+        merged, but anything held for that player is sent before them.
+
+        Joins, leaves and players who are not whitelisted can be aggregated
+        too, per config.webhook["event_aggregation_windows"]. The first one
+        is sent straight away, then any more of the same kind within the
+        window are collected and sent as one embed when it ends, after which
+        another window starts. The window ends once one passes with nothing
+        in it, so the next event is sent straight away again.
+    """
+    def __init__(self, session:aiohttp.ClientSession, url):
+        self.session = session
+        self.scheduler = WebhookPool(
+            session,
+            url,
+            config.webhook["rate_limits"],
+            config.webhook["channel_rate_limits"],
+            config.webhook["max_backlog"],
+            config.webhook["max_send_attempts"],
+            config.webhook["webhook_failure_threshold"],
+            config.webhook["webhook_failover_cooldown"],
+            Spool(
+                config.webhook["spool_location"],
+                config.webhook["spool_flush_interval"],
+                config.webhook["spool_segment_size"],
+            ) if config.webhook["spool_location"] else None,
+        )
+        self.avatar_cache = AvatarCache(
+            config.icons["avatar_cache_location"],
+            config.icons["avatar_cache_size"],
+            config.icons["avatar_cache_ttl"],
+            config.icons["avatar_cache_negative_ttl"],
+        )
+        self.user_cache = UserCache(os.path.join(config.server["root"], "usercache.json")) if config.icons["use_usercache"] else None
+        self.uuid_lookup = UuidLookup(
+            session,
+            self.avatar_cache,
+            config.icons["uuid_lookup_url"],
+            config.icons["uuid_bulk_lookup_url"],
+            config.icons["uuid_lookup_batch_window"],
+        )
+
+        self.coalesce_window = config.webhook["chat_coalesce_window"]
+        self.coalesce_max_latency = config.webhook["chat_coalesce_max_latency"]
+        self.coalesce_max_length = config.webhook["chat_coalesce_max_length"]
+        self._bursts = dict() # Username -> _ChatBurst
+
+        self.aggregation_windows = config.webhook["event_aggregation_windows"]
+        self.aggregation_max_names = config.webhook["event_aggregation_max_names"]
+        self._storms = dict() # Event -> _EventStorm
+
+        # Statistics, see report().
+        self.chat_messages = 0
+        self.chat_posts = 0
+        self.events = 0
+        self.event_posts = 0
+
+    def start(self):
+        self.scheduler.start()
+
+    async def close(self, timeout:float=0):
+        for username in list(self._bursts):
+            self.__flush(username)
+        for event in list(self._storms):
+            storm = self._storms.pop(event)
+            storm.timer.cancel()
+            if storm.names:
+                self.__send_event_embed(event, storm.names)
+        await self.scheduler.close(timeout)
+        await self.uuid_lookup.close()
+        self.avatar_cache.save(force=True)
+
+    def report(self):
+        saved = self.chat_messages - self.chat_posts
+        aggregated = self.events - self.event_posts
+        return self.scheduler.report() + (
+            f" Chat: {self.chat_messages} messages in {self.chat_posts} posts, {saved} posts saved by coalescing."
+            f" Joins/leaves: {self.events} events in {self.event_posts} posts, {aggregated} posts saved by aggregating."
+            f" {self.avatar_cache.report()} {self.uuid_lookup.report()}"
+            + (f" {self.user_cache.report()}" if self.user_cache else "")
+        )
+
+    # Queue a message on the webhook.
+    def __send(self, priority:int, username:str, avatar_url:str, message="", embed=None, allowed_mentions=None):
+        payload = dict(username=username)
+        if avatar_url:
+            payload["avatar_url"] = avatar_url
+        if message:
+            payload["content"] = message
+        if embed:
+            payload["embeds"] = [embed.to_dict()]
+        if allowed_mentions:
+            payload["allowed_mentions"] = allowed_mentions
+        self.scheduler.send(priority, payload)
 
     # Send a message from the console.
     async def __send_console_message(self, message, embed=None):
-        await self.webhook.send(content=message, embed=embed, username="Console", avatar_url=config.icons["console"])
+        self.__send(PRIORITY_CHAT, "Console", config.icons["console"], message, embed)
+
+    # Get the UUID of a player without asking Mojang, or MISSING if it has to be looked up.
+    def __known_uuid(self, username:str):
+        # Players who have joined recently are in the server's usercache.
+        uuid = self.user_cache.get(username) if self.user_cache else None
+        return uuid if uuid else self.avatar_cache.get(username)
+
+    # Start looking up a player's UUID in the background, so it is ready by the time they say something.
+    def prefetch_avatar(self, username:str):
+        if self.__known_uuid(username) is MISSING:
+            self.uuid_lookup.lookup(username, urgent=False)
 
     # Send a message which is "from" a player.
     async def __send_player_message(self, username:str, message="", embed=None):
-        avatar_url = None
-
-        # If we haven't already cached their avatar icon, grab the icon.
-        if username not in self.username_cache:
-            # get the UUID of the player
-            LOG.info(f"Attempt to cache username: {username}")
-            async with aiohttp.ClientSession() as session:
-                async with session.get(config.icons["uuid_lookup_url"] + username) as response:
-                    if response.status == 200:
-                        uuid_json = await response.json()
-                        LOG.info(f"200. UUID: {uuid_json['id']}")
-                        LOG.info(f"Avatar url: {config.icons['avatar_lookup_url'] + uuid_json['id']}" + ".png?size=128&default=MHF_Steve")
-                        self.username_cache[username] = config.icons["avatar_lookup_url"] + uuid_json["id"] + ".png?size=128&default=MHF_Steve"
-                        avatar_url = self.username_cache[username]
-                    else:
-                        LOG.warn(f"Failed to cache username: {username}")
-        else:
-            # If it is cached, just use that.
-            avatar_url = self.username_cache[username]
-
-        # If it is not cached and fails to get the avatar url, it will just pass an empty url to it.
-
-        await self.webhook.send(content=message, embed=embed, username=username, avatar_url=avatar_url, allowed_mentions=discord.AllowedMentions(everyone=False))
+        # If we haven't already cached their UUID, look it up.
+        uuid = self.__known_uuid(username)
+        if uuid is MISSING:
+            uuid = await self.uuid_lookup.lookup(username)
+
+        # If it fails to get the UUID, it will just pass an empty url to it.
+        avatar_url = config.icons["avatar_lookup_url"] + uuid + ".png?size=128&default=MHF_Steve" if uuid else None
+
+        self.chat_messages += 1
+        if not self.coalesce_window or embed or len(message) >= self.coalesce_max_length:
+            self.__flush(username)
+            self.chat_posts += 1
+            self.__send(PRIORITY_CHAT, username, avatar_url, message, embed, NO_EVERYONE)
+            return
+
+        burst = self._bursts.get(username)
+        if burst and (burst.length + 1 + len(message) > self.coalesce_max_length or burst.avatar_url != avatar_url):
+            self.__flush(username)
+            burst = None
+        if not burst:
+            burst = self._bursts[username] = _ChatBurst(avatar_url)
+
+        burst.lines.append(message)
+        burst.length += len(message) + (1 if burst.length else 0)
+
+        # Send once they stop talking for the window, but never hold the first message longer than the max latency.
+        if burst.timer:
+            burst.timer.cancel()
+        delay = min(self.coalesce_window, burst.started + self.coalesce_max_latency - time.monotonic())
+        burst.timer = asyncio.get_running_loop().call_later(max(delay, 0), self.__flush, username)
+
+    # Send the chat messages held for a player, if there are any.
+    def __flush(self, username:str):
+        burst = self._bursts.pop(username, None)
+        if not burst:
+            return
+        if burst.timer:
+            burst.timer.cancel()
+        self.chat_posts += 1
+        self.__send(PRIORITY_CHAT, username, burst.avatar_url, "\n".join(burst.lines), None, NO_EVERYONE)
     
+    # Send an embed about a join/leave storm, or a single join or leave.
+    def __send_event_embed(self, event:str, usernames:list):
+        color, description = EVENT_EMBEDS[event]
+        names = [f"**{username}**" for username in usernames[:self.aggregation_max_names]]
+        others = len(usernames) - len(names)
+        if others:
+            names.append(f"{others} other{'s' if others > 1 else ''}")
+        players = names[0] if len(names) == 1 else ", ".join(names[:-1]) + " and " + names[-1]
+
+        embed = discord.Embed(color=color, description=description.format(players=players, are="is" if len(usernames) == 1 else "are"))
+        self.event_posts += 1
+        self.__send(PRIORITY_EVENTS, config.webhook["server_name"], config.icons["minecraft"], "", embed, NO_EVERYONE)
+
+    # Send a join/leave straight away if it is the first in a while, otherwise collect it into the next summary.
+    def __aggregate_event(self, event:str, username:str):
+        self.events += 1
+        window = self.aggregation_windows.get(event, 0)
+        storm = self._storms.get(event)
+        if not window or not storm:
+            self.__send_event_embed(event, [username])
+            if window:
+                storm = self._storms[event] = _EventStorm()
+                storm.timer = asyncio.get_running_loop().call_later(window, self.__end_window, event)
+            return
+
+        storm.names.append(username)
+
+    def __end_window(self, event:str):
+        storm = self._storms[event]
+        if not storm.names:
+            del self._storms[event]
+            return
+
+        self.__send_event_embed(event, storm.names)
+        storm.names = []
+        storm.timer = asyncio.get_running_loop().call_later(self.aggregation_windows[event], self.__end_window, event)
+
     # Send a message to Discord "from" the server.
-    async def __send_server_message(self, message="", embed=None):
-        await self.webhook.send(content=message, embed=embed, username=config.webhook["server_name"], avatar_url = config.icons["minecraft"], allowed_mentions=discord.AllowedMentions(everyone=False))
+    async def __send_server_message(self, message="", embed=None, priority=PRIORITY_EVENTS):
+        self.__send(priority, config.webhook["server_name"], config.icons["minecraft"], message, embed, NO_EVERYONE)
     
     # Send a player chat to Discord.
     async def on_player_message_noreply(self, username:str, message:str):
@@ -58,39 +277,35 @@ class Bridge:
 
     # Send a player join event to Discord.
     async def on_player_join(self, username:str):
-        embed = discord.Embed(color=0x00ff00, description=f":inbox_tray: **{username}** joined the game.")
-
-        await self.__send_server_message(embed=embed)
+        self.__aggregate_event("player_join", username)
 
     # Send a player leave event to Discord.
     async def on_player_leave(self, username:str):
-        embed = discord.Embed(color=0xff0000, description=f":outbox_tray: **{username}** left the game.")
-
-        await self.__send_server_message(embed=embed)
+        self.__aggregate_event("player_leave", username)
     
     # Send a server starting event to Discord.
     async def on_server_starting(self):
         embed = discord.Embed(color=0xccdd00, description=":yellow_circle: **The server is starting up...**")
 
-        await self.__send_server_message(embed=embed)
+        await self.__send_server_message(embed=embed, priority=PRIORITY_STATE)
     
     # Send a server starting event to Discord.
     async def on_server_started(self):
         embed = discord.Embed(color=0x55dd55, description=":green_circle: **The server has started.**")
 
-        await self.__send_server_message(embed=embed)
+        await self.__send_server_message(embed=embed, priority=PRIORITY_STATE)
     
     # Send a server starting event to Discord.
     async def on_server_stopping(self):
         embed = discord.Embed(color=0xdd5555, description=":red_circle: **The server has closed.**")
 
-        await self.__send_server_message(embed=embed)
+        await self.__send_server_message(embed=embed, priority=PRIORITY_STATE)
 
     # Send a server list event to Discord.
     async def on_server_list(self, current:str, max:str, players:str):
         embed = discord.Embed(color=0xb800b5, description=f":information_source: **There are {current}/{max} players online: {players}**")
 
-        await self.__send_server_message(embed=embed)
+        await self.__send_server_message(embed=embed, priority=PRIORITY_STATE)
 
     # Send a console message event to Discord.
     async def on_console_message(self, message:str):
@@ -104,7 +319,5 @@ class Bridge:
 
     # Send a notification when a player tries to join and is not whitelisted.
     async def on_player_not_whitelisted(self, username:str):
-        embed = discord.Embed(color=0xff0000, description=f":no_entry: **{username}** tried to join but is not whitelisted. If this is you or a friend, run the /whitelist command to add them.")
-
-        await self.__send_server_message(embed=embed)
+        self.__aggregate_event("player_not_whitelisted", username)
     
@@ -0,0 +1,413 @@
+from __future__ import annotations
+import asyncio
+import collections
+import time
+import logging
+
+import aiohttp
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Callable
+    from webhook_spool import Spool
+
+LOG = logging.getLogger("WEBHOOK_SCHEDULER")
+
+# Priority classes, most important first.
+PRIORITY_STATE = 0 # Server starting/started/stopping and the player list.
+PRIORITY_CHAT = 1 # Player chat and console messages.
+PRIORITY_EVENTS = 2 # Joins, leaves, advancements and the like.
+PRIORITY_NAMES = ("state", "chat", "events")
+
+# How long to wait before retrying a message that failed for a reason other than a rate limit, doubled every attempt.
+RETRY_DELAY = 1.0
+
+# Statuses which mean the webhook itself is broken (deleted, or its token changed), rather than the message.
+WEBHOOK_GONE = (401, 403, 404)
+
+
+class TokenBucket:
+    """Allows `capacity` sends per `period` seconds, refilling continuously."""
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def delay(self):
+        """How long until a send is allowed."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class WebhookScheduler:
+    """
+        Sends messages to a single webhook, without running into its rate limits.
+
+        Messages are queued by priority class and sent one at a time, the
+        oldest message of the most important class first. Sends are spread
+        out by token buckets set up from `rate_limits` ((sends, seconds)
+        pairs), and paused until the bucket resets whenever Discord's
+        X-RateLimit headers say none are left, so a burst gets paced instead
+        of running into 429s. If one happens anyway (ie: the limit is shared
+        with something else), the message goes back to the front of its
+        queue and is retried once Discord says it may be.
+
+        send() only queues the message, it does not wait for it to be sent.
+        At most `max_backlog` messages wait at once, after that the oldest
+        message of the least important class is dropped.
+
+        `shared_buckets` are TokenBuckets which are also used by other
+        schedulers, for limits on the channel rather than the webhook.
+        `on_failure` is called with the scheduler every time a send fails
+        because Discord could not be reached or the webhook is broken.
+        `on_settled` is called with the scheduler, the message's job and
+        whether it is worth trying again later, once the scheduler is done
+        with a message: it was sent, refused, dropped or given up on.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, url: str, rate_limits: tuple = ((5, 2),), max_backlog: int = 500, max_attempts: int = 5, shared_buckets: list = (), on_failure: Callable = None, on_settled: Callable = None):
+        self.session = session
+        self.url = url
+        self.buckets = [TokenBucket(capacity, period) for capacity, period in rate_limits] + list(shared_buckets)
+        self.on_failure = on_failure
+        self.on_settled = on_settled
+        self.failures = 0 # Failed sends in a row.
+        self.failed_at = 0.0
+        self.max_backlog = max_backlog
+        self.max_attempts = max_attempts
+
+        self._queues = [collections.deque() for _ in PRIORITY_NAMES]
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.blocked_until = 0.0 # time.monotonic() until which Discord said not to send anything.
+
+        # Statistics, see report().
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rate_limited = 0
+        self.waited = 0.0 # Time spent waiting for the rate limits.
+        self._latency_total = [0.0 for _ in PRIORITY_NAMES]
+        self._latency_max = [0.0 for _ in PRIORITY_NAMES]
+        self._latency_count = [0 for _ in PRIORITY_NAMES]
+
+    @property
+    def backlog(self):
+        return sum(len(queue) for queue in self._queues)
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    def send(self, priority: int, payload: dict, ticket=None):
+        """
+            Queue a webhook payload (the JSON body for Discord's Execute Webhook) to be sent.
+            The ticket is kept with it for on_settled (ie: its id in the spool).
+        """
+        if self.backlog >= self.max_backlog:
+            queue = next(queue for queue in reversed(self._queues) if queue)
+            self._settle(queue.popleft(), True)
+            self.dropped += 1
+            LOG.debug("Webhook backlog is full, dropped the oldest, least important message.")
+
+        self._queues[priority].append([time.monotonic(), payload, 0, ticket])
+        self._wakeup.set()
+
+    def _settle(self, job: list, retry_later: bool):
+        if self.on_settled:
+            self.on_settled(self, job, retry_later)
+
+    def _next(self):
+        for priority, queue in enumerate(self._queues):
+            if queue:
+                return priority, queue
+        return None, None
+
+    def _delay(self):
+        delay = self.blocked_until - time.monotonic()
+        for bucket in self.buckets:
+            delay = max(delay, bucket.delay())
+        return delay
+
+    async def _run(self):
+        while True:
+            priority, queue = self._next()
+            if queue is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Wait for the rate limits, then look again, since something more important may have been queued.
+            delay = self._delay()
+            if delay > 0:
+                self.waited += delay
+                await asyncio.sleep(delay)
+                continue
+
+            job = queue.popleft()
+            for bucket in self.buckets:
+                bucket.take()
+            try:
+                await self._post(priority, job)
+            except Exception as e:
+                # Anything unexpected (ie: the spool failing to write an ack) must not stop the webhook for good.
+                self.failed += 1
+                LOG.error("Unexpected error while sending a webhook message, settling it and carrying on.")
+                LOG.exception(e)
+                try:
+                    self._settle(job, False)
+                except Exception as e:
+                    LOG.exception(e)
+
+    async def _post(self, priority: int, job: list):
+        queued_at, payload, attempts, ticket = job
+        job[2] += 1
+        try:
+            async with self.session.post(self.url, params={"wait": "true"}, json=payload) as response:
+                self._read_limits(response)
+
+                if response.status == 429:
+                    self.rate_limited += 1
+                    try:
+                        retry_after = float((await response.json()).get("retry_after", 1))
+                    except (aiohttp.ContentTypeError, ValueError, TypeError, AttributeError):
+                        retry_after = float(response.headers.get("Retry-After", 1))
+                    LOG.warning(f"Webhook rate limited, retrying in {retry_after:.2f}s.")
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                    self._queues[priority].appendleft(job)
+                    return
+
+                if response.status >= 500 or response.status in WEBHOOK_GONE:
+                    raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status)
+
+                if response.status >= 400:
+                    # Something is wrong with the message itself, sending it again will not help.
+                    self.failed += 1
+                    LOG.error(f"Webhook refused a message ({response.status}): {(await response.text())[:200]}")
+                    self._settle(job, False)
+                    return
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.failures += 1
+            self.failed_at = time.monotonic()
+            if job[2] >= self.max_attempts:
+                self.failed += 1
+                LOG.error(f"Giving up on a webhook message after {job[2]} attempts: {e!r}")
+                self._settle(job, True)
+            else:
+                delay = RETRY_DELAY * 2 ** (job[2] - 1)
+                LOG.warning(f"Failed to send a webhook message ({e!r}), retrying in {delay:.0f}s.")
+                self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+                self._queues[priority].appendleft(job)
+            if self.on_failure:
+                self.on_failure(self)
+            return
+
+        self.failures = 0
+        self.sent += 1
+        self._settle(job, False)
+        latency = time.monotonic() - queued_at
+        self._latency_total[priority] += latency
+        self._latency_count[priority] += 1
+        if latency > self._latency_max[priority]:
+            self._latency_max[priority] = latency
+
+    def _read_limits(self, response: aiohttp.ClientResponse):
+        # Stop before Discord has to say no: once a bucket is used up, wait for it to reset.
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset_after = response.headers.get("X-RateLimit-Reset-After")
+        if remaining is not None and reset_after is not None:
+            try:
+                if int(remaining) == 0:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + float(reset_after))
+            except ValueError:
+                pass
+
+    def take_backlog(self):
+        """Remove every queued message, returning them as (priority, job) pairs in the order they would have been sent."""
+        jobs = []
+        for priority, queue in enumerate(self._queues):
+            jobs.extend((priority, job) for job in queue)
+            queue.clear()
+        return jobs
+
+    def adopt(self, priority: int, job: list):
+        """Queue a message taken from another scheduler, keeping when it was first queued and its attempts."""
+        self._queues[priority].append(job)
+        self._wakeup.set()
+
+    async def close(self, timeout: float = 0):
+        """Stop sending, after giving the queued messages up to `timeout` seconds to be sent."""
+        if self._task and timeout:
+            deadline = time.monotonic() + timeout
+            while self.backlog and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            if self.backlog:
+                LOG.warning(f"Gave up on {self.backlog} queued webhook messages.")
+
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def report(self):
+        """Return a summary of the webhook's activity, with the latencies since the last report."""
+        latencies = []
+        for priority, name in enumerate(PRIORITY_NAMES):
+            count = self._latency_count[priority]
+            if count:
+                latencies.append(f"{name} avg {self._latency_total[priority] / count * 1000:.0f}ms max {self._latency_max[priority] * 1000:.0f}ms")
+            self._latency_total[priority] = 0.0
+            self._latency_max[priority] = 0.0
+            self._latency_count[priority] = 0
+
+        return (
+            f"Webhook: {self.sent} sent, {self.failed} failed, {self.dropped} dropped, {self.rate_limited} rate limited, "
+            f"{self.waited:.1f}s spent pacing in total, backlog {self.backlog}. "
+            f"Queue to sent latency: {', '.join(latencies) or 'nothing sent'}."
+        )
+
+
+class WebhookPool:
+    """
+        Spreads messages over several webhooks for the same channel, each with
+        its own WebhookScheduler, to get past the rate limit of one webhook.
+
+        Messages are routed by the name they are sent under, so everything a
+        player (or the server, or the console) says goes through the same
+        webhook and arrives in order. `channel_rate_limits` are shared by all
+        the webhooks, since Discord limits the channel as well.
+
+        After `failure_threshold` failed sends in a row, a webhook is skipped
+        for `cooldown` seconds, and the messages waiting on it are moved to
+        the next webhook that is working, keeping their order. Once the
+        cooldown is over it gets messages again, and is skipped again straight
+        away if the next one fails as well.
+
+        With a Spool, every message is written to it when it is queued and
+        acked only once it is sent (or refused by Discord, since sending it
+        again would not help). Messages left in it are queued again by
+        start(). Ones given up on because Discord could not be reached, or
+        pushed out of a full backlog, stay in it and are queued again after
+        the next successful send, as far as there is room in the backlog.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, urls: list, rate_limits: tuple = ((5, 2),), channel_rate_limits: tuple = (), max_backlog: int = 500, max_attempts: int = 5, failure_threshold: int = 3, cooldown: float = 60, spool: Spool = None):
+        if isinstance(urls, str):
+            urls = [urls]
+        if not urls:
+            raise ValueError("The webhook pool needs at least one url.")
+
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        shared = [TokenBucket(capacity, period) for capacity, period in channel_rate_limits]
+        self.schedulers = [
+            WebhookScheduler(session, url, rate_limits, max_backlog, max_attempts, shared, self._on_failure, self._on_settled)
+            for url in urls
+        ]
+        self.spool = spool
+        # (spool id, time first queued) of the messages given up on, or pushed out of a full backlog, waiting for room.
+        # Their payloads are only kept in the spool, so an outage costs no more memory than max_backlog allows.
+        self._parked = collections.deque()
+        self.failovers = 0 # Messages moved off a failing webhook.
+
+    @property
+    def backlog(self):
+        return sum(scheduler.backlog for scheduler in self.schedulers)
+
+    def start(self):
+        if self.spool:
+            try:
+                messages = self.spool.load()
+            except OSError as e:
+                LOG.error(f"Cannot use the webhook spool, messages will not be kept on disk: {e}")
+                self.spool = None
+
+        if self.spool:
+            now = time.monotonic()
+            for id, priority, payload in messages:
+                self._route(payload.get("username")).adopt(priority, [now, payload, 0, id])
+            self.spool.start()
+
+        for scheduler in self.schedulers:
+            scheduler.start()
+
+    def healthy(self, scheduler: WebhookScheduler):
+        return scheduler.failures < self.failure_threshold or time.monotonic() - scheduler.failed_at >= self.cooldown
+
+    def _route(self, key: str, skip: WebhookScheduler = None):
+        # The webhook for the key, or the next working one after it. If none are working, the webhook for the key.
+        start = hash(key) % len(self.schedulers)
+        for i in range(len(self.schedulers)):
+            scheduler = self.schedulers[(start + i) % len(self.schedulers)]
+            if scheduler is not skip and self.healthy(scheduler):
+                return scheduler
+        return self.schedulers[start]
+
+    def send(self, priority: int, payload: dict):
+        """Queue a webhook payload on the webhook for its username."""
+        ticket = self.spool.append(priority, payload) if self.spool else None
+        self._route(payload.get("username")).send(priority, payload, ticket)
+
+    def _on_settled(self, scheduler: WebhookScheduler, job: list, retry_later: bool):
+        ticket = job[3]
+        if ticket is None:
+            return
+
+        if retry_later:
+            self._parked.append((ticket, job[0]))
+            return
+
+        self.spool.ack(ticket)
+        if self._parked and scheduler.failures == 0:
+            # Discord is working, queue the parked messages again, without pushing anything else out of the backlog.
+            retried = 0
+            while self._parked:
+                id, queued_at = self._parked[0]
+                entry = self.spool.pending.get(id)
+                if entry is None:
+                    self._parked.popleft() # Acked in the meantime.
+                    continue
+
+                _, priority, payload = entry
+                target = self._route(payload.get("username"))
+                if target.backlog >= target.max_backlog:
+                    break
+                self._parked.popleft()
+                target.adopt(priority, [queued_at, payload, 0, id])
+                retried += 1
+            if retried:
+                LOG.info(f"Retrying {retried} spooled messages, {len(self._parked)} still waiting.")
+
+    def _on_failure(self, scheduler: WebhookScheduler):
+        if len(self.schedulers) == 1 or scheduler.failures < self.failure_threshold:
+            return
+
+        jobs = scheduler.take_backlog()
+        LOG.warning(f"Webhook {self.schedulers.index(scheduler) + 1} failed {scheduler.failures} times in a row, moving {len(jobs)} queued messages to the others for {self.cooldown:.0f}s.")
+        for priority, job in jobs:
+            self._route(job[1].get("username"), skip=scheduler).adopt(priority, job)
+        self.failovers += len(jobs)
+
+    async def close(self, timeout: float = 0):
+        """Stop sending, after giving the queued messages up to `timeout` seconds to be sent."""
+        await asyncio.gather(*(scheduler.close(timeout) for scheduler in self.schedulers))
+        if self.spool:
+            await self.spool.close()
+
+    def report(self):
+        """Return a summary of each webhook's activity, with the latencies since the last report."""
+        spool = f" {self.spool.report()}" if self.spool else ""
+        if len(self.schedulers) == 1:
+            return self.schedulers[0].report() + spool
+
+        reports = [
+            f"[{i + 1}{'' if self.healthy(scheduler) else ', failing'}] {scheduler.report()}"
+            for i, scheduler in enumerate(self.schedulers)
+        ]
+        return f"{len(self.schedulers)} webhooks, {self.failovers} messages failed over. " + " ".join(reports) + spool
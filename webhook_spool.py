@@ -0,0 +1,232 @@
+from __future__ import annotations
+import asyncio
+import glob
+import json
+import os
+import time
+import logging
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # Not available on Windows, where the spool directory is not locked.
+
+LOG = logging.getLogger("WEBHOOK_SPOOL")
+
+SEGMENT_NAME = "spool-{:08d}.log"
+
+# Kept locked by the spool using the directory, see Spool.load().
+LOCK_NAME = "lock"
+
+
+class Spool:
+    """
+        Keeps every outgoing webhook message on disk until it has been
+        delivered, so the ones still waiting when the bot stops (or crashes)
+        are sent when it starts again.
+
+        The spool is a directory of append-only segment files, with one JSON
+        record per line: a message when it is queued, and an ack (just its
+        id) once it is finished with. Writes are buffered, and a background
+        task flushes and fsyncs them every `flush_interval` seconds, so one
+        fsync covers every message queued in that time. A message queued less
+        than `flush_interval` before a crash may be lost.
+
+        Once the current segment is bigger than `segment_size` a new one is
+        started. Segments are deleted oldest first once every message in them
+        has been acked (acks only ever refer to the same or an older segment,
+        so this never forgets an ack). If more than `max_segments` are kept
+        alive by a few old messages, those are copied to the current segment
+        so the old one can go.
+
+        Messages are delivered at least once: one which was sent but not yet
+        acked when the bot stopped is sent again.
+
+        Only one spool may use a directory at a time (ie: not both the old
+        and the new cog while it is reloaded, which would send the messages
+        in flight twice), so load() locks it until close().
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 0.05, segment_size: int = 1024 * 1024, max_segments: int = 8):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+
+        self.pending = dict() # Id -> (segment, priority, payload), in the order they were queued.
+        self._live = dict() # Segment -> messages in it which are not acked yet.
+        self._segment = 0
+        self._file = None
+        self._size = 0
+        self._dirty = False
+        self._next_id = 0
+        self._task = None
+        self._sync = None # The fsync running in a thread, if there is one.
+        self._lock = None
+
+        # Statistics, see report().
+        self.appended = 0
+        self.acked = 0
+        self.fsyncs = 0
+        self.fsync_time = 0.0
+        self.compacted = 0
+
+    def _path(self, segment: int):
+        return os.path.join(self.directory, SEGMENT_NAME.format(segment))
+
+    def load(self):
+        """
+            Read the spool, returning the messages which were never acked as (id, priority, payload), oldest first.
+            Raises an OSError if another spool is using the directory.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if fcntl:
+            self._lock = open(os.path.join(self.directory, LOCK_NAME), "a")
+            try:
+                fcntl.flock(self._lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock.close()
+                self._lock = None
+                raise OSError(f"{self.directory} is in use by another spool")
+
+        records = dict()
+        acked = set()
+        segments = sorted(glob.glob(os.path.join(glob.escape(self.directory), SEGMENT_NAME.replace("{:08d}", "*"))))
+        for path in segments:
+            segment = int(os.path.basename(path)[6:-4])
+            self._live[segment] = 0
+            self._segment = segment
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The end of a write which was cut short by a crash.
+                        LOG.warning(f"Skipping a damaged record in {path}.")
+                        continue
+                    if "ack" in record:
+                        acked.add(record["ack"])
+                    else:
+                        records[record["id"]] = (segment, record["priority"], record["payload"])
+
+        # Ids which only appear in acks (their messages were compacted away) must not be used again either.
+        ids = records.keys() | acked
+        if ids:
+            self._next_id = max(ids) + 1
+        for id in sorted(records):
+            if id not in acked:
+                segment, priority, payload = records[id]
+                self.pending[id] = records[id]
+                self._live[segment] += 1
+
+        # Never append to an old segment, its last line may be cut short.
+        self._open(self._segment + 1 if segments else 0)
+        if self.pending:
+            LOG.info(f"Found {len(self.pending)} webhook messages which were never sent, sending them now.")
+        return [(id, priority, payload) for id, (_, priority, payload) in self.pending.items()]
+
+    def _open(self, segment: int):
+        if self._file:
+            self._file.close()
+        self._segment = segment
+        self._live.setdefault(segment, 0)
+        self._file = open(self._path(segment), "ab")
+        self._size = self._file.tell()
+
+    def _write(self, record: dict):
+        data = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        self._file.write(data)
+        self._size += len(data)
+        self._dirty = True
+
+    def append(self, priority: int, payload: dict):
+        """Add a message to the spool, returning its id."""
+        id = self._next_id
+        self._next_id += 1
+        self._write(dict(id=id, priority=priority, payload=payload))
+        self.pending[id] = (self._segment, priority, payload)
+        self._live[self._segment] += 1
+        self.appended += 1
+        return id
+
+    def ack(self, id: int):
+        """Mark a message as finished with, so it is not sent again."""
+        entry = self.pending.pop(id, None)
+        if entry is None:
+            return
+        self._write(dict(ack=id))
+        self._live[entry[0]] -= 1
+        self.acked += 1
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._dirty:
+                self._dirty = False
+                start = time.perf_counter()
+                await self._fsync()
+                self.fsync_time += time.perf_counter() - start
+                self.fsyncs += 1
+
+            # Only roll over between fsyncs, so the file is never closed under one.
+            if self._size >= self.segment_size:
+                self._open(self._segment + 1)
+            await self._compact()
+
+    async def _fsync(self):
+        self._file.flush()
+        # Shielded, so close() can wait for it to finish before closing the file.
+        self._sync = asyncio.ensure_future(asyncio.to_thread(os.fsync, self._file.fileno()))
+        await asyncio.shield(self._sync)
+
+    async def _compact(self):
+        segments = sorted(self._live)
+        if len(segments) > self.max_segments and self._live[segments[0]]:
+            # Copy the few messages keeping the oldest segment alive to the current one.
+            oldest = segments[0]
+            for id, (segment, priority, payload) in list(self.pending.items()):
+                if segment == oldest:
+                    self._write(dict(id=id, priority=priority, payload=payload))
+                    self.pending[id] = (self._segment, priority, payload)
+                    self._live[self._segment] += 1
+                    self._live[oldest] -= 1
+            # The copies have to be on disk before the originals go.
+            await self._fsync()
+
+        for segment in segments:
+            if segment == self._segment or self._live[segment]:
+                break
+            try:
+                os.remove(self._path(segment))
+            except FileNotFoundError:
+                pass
+            del self._live[segment]
+            self.compacted += 1
+
+    async def close(self):
+        """Stop the background task, and get everything written so far onto the disk."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._sync and not self._sync.done():
+            await asyncio.wait([self._sync])
+        self._sync = None # The fsync running in a thread, if there is one.
+        if self._file:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        if self._lock:
+            self._lock.close() # Which unlocks it.
+            self._lock = None
+
+    def report(self):
+        """Return a summary of the spool's activity."""
+        average = self.fsync_time / self.fsyncs * 1000 if self.fsyncs else 0.0
+        return (
+            f"Spool: {len(self.pending)} waiting in {len(self._live)} segments, {self.appended} queued, {self.acked} acked, "
+            f"{self.fsyncs} fsyncs (avg {average:.1f}ms), {self.compacted} segments removed."
+        )